@@ -3,6 +3,15 @@ require('dotenv').config();
 
 const FASTAPI_URL = process.env.FASTAPI_URL || 'http://localhost:8000';
 
+// Transform a prediction to match our expected format
+function toVerificationResult(data) {
+    return {
+        isAuthentic: !data.is_fake,
+        confidence: data.confidence * 100,
+        details: data.model_details
+    };
+}
+
 async function verifyMedicineWithFastAPI(imageBuffer) {
     try {
         // Convert buffer to form data
@@ -16,18 +25,64 @@ async function verifyMedicineWithFastAPI(imageBuffer) {
             },
         });
 
-        // Transform the response to match our expected format
-        return {
-            isAuthentic: !response.data.is_fake,
-            confidence: response.data.confidence * 100,
-            details: response.data.model_details
-        };
+        return toVerificationResult(response.data);
     } catch (error) {
         console.error('Error calling FastAPI:', error);
         throw new Error('Failed to verify medicine');
     }
 }
 
+// Verify many images in one request. `images` is a list of buffers or
+// { buffer, filename } objects; results come back in input order and are
+// passed to `onResult` as soon as each NDJSON line arrives.
+async function verifyMedicinesBatchWithFastAPI(images, onResult) {
+    try {
+        const formData = new FormData();
+        images.forEach((image, i) => {
+            const buffer = image.buffer || image;
+            const filename = image.filename || `medicine_${i}.jpg`;
+            formData.append('files', new Blob([buffer]), filename);
+        });
+
+        const response = await axios.post(`${FASTAPI_URL}/predict/batch`, formData, {
+            headers: {
+                'Content-Type': 'multipart/form-data',
+            },
+            responseType: 'stream',
+        });
+
+        const results = [];
+        const handleLine = (line) => {
+            if (!line.trim()) {
+                return;
+            }
+            const data = JSON.parse(line);
+            const result = data.error
+                ? { index: data.index, filename: data.filename, error: data.error }
+                : { index: data.index, filename: data.filename, ...toVerificationResult(data) };
+            results.push(result);
+            if (onResult) {
+                onResult(result);
+            }
+        };
+
+        let pending = '';
+        for await (const chunk of response.data) {
+            pending += chunk.toString();
+            const lines = pending.split('\n');
+            pending = lines.pop();
+            lines.forEach(handleLine);
+        }
+        handleLine(pending);
+
+        return results;
+    } catch (error) {
+        console.error('Error calling FastAPI batch endpoint:', error);
+        throw new Error('Failed to verify medicines');
+    }
+}
+
 module.exports = {
-    verifyMedicineWithFastAPI
-}; 
\ No newline at end of file
+    verifyMedicineWithFastAPI,
+    verifyMedicinesBatchWithFastAPI
+};
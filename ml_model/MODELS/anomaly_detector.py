@@ -1,252 +1,565 @@
+import os
+import time
 import torch
 import torch.nn as nn
 import numpy as np
-from sklearn.cluster import KMeans
-from sklearn.metrics import silhouette_score, precision_recall_curve, average_precision_score
-import matplotlib.pyplot as plt
-from resnet_extractor import extract_embeddings
+from knn_index import IVFIndex
+
+# sklearn.cluster, sklearn.metrics, matplotlib and the embedding store are
+# imported where they are used so that serving does not pay for them
+
+def classification_metrics(labels, predictions):
+    """Precision, recall, F1 and accuracy for binary labels (1 = fake); 0.0 where undefined"""
+    labels = np.asarray(labels).astype(bool)
+    predictions = np.asarray(predictions).astype(bool)
+    tp = int(np.sum(predictions & labels))
+    fp = int(np.sum(predictions & ~labels))
+    fn = int(np.sum(~predictions & labels))
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    accuracy = float(np.mean(predictions == labels)) if len(labels) else 0.0
+    return {"precision": precision, "recall": recall, "f1": f1, "accuracy": accuracy}
+
+def _linear_stack(dims):
+    layers = []
+    for i, (d_in, d_out) in enumerate(zip(dims[:-1], dims[1:])):
+        layers.append(nn.Linear(d_in, d_out))
+        if i < len(dims) - 2:
+            layers += [nn.BatchNorm1d(d_out), nn.ReLU(), nn.Dropout(0.2)]
+    return nn.Sequential(*layers)
+
+class AutoEncoder(nn.Module):
+    """Dense autoencoder; hidden_dims run from the input to the bottleneck and the decoder mirrors them"""
+
+    def __init__(self, input_dim=512, hidden_dims=(256, 128, 64)):
+        super().__init__()
+        hidden_dims = list(hidden_dims)
+        self.encoder = _linear_stack([input_dim] + hidden_dims)
+        self.decoder = _linear_stack(hidden_dims[::-1] + [input_dim])
+        
+    def forward(self, x):
+        z = self.encoder(x)
+        return self.decoder(z)
+
+class ScoreAccumulator:
+    """
+    Running histogram and confusion counts of anomaly scores, per label
+    (rows: real, fake, unlabelled), for evaluating in chunks.
+    """
+    
+    def __init__(self, threshold, bins=200, score_range=(0.0, 1.0)):
+        low, high = score_range
+        if not high > low:
+            high = low + 1.0
+        self.threshold = float(threshold)
+        self.edges = np.linspace(low, high, bins + 1)
+        self.histogram = np.zeros((3, bins), dtype=np.int64)
+        self.confusion = np.zeros((2, 2), dtype=np.int64)  # [label, prediction]
+        self.stats = None
+        self.min = np.inf
+        self.max = -np.inf
+    
+    def update(self, scores, labels=None):
+        scores = np.asarray(scores, dtype=np.float64)
+        if len(scores) == 0:
+            return
+        bins = len(self.edges) - 1
+        idx = np.clip(np.searchsorted(self.edges, scores, side='right') - 1, 0, bins - 1)
+        if labels is None:
+            self.histogram[2] += np.bincount(idx, minlength=bins)
+        else:
+            labels = np.asarray(labels).astype(bool)
+            self.histogram[0] += np.bincount(idx[~labels], minlength=bins)
+            self.histogram[1] += np.bincount(idx[labels], minlength=bins)
+            predictions = scores > self.threshold
+            self.confusion += np.bincount(labels * 2 + predictions, minlength=4).reshape(2, 2)
+        self.stats = _merge_stats(self.stats, scores)
+        self.min = min(self.min, float(scores.min()))
+        self.max = max(self.max, float(scores.max()))
+    
+    def threshold_metrics(self):
+        """Precision, recall and F1 for predicting fake above each bin edge except the last"""
+        # Samples in bins at or above edge i count as predicted fake
+        above = np.cumsum(self.histogram[:2, ::-1], axis=1)[:, ::-1]
+        tp, fp = above[1].astype(np.float64), above[0].astype(np.float64)
+        fn = self.histogram[1].sum() - tp
+        with np.errstate(divide='ignore', invalid='ignore'):
+            precision = np.where(tp + fp > 0, tp / (tp + fp), 0.0)
+            recall = np.where(tp + fn > 0, tp / (tp + fn), 0.0)
+            f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+        return {"thresholds": self.edges[:-1], "precision": precision, "recall": recall, "f1": f1}
+    
+    def report(self):
+        stats = self.stats or {"count": 0, "mean": 0.0, "m2": 0.0}
+        report = {
+            "count": stats["count"],
+            "threshold": self.threshold,
+            "score_mean": stats["mean"],
+            "score_std": float(np.sqrt(stats["m2"] / stats["count"])) if stats["count"] else 0.0,
+            "score_min": self.min if stats["count"] else None,
+            "score_max": self.max if stats["count"] else None,
+        }
+        if self.confusion.sum():
+            (tn, fp), (fn, tp) = self.confusion
+            report["confusion"] = {"tn": int(tn), "fp": int(fp), "fn": int(fn), "tp": int(tp)}
+            report["metrics"] = {
+                "precision": tp / (tp + fp) if tp + fp else 0.0,
+                "recall": tp / (tp + fn) if tp + fn else 0.0,
+                "accuracy": (tp + tn) / self.confusion.sum(),
+            }
+            precision, recall = report["metrics"]["precision"], report["metrics"]["recall"]
+            report["metrics"]["f1"] = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+            report["metrics"] = {k: float(v) for k, v in report["metrics"].items()}
+            
+            grid = self.threshold_metrics()
+            best = int(np.argmax(grid["f1"]))
+            report["best_threshold"] = {"threshold": float(grid["thresholds"][best]),
+                                        **{k: float(grid[k][best]) for k in ("precision", "recall", "f1")}}
+            report["threshold_grid"] = {k: v.tolist() for k, v in grid.items()}
+        return report
+
+def _merge_stats(stats, values):
+    """Merge a batch of values into running count/mean/M2 statistics (Chan et al.)"""
+    values = np.asarray(values, dtype=np.float64)
+    n, mean = len(values), float(values.mean()) if len(values) else 0.0
+    m2 = float(np.sum((values - mean) ** 2))
+    if not stats or stats["count"] == 0:
+        return {"count": n, "mean": mean, "m2": m2}
+    total = stats["count"] + n
+    delta = mean - stats["mean"]
+    return {"count": total,
+            "mean": stats["mean"] + delta * n / total,
+            "m2": stats["m2"] + m2 + delta ** 2 * stats["count"] * n / total}
+
+class _EmbeddingBatches(torch.utils.data.Dataset):
+    """Map-style dataset whose items are whole batches, indexed by a list of row numbers"""
+    
+    def __init__(self, X):
+        self.X = X
+    
+    def __len__(self):
+        return len(self.X)
+    
+    def __getitem__(self, indices):
+        # Sorted indices keep reads from a memmap sequential
+        return torch.from_numpy(np.asarray(self.X[np.sort(indices)], dtype=np.float32))
 
 class AnomalyDetector:
-    def __init__(self, method='autoencoder', n_clusters=3):
+    def __init__(self, method='autoencoder', n_clusters=3, n_neighbors=5, hidden_dims=(256, 128, 64)):
         self.method = method
         self.n_clusters = n_clusters
+        self.n_neighbors = n_neighbors
+        self.hidden_dims = tuple(hidden_dims)
         self.kmeans = None
+        self.centroids = None
         self.autoencoder = None
+        self.index = None
         self.threshold = None
         self.best_threshold = None
+        self.calibration = {"scale": 1.0}
+        self.history = []
+        self.cluster_counts = None  # samples absorbed by each centroid (streaming kmeans)
+        self.distance_stats = None  # running count/mean/M2 of nearest-centroid distances
         
     def build_autoencoder(self, input_dim=512):
-        class AutoEncoder(nn.Module):
-            def __init__(self):
-                super().__init__()
-                self.encoder = nn.Sequential(
-                    nn.Linear(input_dim, 256),
-                    nn.BatchNorm1d(256),
-                    nn.ReLU(),
-                    nn.Dropout(0.2),
-                    nn.Linear(256, 128),
-                    nn.BatchNorm1d(128),
-                    nn.ReLU(),
-                    nn.Dropout(0.2),
-                    nn.Linear(128, 64)
-                )
-                self.decoder = nn.Sequential(
-                    nn.Linear(64, 128),
-                    nn.BatchNorm1d(128),
-                    nn.ReLU(),
-                    nn.Dropout(0.2),
-                    nn.Linear(128, 256),
-                    nn.BatchNorm1d(256),
-                    nn.ReLU(),
-                    nn.Dropout(0.2),
-                    nn.Linear(256, input_dim)
-                )
-                
-            def forward(self, x):
-                z = self.encoder(x)
-                return self.decoder(z)
-        
-        return AutoEncoder()
+        return AutoEncoder(input_dim, getattr(self, 'hidden_dims', (256, 128, 64)))
     
     def find_optimal_threshold(self, scores, labels):
+        from sklearn.metrics import precision_recall_curve
+        
         precision, recall, thresholds = precision_recall_curve(labels, scores)
         f1_scores = 2 * (precision * recall) / (precision + recall + 1e-10)
         best_idx = np.argmax(f1_scores)
         return thresholds[best_idx]
     
-    def fit(self, X, validation_X=None, validation_labels=None):
+    def fit(self, X, validation_X=None, validation_labels=None, **train_options):
+        """Fit the detector and its threshold; train_options go to train_autoencoder"""
         if self.method == 'kmeans':
+            from sklearn.cluster import KMeans
+            
             # Fit KMeans
             self.kmeans = KMeans(n_clusters=self.n_clusters, random_state=42)
             self.kmeans.fit(X)
+            self.centroids = self.kmeans.cluster_centers_.astype(np.float32)
             
             # Calculate distances to cluster centers
-            distances = np.min(self.kmeans.transform(X), axis=1)
+            assignments, distances = self.nearest_clusters(X)
+            
+            # Starting point for later partial_fit updates
+            self.cluster_counts = np.bincount(assignments, minlength=len(self.centroids)).astype(np.float64)
+            self.distance_stats = _merge_stats(None, distances)
             
             if validation_X is not None and validation_labels is not None:
-                val_distances = np.min(self.kmeans.transform(validation_X), axis=1)
+                val_distances = self.cluster_distances(validation_X)
                 self.threshold = self.find_optimal_threshold(val_distances, validation_labels)
             else:
                 # Set threshold as mean + 2*std of distances
                 self.threshold = np.mean(distances) + 2 * np.std(distances)
             
-        elif self.method == 'autoencoder':
-            # Initialize and train autoencoder
-            self.autoencoder = self.build_autoencoder(X.shape[1])
-            device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-            self.autoencoder = self.autoencoder.to(device)
+        elif self.method == 'knn':
+            if len(X) <= self.n_neighbors:
+                raise ValueError(f"kNN needs more than n_neighbors={self.n_neighbors} "
+                                 f"genuine embeddings, got {len(X)}")
             
-            # Convert data to tensor
-            X_tensor = torch.FloatTensor(X).to(device)
+            # Index the known-genuine embeddings
+            self.index = IVFIndex(dim=X.shape[1]).add(X)
+            self.index.merge()
             
-            # Training setup
-            criterion = nn.MSELoss()
-            optimizer = torch.optim.Adam(self.autoencoder.parameters(), lr=1e-3, weight_decay=1e-5)
-            scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(optimizer, 'min', patience=5)
+            # Distance to the nearest genuine neighbours, excluding each sample itself
+            distances = self.knn_distances(X, exclude_self=True)
             
-            # Training loop
-            n_epochs = 100
-            batch_size = 32
-            n_batches = len(X) // batch_size
-            best_loss = float('inf')
-            patience = 10
-            patience_counter = 0
+            if validation_X is not None and validation_labels is not None:
+                val_distances = self.knn_distances(validation_X)
+                self.threshold = self.find_optimal_threshold(val_distances, validation_labels)
+            else:
+                # Set threshold as mean + 2*std of distances
+                self.threshold = np.mean(distances) + 2 * np.std(distances)
+            
+        elif self.method == 'autoencoder':
+            self.train_autoencoder(X, **train_options)
             
-            for epoch in range(n_epochs):
-                epoch_loss = 0
+            if validation_X is not None and validation_labels is not None:
+                val_errors = self.reconstruction_errors(validation_X)
+                self.threshold = self.find_optimal_threshold(val_errors, validation_labels)
+            else:
+                # Set threshold as mean + 2*std of reconstruction errors
+                recon_errors = self.reconstruction_errors(X)
+                self.threshold = np.mean(recon_errors) + 2 * np.std(recon_errors)
+    
+    def train_autoencoder(self, X, epochs=100, batch_size=32, lr=1e-3, patience=10,
+                          num_workers=0, num_threads=None, checkpoint_path=None,
+                          checkpoint_every=10, resume=False, random_state=42):
+        """
+        Train the autoencoder on X (an array or memmap of shape (N, D)).
+        
+        Args:
+            epochs (int): Maximum number of epochs; training stops early after
+                `patience` epochs without improvement
+            batch_size (int): Samples per step; larger batches trade a little
+                accuracy for much higher CPU throughput
+            num_workers (int): DataLoader worker processes gathering batches
+            num_threads (int): torch intra-op threads while training (None keeps the current setting)
+            checkpoint_path (str): Save model/optimizer state here every
+                `checkpoint_every` epochs and when training ends
+            resume (bool): Continue from checkpoint_path if it exists
+        
+        Per-epoch loss, learning rate and timing are recorded in self.history.
+        """
+        from torch.utils.data import BatchSampler, DataLoader, RandomSampler
+        
+        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        self.autoencoder = self.build_autoencoder(X.shape[1]).to(device)
+        criterion = nn.MSELoss()
+        optimizer = torch.optim.Adam(self.autoencoder.parameters(), lr=lr, weight_decay=1e-5)
+        scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(optimizer, 'min', patience=5)
+        
+        generator = torch.Generator().manual_seed(random_state)
+        state = {"epoch": 0, "best_loss": float('inf'), "patience_counter": 0, "history": []}
+        if resume and checkpoint_path and os.path.exists(checkpoint_path):
+            checkpoint = torch.load(checkpoint_path, map_location=device, weights_only=False)
+            self.autoencoder.load_state_dict(checkpoint["model"])
+            optimizer.load_state_dict(checkpoint["optimizer"])
+            scheduler.load_state_dict(checkpoint["scheduler"])
+            generator.set_state(checkpoint["generator"])
+            # Dropout draws from the global RNG
+            torch.set_rng_state(checkpoint["torch_rng"])
+            state = checkpoint["state"]
+            print(f"Resuming autoencoder training from epoch {state['epoch']}")
+        self.history = state["history"]
+        
+        # Each loader item is a whole shuffled batch gathered from X with one fancy index
+        sampler = BatchSampler(RandomSampler(range(len(X)), generator=generator), batch_size, drop_last=False)
+        loader = DataLoader(_EmbeddingBatches(X), sampler=sampler, batch_size=None,
+                            num_workers=num_workers, pin_memory=device.type == 'cuda',
+                            persistent_workers=num_workers > 0)
+        
+        previous_threads = torch.get_num_threads()
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        try:
+            for epoch in range(state["epoch"], epochs):
+                start = time.perf_counter()
                 self.autoencoder.train()
-                for i in range(n_batches):
-                    start_idx = i * batch_size
-                    end_idx = start_idx + batch_size
-                    batch = X_tensor[start_idx:end_idx]
-                    
-                    optimizer.zero_grad()
-                    output = self.autoencoder(batch)
-                    loss = criterion(output, batch)
+                epoch_loss = 0.0
+                seen = 0
+                for batch in loader:
+                    # BatchNorm cannot train on a single sample
+                    if len(batch) < 2:
+                        continue
+                    batch = batch.to(device, non_blocking=True)
+                    optimizer.zero_grad(set_to_none=True)
+                    loss = criterion(self.autoencoder(batch), batch)
                     loss.backward()
                     optimizer.step()
-                    
-                    epoch_loss += loss.item()
+                    epoch_loss += loss.item() * len(batch)
+                    seen += len(batch)
                 
-                avg_loss = epoch_loss/n_batches
+                avg_loss = epoch_loss / max(seen, 1)
                 scheduler.step(avg_loss)
+                seconds = time.perf_counter() - start
+                self.history.append({"epoch": epoch + 1, "loss": avg_loss,
+                                     "lr": optimizer.param_groups[0]['lr'], "seconds": seconds,
+                                     "samples_per_s": seen / seconds if seconds > 0 else 0.0})
                 
-                if avg_loss < best_loss:
-                    best_loss = avg_loss
-                    patience_counter = 0
+                if avg_loss < state["best_loss"]:
+                    state["best_loss"] = avg_loss
+                    state["patience_counter"] = 0
                 else:
-                    patience_counter += 1
+                    state["patience_counter"] += 1
+                state["epoch"] = epoch + 1
                 
-                if patience_counter >= patience:
+                stop = state["patience_counter"] >= patience
+                if checkpoint_path and (stop or (epoch + 1) % checkpoint_every == 0 or epoch + 1 == epochs):
+                    self._save_checkpoint(checkpoint_path, optimizer, scheduler, generator, state)
+                
+                if stop:
                     print(f"Early stopping at epoch {epoch+1}")
                     break
                 
                 if (epoch + 1) % 10 == 0:
-                    print(f'Epoch [{epoch+1}/{n_epochs}], Loss: {avg_loss:.4f}')
+                    print(f'Epoch [{epoch+1}/{epochs}], Loss: {avg_loss:.4f}, '
+                          f'{self.history[-1]["samples_per_s"]:.0f} samples/s')
+        finally:
+            torch.set_num_threads(previous_threads)
+        
+        self.autoencoder.eval()
+        return self.history
+    
+    def _save_checkpoint(self, path, optimizer, scheduler, generator, state):
+        tmp_path = path + '.tmp'
+        torch.save({"model": self.autoencoder.state_dict(), "optimizer": optimizer.state_dict(),
+                    "scheduler": scheduler.state_dict(), "generator": generator.get_state(),
+                    "torch_rng": torch.get_rng_state(), "state": state}, tmp_path)
+        os.replace(tmp_path, path)
+    
+    def knn_distances(self, X, exclude_self=False):
+        """
+        Mean distance to the k nearest known-genuine embeddings.
+        
+        The index pads missing neighbours (too few vectors in the probed lists)
+        with inf, so only the neighbours actually found are averaged; a query
+        with none at all gets inf.
+        """
+        k = self.n_neighbors + 1 if exclude_self else self.n_neighbors
+        distances, _ = self.index.search(X, k)
+        if exclude_self:
+            distances = distances[:, 1:]
+        found = np.isfinite(distances)
+        counts = found.sum(axis=1)
+        totals = np.where(found, distances, 0).sum(axis=1)
+        return np.divide(totals, counts, out=np.full(len(distances), np.inf), where=counts > 0)
+    
+    def add_genuine(self, X):
+        """Add newly verified genuine embeddings to the kNN index"""
+        if self.index is None:
+            self.index = IVFIndex(dim=X.shape[1])
+        self.index.add(X)
+    
+    def nearest_clusters(self, X):
+        """Index of and distance to the nearest KMeans centroid for each row of X"""
+        # Detectors pickled before centroids were stored only have the KMeans object
+        centers = getattr(self, 'centroids', None)
+        if centers is None:
+            centers = self.kmeans.cluster_centers_.astype(np.float32)
+        X = np.asarray(X, dtype=np.float32)
+        sq = (np.einsum('ij,ij->i', X, X)[:, None]
+              - 2 * (X @ centers.T)
+              + np.einsum('ij,ij->i', centers, centers)[None, :])
+        nearest = np.argmin(sq, axis=1)
+        return nearest, np.sqrt(np.maximum(sq[np.arange(len(X)), nearest], 0))
+    
+    def cluster_distances(self, X):
+        """Distance from each row of X to its nearest KMeans centroid"""
+        return self.nearest_clusters(X)[1]
+    
+    def partial_fit(self, X, update_threshold=True):
+        """
+        Update the kmeans detector with a new chunk of genuine embeddings.
+        
+        Each centroid moves to the running mean of every sample assigned to
+        it so far (mini-batch / MacQueen updates), and the distance statistics
+        behind the mean + 2*std threshold are merged in online, so the cost is
+        proportional to the chunk, not to everything seen before. The first
+        chunk (at least n_clusters rows) initialises the centroids with KMeans.
+        """
+        if self.method != 'kmeans':
+            raise ValueError("partial_fit is only supported for the kmeans method")
+        X = np.asarray(X, dtype=np.float32)
+        if len(X) == 0:
+            return self
+        
+        if getattr(self, 'centroids', None) is None and self.kmeans is None:
+            from sklearn.cluster import KMeans
             
-            # Calculate reconstruction errors
-            self.autoencoder.eval()
-            with torch.no_grad():
+            if len(X) < self.n_clusters:
+                raise ValueError(f"The first chunk needs at least n_clusters={self.n_clusters} rows")
+            self.kmeans = KMeans(n_clusters=self.n_clusters, random_state=42).fit(X)
+            self.centroids = self.kmeans.cluster_centers_.astype(np.float32)
+            self.cluster_counts = np.zeros(len(self.centroids))
+        elif getattr(self, 'cluster_counts', None) is None:
+            # Fitted before streaming support: treat the current centroids as one sample each
+            if getattr(self, 'centroids', None) is None:
+                self.centroids = self.kmeans.cluster_centers_.astype(np.float32)
+            self.cluster_counts = np.ones(len(self.centroids))
+        
+        assignments, _ = self.nearest_clusters(X)
+        counts = np.bincount(assignments, minlength=len(self.centroids))
+        sums = np.zeros(self.centroids.shape, dtype=np.float64)
+        for cluster in np.flatnonzero(counts):
+            sums[cluster] = X[assignments == cluster].sum(axis=0, dtype=np.float64)
+        
+        updated = counts > 0
+        total = self.cluster_counts[updated] + counts[updated]
+        centroids = np.array(self.centroids, dtype=np.float64)
+        centroids[updated] += (sums[updated] - counts[updated, None] * centroids[updated]) / total[:, None]
+        self.centroids = centroids.astype(np.float32)
+        self.cluster_counts = self.cluster_counts + counts
+        
+        # Distances to the updated centroids feed the running threshold statistics
+        self.distance_stats = _merge_stats(getattr(self, 'distance_stats', None), self.cluster_distances(X))
+        if update_threshold:
+            self.threshold = self.stats_threshold()
+        return self
+    
+    def fit_stream(self, chunks, validation_X=None, validation_labels=None):
+        """
+        Fit (or keep updating) the kmeans detector from an iterable of embedding
+        chunks, e.g. ``(v for _, v in EmbeddingStore(...).iter_vectors())``.
+        """
+        for chunk in chunks:
+            self.partial_fit(chunk, update_threshold=False)
+        if self.distance_stats is None:
+            raise ValueError("No embeddings in stream")
+        
+        if validation_X is not None and validation_labels is not None:
+            self.threshold = self.find_optimal_threshold(self.cluster_distances(validation_X), validation_labels)
+        else:
+            self.threshold = self.stats_threshold()
+        return self
+    
+    def stats_threshold(self, n_std=2.0):
+        """mean + n_std * std of the nearest-centroid distances seen so far"""
+        stats = self.distance_stats
+        std = np.sqrt(stats["m2"] / stats["count"]) if stats["count"] else 0.0
+        return float(stats["mean"] + n_std * std)
+    
+    def reconstruction_errors(self, X, chunk_size=8192):
+        """Mean squared autoencoder reconstruction error for each row of X, in bounded-memory chunks"""
+        device = next(self.autoencoder.parameters()).device
+        self.autoencoder.eval()
+        errors = np.empty(len(X), dtype=np.float32)
+        
+        with torch.inference_mode():
+            for start in range(0, len(X), chunk_size):
+                chunk = np.array(X[start:start + chunk_size], dtype=np.float32)
+                X_tensor = torch.as_tensor(chunk, device=device)
                 X_recon = self.autoencoder(X_tensor)
-                recon_errors = torch.mean((X_tensor - X_recon) ** 2, dim=1).cpu().numpy()
-            
-            if validation_X is not None and validation_labels is not None:
-                val_tensor = torch.FloatTensor(validation_X).to(device)
-                with torch.no_grad():
-                    val_recon = self.autoencoder(val_tensor)
-                    val_errors = torch.mean((val_tensor - val_recon) ** 2, dim=1).cpu().numpy()
-                self.threshold = self.find_optimal_threshold(val_errors, validation_labels)
-            else:
-                # Set threshold as mean + 2*std of reconstruction errors
-                self.threshold = np.mean(recon_errors) + 2 * np.std(recon_errors)
+                errors[start:start + len(chunk)] = torch.mean((X_tensor - X_recon) ** 2, dim=1).cpu().numpy()
+        return errors
     
-    def predict(self, X):
+    def raw_scores(self, X):
+        """Anomaly score for each row of X; higher means more likely fake"""
         if self.method == 'kmeans':
-            # Calculate distances to cluster centers
-            distances = np.min(self.kmeans.transform(X), axis=1)
-            return distances > self.threshold
-            
+            return self.cluster_distances(X)
+        elif self.method == 'knn':
+            return self.knn_distances(X)
         elif self.method == 'autoencoder':
-            # Calculate reconstruction errors
-            device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-            X_tensor = torch.FloatTensor(X).to(device)
-            self.autoencoder.eval()
-            
-            with torch.no_grad():
-                X_recon = self.autoencoder(X_tensor)
-                recon_errors = torch.mean((X_tensor - X_recon) ** 2, dim=1).cpu().numpy()
-            
-            return recon_errors > self.threshold
+            return self.reconstruction_errors(X)
+        raise ValueError(f"Unknown method '{self.method}'")
+    
+    def score(self, X):
+        """
+        Score an (N, D) batch in a single pass.
+        
+        Returns:
+            dict: 'scores' (raw anomaly scores), 'labels' (True for fake) and
+                'probabilities' (closer to 1 means more likely to be real)
+        """
+        scores = self.raw_scores(X)
+        # Convert scores to probabilities (below the threshold means more likely to be real)
+        scale = getattr(self, 'calibration', {}).get("scale", 1.0)
+        margin = np.clip((scores.astype(np.float64) - self.threshold) / scale, -500, 500)
+        return {
+            'scores': scores,
+            'labels': scores > self.threshold,
+            'probabilities': 1 / (1 + np.exp(margin))
+        }
+    
+    def predict(self, X):
+        return self.score(X)['labels']
     
     def predict_proba(self, X):
-        if self.method == 'kmeans':
-            distances = np.min(self.kmeans.transform(X), axis=1)
-            # Convert distances to probabilities (closer to 0 means more likely to be real)
-            probs = 1 / (1 + np.exp(distances - self.threshold))
-            return probs
-            
-        elif self.method == 'autoencoder':
-            device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-            X_tensor = torch.FloatTensor(X).to(device)
-            self.autoencoder.eval()
-            
-            with torch.no_grad():
-                X_recon = self.autoencoder(X_tensor)
-                recon_errors = torch.mean((X_tensor - X_recon) ** 2, dim=1).cpu().numpy()
-            
-            # Convert reconstruction errors to probabilities
-            probs = 1 / (1 + np.exp(recon_errors - self.threshold))
-            return probs
+        return self.score(X)['probabilities']
     
-    def evaluate(self, X, labels=None):
-        if self.method == 'kmeans':
-            # Calculate distances to cluster centers
-            distances = np.min(self.kmeans.transform(X), axis=1)
-            
-            # Plot cluster distances
-            plt.figure(figsize=(10, 5))
-            plt.hist(distances, bins=50)
-            plt.axvline(self.threshold, color='r', linestyle='--', label='Anomaly Threshold')
-            plt.xlabel('Distance to Nearest Cluster Center')
-            plt.ylabel('Count')
-            plt.title('Distribution of Distances to Cluster Centers')
-            plt.legend()
-            plt.savefig('kmeans_distances.png')
-            plt.close()
-            
-            if labels is not None:
-                # Calculate and print evaluation metrics
-                predictions = distances > self.threshold
-                accuracy = np.mean(predictions == labels)
-                precision = np.mean(predictions[labels == 1])
-                recall = np.mean(labels[predictions == 1])
-                f1 = 2 * (precision * recall) / (precision + recall)
-                
-                print(f"\nEvaluation Metrics:")
-                print(f"Accuracy: {accuracy:.4f}")
-                print(f"Precision: {precision:.4f}")
-                print(f"Recall: {recall:.4f}")
-                print(f"F1 Score: {f1:.4f}")
-            
-        elif self.method == 'autoencoder':
-            # Calculate reconstruction errors
-            device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-            X_tensor = torch.FloatTensor(X).to(device)
-            self.autoencoder.eval()
-            
-            with torch.no_grad():
-                X_recon = self.autoencoder(X_tensor)
-                recon_errors = torch.mean((X_tensor - X_recon) ** 2, dim=1).cpu().numpy()
-            
-            # Plot reconstruction errors
-            plt.figure(figsize=(10, 5))
-            plt.hist(recon_errors, bins=50)
-            plt.axvline(self.threshold, color='r', linestyle='--', label='Anomaly Threshold')
-            plt.xlabel('Reconstruction Error')
-            plt.ylabel('Count')
-            plt.title('Distribution of Reconstruction Errors')
-            plt.legend()
-            plt.savefig('autoencoder_errors.png')
-            plt.close()
-            
-            if labels is not None:
-                # Calculate and print evaluation metrics
-                predictions = recon_errors > self.threshold
-                accuracy = np.mean(predictions == labels)
-                precision = np.mean(predictions[labels == 1])
-                recall = np.mean(labels[predictions == 1])
-                f1 = 2 * (precision * recall) / (precision + recall)
-                
-                print(f"\nEvaluation Metrics:")
-                print(f"Accuracy: {accuracy:.4f}")
-                print(f"Precision: {precision:.4f}")
-                print(f"Recall: {recall:.4f}")
-                print(f"F1 Score: {f1:.4f}")
+    def evaluate(self, X, labels=None, chunk_size=65536, plot=False, **options):
+        """
+        Evaluate on X (an array or memmap) in chunks of chunk_size rows; see evaluate_stream.
+        """
+        def chunks():
+            for start in range(0, len(X), chunk_size):
+                yield X[start:start + chunk_size], None if labels is None else labels[start:start + chunk_size]
+        
+        return self.evaluate_stream(chunks(), plot=plot, **options)
+    
+    def evaluate_stream(self, chunks, bins=200, score_range=None, plot=False, verbose=True):
+        """
+        Evaluate on an iterable of (X, labels) chunks (labels may be None) in constant memory.
+        
+        Scores are accumulated into a fixed histogram and confusion counts at the
+        current threshold, so precision/recall/F1 at every bin edge come from one
+        cumulative sum at the end. score_range defaults to (0, 3 * threshold);
+        scores outside it land in the first/last bin.
+        
+        Returns:
+            dict: see ScoreAccumulator.report
+        """
+        accumulator = ScoreAccumulator(self.threshold, bins, score_range or (0.0, 3 * float(self.threshold)))
+        for X_chunk, labels_chunk in chunks:
+            accumulator.update(self.raw_scores(X_chunk), labels_chunk)
+        report = accumulator.report()
+        
+        if plot:
+            self.plot_score_histogram(accumulator)
+        if verbose and report.get("metrics"):
+            metrics = report["metrics"]
+            print("\nEvaluation Metrics:")
+            print(f"Accuracy: {metrics['accuracy']:.4f}")
+            print(f"Precision: {metrics['precision']:.4f}")
+            print(f"Recall: {metrics['recall']:.4f}")
+            print(f"F1 Score: {metrics['f1']:.4f}")
+            best = report["best_threshold"]
+            print(f"Best threshold on grid: {best['threshold']:.4f} (F1 {best['f1']:.4f})")
+        return report
+    
+    def plot_score_histogram(self, accumulator):
+        import matplotlib.pyplot as plt
+        
+        xlabel, title, filename = {
+            'kmeans': ('Distance to Nearest Cluster Center', 'Distribution of Distances to Cluster Centers',
+                       'kmeans_distances.png'),
+            'knn': (f'Mean Distance to {self.n_neighbors} Nearest Genuine Embeddings',
+                    'Distribution of Nearest-Neighbour Distances', 'knn_distances.png'),
+            'autoencoder': ('Reconstruction Error', 'Distribution of Reconstruction Errors',
+                            'autoencoder_errors.png'),
+        }[self.method]
+        
+        plt.figure(figsize=(10, 5))
+        plt.stairs(accumulator.histogram.sum(axis=0), accumulator.edges, fill=True)
+        plt.axvline(self.threshold, color='r', linestyle='--', label='Anomaly Threshold')
+        plt.xlabel(xlabel)
+        plt.ylabel('Count')
+        plt.title(title)
+        plt.legend()
+        plt.savefig(filename)
+        plt.close()
 
 def main():
+    from embedding_store import cached_extract_embeddings
+    
     # Load features from real medicine images
-    X_real, real_filenames = extract_embeddings("real_medicines")
-    X_fake, fake_filenames = extract_embeddings("fake_medicines")
+    X_real, real_filenames = cached_extract_embeddings("real_medicines")
+    X_fake, fake_filenames = cached_extract_embeddings("fake_medicines")
     
     # Combine data for training
     X = np.vstack([X_real, X_fake])
@@ -260,12 +573,12 @@ def main():
     print("\nTraining KMeans Anomaly Detector...")
     kmeans_detector = AnomalyDetector(method='kmeans')
     kmeans_detector.fit(X_train, X_val, y_val)
-    kmeans_detector.evaluate(X_val, y_val)
+    kmeans_detector.evaluate(X_val, y_val, plot=True)
     
     print("\nTraining Autoencoder Anomaly Detector...")
     autoencoder_detector = AnomalyDetector(method='autoencoder')
     autoencoder_detector.fit(X_train, X_val, y_val)
-    autoencoder_detector.evaluate(X_val, y_val)
+    autoencoder_detector.evaluate(X_val, y_val, plot=True)
     
     # Save the models
     if kmeans_detector.kmeans is not None:
@@ -274,6 +587,10 @@ def main():
     
     if autoencoder_detector.autoencoder is not None:
         torch.save(autoencoder_detector.autoencoder.state_dict(), 'autoencoder_detector.pth')
+    
+    # Single-file bundle served by the API
+    from bundle import save_bundle, DEFAULT_BUNDLE_NAME
+    save_bundle(DEFAULT_BUNDLE_NAME, {'kmeans': kmeans_detector, 'autoencoder': autoencoder_detector})
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -1,15 +1,32 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+import time
+_import_start = time.perf_counter()
+
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-import torch
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 import numpy as np
 from PIL import Image
 import io
-from resnet_extractor import extract_embeddings, transform
+import asyncio
+import json
+import zipfile
+import hashlib
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import resnet_extractor
+from resnet_extractor import embed
 from anomaly_detector import AnomalyDetector
+from batcher import MicroBatcher
+from preprocessing import decode_and_preprocess
+import runtime
+import metrics
+from bundle import load_bundle, load_legacy_autoencoder, DEFAULT_BUNDLE_NAME
+from result_cache import ResultCache
 import joblib
+import logging
 import os
-import cv2
-from typing import Dict, Any
+from typing import Dict, Any, List, Tuple
 
 app = FastAPI()
 
@@ -25,176 +42,609 @@ app.add_middleware(
 # Global variables for models
 kmeans_detector = None
 autoencoder_detector = None
+knn_detector = None  # only shipped in model bundles
+bundle_info = None  # header summary of the loaded model bundle
+models_ready = False
+models_loading = None  # asyncio task running load_and_warm_up
+startup_timings = {"imports": time.perf_counter() - _import_start}
 CONFIDENCE_THRESHOLD = 0.7  # Minimum confidence threshold for predictions
 
-def preprocess_image(image: Image.Image) -> Image.Image:
-    """Enhanced image preprocessing"""
-    # Convert to numpy array
-    img_array = np.array(image)
-    
-    # Convert to grayscale for edge detection
-    gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
-    
-    # Apply adaptive thresholding
-    thresh = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-                                 cv2.THRESH_BINARY, 11, 2)
-    
-    # Find contours
-    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    
-    if contours:
-        # Find the largest contour (assuming it's the medicine)
-        largest_contour = max(contours, key=cv2.contourArea)
-        x, y, w, h = cv2.boundingRect(largest_contour)
-        
-        # Add padding
-        padding = 10
-        x = max(0, x - padding)
-        y = max(0, y - padding)
-        w = min(img_array.shape[1] - x, w + 2*padding)
-        h = min(img_array.shape[0] - y, h + 2*padding)
-        
-        # Crop the image
-        cropped = img_array[y:y+h, x:x+w]
-        image = Image.fromarray(cropped)
-    
-    # Resize maintaining aspect ratio
-    max_size = 800
-    ratio = min(max_size/image.size[0], max_size/image.size[1])
-    new_size = tuple(int(dim * ratio) for dim in image.size)
-    image = image.resize(new_size, Image.Resampling.LANCZOS)
-    
-    return image
+# Feature extractor inference backend: eager, torchscript, onnx, dynamic_int8 or static_int8
+EXTRACTOR_BACKEND = os.environ.get("EXTRACTOR_BACKEND", "eager")
+
+# Model bundle to serve; defaults to model_bundle.fmd next to this file
+MODEL_BUNDLE = os.environ.get("MODEL_BUNDLE")
+# Without a bundle, the legacy autoencoder_detector.pth is only served with this threshold,
+# since the file stores no threshold of its own
+AUTOENCODER_THRESHOLD = os.environ.get("AUTOENCODER_THRESHOLD")
+
+logger = logging.getLogger(__name__)
+
+# Request coalescing for the ResNet forward and detector scoring
+MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", 16))
+MAX_BATCH_WAIT_MS = float(os.environ.get("MAX_BATCH_WAIT_MS", 5))
+
+# Early-exit detector cascade: detectors run in CASCADE_ORDER (cheapest first; loaded detectors
+# not listed run last). An image stops once its probability is more than CASCADE_BAND away from
+# 0.5 and the remaining detectors could no longer change the ensemble verdict. Its confidence
+# then covers only stages_run, with the full ensemble's in confidence_range
+CASCADE = os.environ.get("CASCADE", "0") == "1"
+CASCADE_ORDER = [name.strip() for name in os.environ.get("CASCADE_ORDER", "kmeans,autoencoder").split(",")
+                 if name.strip()]
+CASCADE_BAND = float(os.environ.get("CASCADE_BAND", 0.25))
+
+# Bulk scoring via /predict/batch
+BATCH_CHUNK_SIZE = int(os.environ.get("BATCH_CHUNK_SIZE", 32))
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+ZIP_CONTENT_TYPES = ('application/zip', 'application/x-zip-compressed')
+
+# Reduced-resolution decode and box search; opt-in (FAST_PREPROCESS=1) until
+# `python benchmark.py preprocess` shows embedding parity with preprocess_image on your data
+FAST_PREPROCESS = os.environ.get("FAST_PREPROCESS", "0") == "1"
+
+# Opt-in (RESULT_CACHE=1) cache of /predict results keyed by upload hash and model version.
+# Processes pointed at the same RESULT_CACHE_PATH share stored results. Leave it off when
+# load testing or benchmarking, since replayed images would only measure cache hits
+RESULT_CACHE = os.environ.get("RESULT_CACHE", "0") == "1"
+RESULT_CACHE_PATH = os.environ.get("RESULT_CACHE_PATH",
+                                   os.path.join(tempfile.gettempdir(), "fmd_result_cache.sqlite"))
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get("RESULT_CACHE_MAX_ENTRIES", 10000))
+RESULT_CACHE_TTL = float(os.environ.get("RESULT_CACHE_TTL", 3600))
+# A process scoring an upload claims its hash in the cache; other processes receiving the same
+# bytes poll for the result, and take over claims older than the timeout (e.g. a crashed worker)
+RESULT_CACHE_CLAIM_TIMEOUT = float(os.environ.get("RESULT_CACHE_CLAIM_TIMEOUT", 30))
+RESULT_CACHE_POLL_INTERVAL = float(os.environ.get("RESULT_CACHE_POLL_INTERVAL", 0.02))
+result_cache = None  # opened by the startup hook
+models_id = None  # bundle id, or a tag for the legacy model files, set by load_models
+# Uploads being scored in this process, by content hash, so identical concurrent uploads to the
+# same process share one pass; across processes the cache's claims do the same
+_inflight_results: Dict[str, asyncio.Future] = {}
+
+# CPU work runs off the event loop: decode/preprocess on preprocess_pool ("thread" or
+# "process"), batched inference on inference_pool. Torch/OpenCV threads are split
+# across INFERENCE_WORKERS and WEB_CONCURRENCY server processes (see runtime.py)
+thread_plan = runtime.configure_threads()
+PREPROCESS_WORKERS = thread_plan["preprocess_workers"]
+INFERENCE_WORKERS = thread_plan["inference_workers"]
+PREPROCESS_EXECUTOR = os.environ.get("PREPROCESS_EXECUTOR", "thread")
+
+if PREPROCESS_EXECUTOR == "process":
+    # forkserver children only import preprocessing (PIL/OpenCV), not torch, the models
+    # or the __main__ module
+    mp_context = multiprocessing.get_context("forkserver")
+    mp_context.set_forkserver_preload(["preprocessing"])
+    preprocess_pool = ProcessPoolExecutor(max_workers=PREPROCESS_WORKERS, mp_context=mp_context)
+else:
+    preprocess_pool = ThreadPoolExecutor(max_workers=PREPROCESS_WORKERS, thread_name_prefix="preprocess")
+inference_pool = ThreadPoolExecutor(max_workers=INFERENCE_WORKERS, thread_name_prefix="inference")
+
+# Prometheus metrics served on /metrics
+REQUESTS = metrics.Counter("fmd_requests_total", "HTTP requests by endpoint and status code",
+                           ("endpoint", "method", "status"))
+REQUEST_LATENCY = metrics.Histogram("fmd_request_duration_seconds",
+                                    "Time to the response start, by endpoint", ("endpoint",))
+STAGE_LATENCY = metrics.Histogram("fmd_stage_duration_seconds",
+                                  "Time spent per pipeline stage (per image for upload_read and "
+                                  "preprocess, per batch otherwise)", ("stage",))
+STAGE_ERRORS = metrics.Counter("fmd_stage_errors_total", "Failures per pipeline stage", ("stage",))
+BATCH_SIZE = metrics.Histogram("fmd_batch_size", "Images per batched forward pass",
+                               buckets=metrics.BATCH_SIZE_BUCKETS)
+IMAGES_SCORED = metrics.Counter("fmd_images_scored_total", "Images embedded and scored")
+STARTUP_SECONDS = metrics.Gauge("fmd_startup_seconds", "Model loading and warm-up time by phase",
+                                ("phase",))
+MODELS_READY = metrics.Gauge("fmd_models_ready", "1 once the models are loaded and warmed up")
+CASCADE_EXITS = metrics.Counter("fmd_cascade_exits_total",
+                                "Images whose verdict was settled at each cascade stage", ("stage",))
+CACHE_LOOKUPS = metrics.Counter("fmd_result_cache_lookups_total",
+                                "/predict result cache lookups by outcome (hit, miss, coalesced, waited)",
+                                ("result",))
+CACHE_HIT_RATIO = metrics.Gauge("fmd_result_cache_hit_ratio",
+                                "Share of /predict uploads in this process answered without scoring")
+CACHE_ENTRIES = metrics.Gauge("fmd_result_cache_entries", "Entries in the shared result cache")
+_cache_counts = {"hit": 0, "miss": 0, "coalesced": 0, "waited": 0}
+
+def collect_startup_metrics():
+    for phase, seconds in list(startup_timings.items()):
+        STARTUP_SECONDS.set(seconds, phase=phase)
+    MODELS_READY.set(int(models_ready))
+    if result_cache is not None:
+        lookups = sum(_cache_counts.values())
+        CACHE_HIT_RATIO.set((lookups - _cache_counts["miss"]) / lookups if lookups else 0.0)
+        CACHE_ENTRIES.set(len(result_cache))
+
+metrics.REGISTRY.add_collector(collect_startup_metrics)
+
+def record_batch(size: int, waits: List[float]):
+    BATCH_SIZE.observe(size)
+    for wait in waits:
+        STAGE_LATENCY.observe(wait, stage="queue_wait")
+
+def load_image(contents: bytes) -> Image.Image:
+    """Decode uploaded bytes and run the enhanced preprocessing"""
+    try:
+        with STAGE_LATENCY.time(stage="preprocess"):
+            return decode_and_preprocess(contents, FAST_PREPROCESS)
+    except Exception:
+        STAGE_ERRORS.inc(stage="preprocess")
+        raise
 
 def load_models():
-    global kmeans_detector, autoencoder_detector
+    global kmeans_detector, autoencoder_detector, knn_detector, bundle_info, models_id
     
     # Get the current directory
     current_dir = os.path.dirname(os.path.abspath(__file__))
     
+    # Prefer the single-file bundle: arrays are memory-mapped, nothing is unpickled
+    bundle_path = MODEL_BUNDLE or os.path.join(current_dir, DEFAULT_BUNDLE_NAME)
+    if os.path.exists(bundle_path):
+        # serve.py loads in the parent before workers select the backend, so check against the configured one
+        header, detectors = load_bundle(bundle_path, backend=EXTRACTOR_BACKEND)
+        unknown = set(detectors) - {'kmeans', 'autoencoder', 'knn'}
+        if unknown:
+            raise ValueError(f"Bundle {bundle_path} has detectors the API cannot serve: {sorted(unknown)}")
+        kmeans_detector = detectors.get('kmeans')
+        autoencoder_detector = detectors.get('autoencoder')
+        knn_detector = detectors.get('knn')
+        bundle_info = {"path": bundle_path, "bundle_id": header["bundle_id"],
+                       "format_version": header["format_version"],
+                       "extractor_id": header["extractor_id"]}
+        models_id = header["bundle_id"]
+        return
+    if MODEL_BUNDLE:
+        raise FileNotFoundError(f"MODEL_BUNDLE not found: {MODEL_BUNDLE}")
+    
     # Load KMeans model
     kmeans_path = os.path.join(current_dir, 'kmeans_detector.joblib')
     if os.path.exists(kmeans_path):
         kmeans_detector = joblib.load(kmeans_path)
     
-    # Load Autoencoder model
+    # Load the legacy autoencoder weights; the .pth holds no threshold, so one must be configured
     autoencoder_path = os.path.join(current_dir, 'autoencoder_detector.pth')
     if os.path.exists(autoencoder_path):
-        autoencoder_detector = AnomalyDetector(method='autoencoder')
-        autoencoder_detector.autoencoder = autoencoder_detector.build_autoencoder()
-        autoencoder_detector.autoencoder.load_state_dict(torch.load(autoencoder_path))
-        autoencoder_detector.autoencoder.eval()
+        if AUTOENCODER_THRESHOLD is None:
+            logger.warning("Not serving %s: it stores no threshold. Set AUTOENCODER_THRESHOLD, or bundle it with "
+                           "`python bundle.py convert --kmeans kmeans_detector.joblib --autoencoder "
+                           "autoencoder_detector.pth --autoencoder-threshold <value>`", autoencoder_path)
+        else:
+            autoencoder_detector = load_legacy_autoencoder(autoencoder_path, AUTOENCODER_THRESHOLD)
+    
+    loaded = [path for path, detector in ((kmeans_path, kmeans_detector), (autoencoder_path, autoencoder_detector))
+              if detector is not None]
+    if loaded:
+        stats = [os.stat(path) for path in loaded]
+        models_id = "legacy-" + "-".join(f"{st.st_size}-{st.st_mtime_ns}" for st in stats)
+        if autoencoder_detector is not None:
+            models_id += f"-ae{AUTOENCODER_THRESHOLD}"
+
+def cache_version() -> str:
+    """Result cache version of the loaded models: anything that changes a response for the same bytes"""
+    version = f"{models_id}/{resnet_extractor.extractor_id()}/fast={int(FAST_PREPROCESS)}/{CONFIDENCE_THRESHOLD}"
+    if CASCADE:
+        version += f"/cascade={','.join(CASCADE_ORDER)}:{CASCADE_BAND}"
+    return version
+
+async def preprocess_async(contents: bytes) -> Image.Image:
+    """load_image on preprocess_pool, keeping the event loop free for other requests"""
+    loop = asyncio.get_running_loop()
+    if PREPROCESS_EXECUTOR != "process":
+        return await loop.run_in_executor(preprocess_pool, load_image, contents)
+    
+    # Stage timing is taken here since metrics in the child processes are not collected
+    start = time.perf_counter()
+    try:
+        return await loop.run_in_executor(preprocess_pool, decode_and_preprocess, contents, FAST_PREPROCESS)
+    except Exception:
+        STAGE_ERRORS.inc(stage="preprocess")
+        raise
+    finally:
+        STAGE_LATENCY.observe(time.perf_counter() - start, stage="preprocess")
+
+def loaded_detectors() -> Dict[str, AnomalyDetector]:
+    detectors = {'kmeans': kmeans_detector, 'autoencoder': autoencoder_detector, 'knn': knn_detector}
+    return {name: detector for name, detector in detectors.items() if detector is not None}
+
+def cascade_order(detectors: Dict[str, AnomalyDetector]) -> List[str]:
+    """Loaded detectors in cascade order; any not listed in CASCADE_ORDER run last"""
+    return [name for name in CASCADE_ORDER if name in detectors] + \
+           [name for name in detectors if name not in CASCADE_ORDER]
+
+def confidence_bounds(real_weight: np.ndarray, total_weight: np.ndarray, skipped) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Range the weighted vote of ensemble_predictions can still end up in once `skipped`
+    more detectors vote: a real vote weighs at most 1 and a fake one less than 0.5.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        low = np.where(skipped > 0, real_weight / (total_weight + 0.5 * skipped), real_weight / total_weight)
+        high = (real_weight + skipped) / (total_weight + skipped)
+    return np.nan_to_num(low), np.nan_to_num(high)
+
+def get_model_predictions(features: np.ndarray) -> Dict[str, Dict[str, np.ndarray]]:
+    """
+    Score an (N, 512) batch, one pass per model.
+    
+    With CASCADE on, each detector only scores the images the previous ones left
+    uncertain; rows a detector did not score have NaN scores and probabilities.
+    An image is settled when, however the remaining detectors vote, the weighted
+    vote of ensemble_predictions stays on the same side of 0.5 (see
+    confidence_bounds), so its verdict matches the full ensemble. Its confidence
+    and low-confidence warning come from the detectors that ran.
+    """
+    detectors = loaded_detectors()
+    outputs = {}
+    if not CASCADE:
+        for name, detector in detectors.items():
+            with STAGE_LATENCY.time(stage=f"detector_{name}"):
+                outputs[name] = detector.score(features)
+        return outputs
+    
+    n = len(features)
+    pending = np.arange(n)
+    order = cascade_order(detectors)
+    real_weight = np.zeros(n)
+    total_weight = np.zeros(n)
+    for stage, name in enumerate(order):
+        # Detectors nobody reached still get a (NaN) entry, so ensemble_predictions counts them as skipped
+        output = {'scores': np.full(n, np.nan), 'labels': np.zeros(n, dtype=bool),
+                  'probabilities': np.full(n, np.nan)}
+        outputs[name] = output
+        if len(pending) == 0:
+            continue
+        with STAGE_LATENCY.time(stage=f"detector_{name}"):
+            scored = detectors[name].score(features[pending] if len(pending) < n else features)
+        for key, values in scored.items():
+            output[key][pending] = values
+        
+        if stage < len(order) - 1:
+            probabilities = scored['probabilities'].astype(np.float64)
+            total_weight[pending] += probabilities
+            real_weight[pending] += np.where(scored['labels'], 0.0, probabilities)
+            low, high = confidence_bounds(real_weight[pending], total_weight[pending], len(order) - stage - 1)
+            decided = (low >= 0.5) | (high < 0.5)
+            uncertain = ~decided | (np.abs(probabilities - 0.5) < CASCADE_BAND)
+            settled = int(len(pending) - uncertain.sum())
+        else:
+            uncertain, settled = None, len(pending)
+        if settled:
+            CASCADE_EXITS.inc(settled, stage=name)
+        if uncertain is not None:
+            pending = pending[uncertain]
+    return outputs
+
+def predict_batch(images: List[Image.Image]) -> List[Dict[str, Any]]:
+    """Embed and score a batch of preprocessed images in one pass"""
+    try:
+        with STAGE_LATENCY.time(stage="extractor"):
+            features = embed(images)
+        outputs = get_model_predictions(features)
+        if not outputs:
+            raise HTTPException(status_code=500, detail="No models loaded")
+        with STAGE_LATENCY.time(stage="ensemble"):
+            responses = ensemble_predictions(outputs)
+    except Exception:
+        STAGE_ERRORS.inc(stage="batch")
+        raise
+    IMAGES_SCORED.inc(len(images))
+    return responses
+
+batcher = MicroBatcher(predict_batch, max_batch_size=MAX_BATCH_SIZE,
+                       max_wait_ms=MAX_BATCH_WAIT_MS, executor=inference_pool,
+                       max_concurrency=INFERENCE_WORKERS, on_batch=record_batch)
+
+def load_and_warm_up():
+    """Load the extractor and detectors and run a warm-up pass, timing each phase.
+    
+    Anything already loaded (e.g. by the pre-fork parent in serve.py) is kept.
+    """
+    global models_ready
+    
+    def timed(phase, fn, *args):
+        start = time.perf_counter()
+        result = fn(*args)
+        startup_timings[phase] = time.perf_counter() - start
+        return result
+    
+    if not resnet_extractor.is_loaded():
+        timed("extractor_load", resnet_extractor.load_model)
+    if EXTRACTOR_BACKEND != resnet_extractor.backend:
+        timed("extractor_backend", resnet_extractor.set_backend, EXTRACTOR_BACKEND)
+    if not loaded_detectors():
+        timed("detectors_load", load_models)
+    if result_cache is not None and models_id is not None:
+        # Reloaded models get a new version, so earlier results are no longer served
+        result_cache.set_model_version(cache_version())
+    timed("warmup", warm_up)
+    startup_timings["total"] = time.perf_counter() - _import_start
+    models_ready = True
+
+def warm_up():
+    resnet_extractor.warm_up()
+    if loaded_detectors():
+        predict_batch([Image.new('RGB', (224, 224))] * 2)
+
+def start_loading():
+    """Start load_and_warm_up on a worker thread once; every caller shares the same future"""
+    global models_loading
+    if models_loading is None:
+        loop = asyncio.get_running_loop()
+        models_loading = asyncio.ensure_future(loop.run_in_executor(None, load_and_warm_up))
+    return models_loading
+
+async def ensure_models_loaded():
+    """Wait for model loading to finish, starting it if startup never ran"""
+    if models_ready:
+        return
+    # A cancelled request must not cancel the load other requests are waiting on
+    await asyncio.shield(start_loading())
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route template so per-request paths don't create new series
+        route = request.scope.get("route")
+        endpoint = route.path if route is not None else "unmatched"
+        REQUESTS.inc(endpoint=endpoint, method=request.method, status=status)
+        REQUEST_LATENCY.observe(time.perf_counter() - start, endpoint=endpoint)
 
 @app.on_event("startup")
 async def startup_event():
-    load_models()
-
-def get_model_predictions(features: np.ndarray) -> Dict[str, Any]:
-    """Get predictions from all available models with confidence scores"""
-    results = {}
-    
-    if kmeans_detector is not None:
-        kmeans_pred = kmeans_detector.predict(features)
-        kmeans_proba = kmeans_detector.predict_proba(features)
-        results['kmeans'] = {
-            'is_fake': bool(kmeans_pred[0]),
-            'confidence': float(kmeans_proba[0])
-        }
+    global result_cache
+    if RESULT_CACHE and result_cache is None:
+        # Opened here rather than at import, so importing the app (tests, benchmarks,
+        # the pre-fork parent) never touches the cache file
+        result_cache = ResultCache(RESULT_CACHE_PATH, RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_TTL,
+                                   claim_timeout=RESULT_CACHE_CLAIM_TIMEOUT)
+    # Load in the background so /health and /ready answer while models load
+    start_loading()
+    await batcher.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await batcher.stop()
+    if PREPROCESS_EXECUTOR == "process":
+        preprocess_pool.shutdown(wait=False, cancel_futures=True)
+
+def ensemble_predictions(outputs: Dict[str, Dict[str, np.ndarray]]) -> List[Dict[str, Any]]:
+    """Combine per-model batch outputs into one verdict per image using weighted voting"""
+    names = list(outputs)
+    n = len(next(iter(outputs.values()))['labels'])
+    
+    # (models, N) arrays; each model's weight is its confidence. Models the cascade
+    # skipped for an image have NaN probabilities and take no part in its vote
+    probabilities = np.stack([outputs[name]['probabilities'] for name in names]).astype(np.float64)
+    ran = ~np.isnan(probabilities)
+    weights = np.where(ran, probabilities, 0.0)
+    is_fake = np.stack([outputs[name]['labels'] for name in names]).astype(bool) & ran
     
-    if autoencoder_detector is not None:
-        autoencoder_pred = autoencoder_detector.predict(features)
-        autoencoder_proba = autoencoder_detector.predict_proba(features)
-        results['autoencoder'] = {
-            'is_fake': bool(autoencoder_pred[0]),
-            'confidence': float(autoencoder_proba[0])
+    # Calculate weighted average
+    total_weight = weights.sum(axis=0)
+    weighted_sum = (weights * ~is_fake).sum(axis=0)
+    valid = total_weight > 0
+    avg_confidence = np.divide(weighted_sum, total_weight, out=np.zeros(n), where=valid)
+    verdict = avg_confidence < 0.5
+    
+    # Flag predictions that are not high-confidence
+    low_confidence = valid & (avg_confidence < CONFIDENCE_THRESHOLD) & (avg_confidence > 1 - CONFIDENCE_THRESHOLD)
+    
+    details_by_model = {
+        name: [{'is_fake': f, 'confidence': c} for f, c in zip(is_fake[i].tolist(), weights[i].tolist())]
+        for i, name in enumerate(names)
+    }
+    
+    ran_by_image = ran.T.tolist()
+    # The cascade only stops once is_fake matches the full ensemble. Confidence and warning
+    # come from the stages that ran; the full ensemble's confidence lies in confidence_range
+    skipped = (~ran).sum(axis=0)
+    range_low, range_high = confidence_bounds(weighted_sum, total_weight, skipped)
+    
+    responses = []
+    for i, (ok, fake, confidence, low) in enumerate(zip(valid.tolist(), verdict.tolist(),
+                                                       avg_confidence.tolist(), low_confidence.tolist())):
+        stages_run = [name for name, r in zip(names, ran_by_image[i]) if r]
+        response = {
+            "is_fake": fake if ok else None,
+            "confidence": confidence,
+            "model_details": {name: details_by_model[name][i] for name in stages_run},
+            "stages_run": stages_run
         }
+        if skipped[i] and ok:
+            response["confidence_range"] = [float(range_low[i]), float(range_high[i])]
+        if low:
+            response["warning"] = "Low confidence prediction"
+        responses.append(response)
     
-    return results
+    return responses
 
-def ensemble_predictions(results: Dict[str, Any]) -> Dict[str, Any]:
-    """Combine predictions from multiple models using weighted voting"""
-    if not results:
-        return {"is_fake": None, "confidence": 0.0, "model_details": results}
+async def score_upload(contents: bytes) -> Dict[str, Any]:
+    image = await preprocess_async(contents)
     
-    # Calculate weighted average
-    total_weight = 0
-    weighted_sum = 0
-    
-    for model_name, result in results.items():
-        # Weight based on confidence
-        weight = result['confidence']
-        total_weight += weight
-        weighted_sum += weight * (0 if result['is_fake'] else 1)
-    
-    if total_weight == 0:
-        return {"is_fake": None, "confidence": 0.0, "model_details": results}
-    
-    avg_confidence = weighted_sum / total_weight
-    is_fake = avg_confidence < 0.5
-    
-    # Only return high-confidence predictions
-    if avg_confidence < CONFIDENCE_THRESHOLD and avg_confidence > (1 - CONFIDENCE_THRESHOLD):
-        return {
-            "is_fake": is_fake,
-            "confidence": avg_confidence,
-            "model_details": results,
-            "warning": "Low confidence prediction"
-        }
+    # Extract features and score together with other in-flight requests
+    await ensure_models_loaded()
+    return await batcher.submit(image)
+
+async def cached_score_upload(key: str, contents: bytes) -> Dict[str, Any]:
+    await ensure_models_loaded()
+    result = await asyncio.to_thread(result_cache.get, key)
+    if result is not None:
+        _cache_counts["hit"] += 1
+        CACHE_LOOKUPS.inc(result="hit")
+        return result
     
-    return {
-        "is_fake": is_fake,
-        "confidence": avg_confidence,
-        "model_details": results
-    }
+    if not await asyncio.to_thread(result_cache.claim, key):
+        # Another process is scoring the same bytes
+        result = await wait_for_claimed_result(key)
+        if result is not None:
+            _cache_counts["waited"] += 1
+            CACHE_LOOKUPS.inc(result="waited")
+            return result
+    _cache_counts["miss"] += 1
+    CACHE_LOOKUPS.inc(result="miss")
+    try:
+        result = await score_upload(contents)
+    except BaseException:
+        await asyncio.to_thread(result_cache.release, key)
+        raise
+    # Storing the result also releases the claim
+    await asyncio.to_thread(result_cache.put, key, result)
+    return result
+
+async def wait_for_claimed_result(key: str):
+    """Poll the cache until the process holding the claim on key stores its result; None if it never does"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + RESULT_CACHE_CLAIM_TIMEOUT
+    while loop.time() < deadline:
+        await asyncio.sleep(RESULT_CACHE_POLL_INTERVAL)
+        result = await asyncio.to_thread(result_cache.get, key)
+        if result is not None:
+            return result
+        if not await asyncio.to_thread(result_cache.is_claimed, key):
+            # Released without a result (the owner failed), or stored just after the read above
+            return await asyncio.to_thread(result_cache.get, key)
+    return None
+
+async def predict_upload(contents: bytes) -> Dict[str, Any]:
+    """Score uploaded bytes, answering repeats from the result cache"""
+    if result_cache is None:
+        return await score_upload(contents)
+    
+    key = hashlib.sha256(contents).hexdigest()
+    future = _inflight_results.get(key)
+    if future is not None:
+        # Same bytes already being scored in this process: wait for that result
+        _cache_counts["coalesced"] += 1
+        CACHE_LOOKUPS.inc(result="coalesced")
+        return await asyncio.shield(future)
+    
+    future = asyncio.ensure_future(cached_score_upload(key, contents))
+    _inflight_results[key] = future
+    future.add_done_callback(lambda _: _inflight_results.pop(key, None))
+    # Shielded so a disconnecting first client does not cancel the work others wait on
+    return await asyncio.shield(future)
 
 @app.post("/predict")
 async def predict(file: UploadFile = File(...)):
     try:
-        # Read and validate image
-        contents = await file.read()
-        image = Image.open(io.BytesIO(contents))
-        
-        # Convert to RGB if necessary
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        
-        # Enhanced preprocessing
-        image = preprocess_image(image)
-        
-        # Save temporarily for feature extraction
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        temp_path = os.path.join(current_dir, "temp_image.jpg")
-        image.save(temp_path, quality=95)  # Save with high quality
-        
-        # Extract features
-        features, _ = extract_embeddings(temp_path)
-        
-        # Remove temporary file
-        os.remove(temp_path)
-        
-        # Get predictions from all models
-        results = get_model_predictions(features)
-        
-        # Combine predictions using ensemble method
-        if results:
-            return ensemble_predictions(results)
-        else:
-            raise HTTPException(status_code=500, detail="No models loaded")
+        # Read, validate and preprocess image
+        with STAGE_LATENCY.time(stage="upload_read"):
+            contents = await file.read()
+        return await predict_upload(contents)
             
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def read_batch_uploads(files: List[UploadFile]) -> List[Tuple[str, bytes]]:
+    """Expand uploaded files and zip archives into (filename, bytes) pairs in input order"""
+    items = []
+    for file in files:
+        contents = await file.read()
+        filename = file.filename or ""
+        if file.content_type in ZIP_CONTENT_TYPES or filename.lower().endswith('.zip'):
+            with zipfile.ZipFile(io.BytesIO(contents)) as archive:
+                for info in archive.infolist():
+                    if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS):
+                        items.append((info.filename, archive.read(info)))
+        else:
+            items.append((filename, contents))
+    return items
+
+async def _preprocess_safe(contents: bytes):
+    try:
+        return await preprocess_async(contents)
+    except Exception as e:
+        return e
+
+def _error_detail(error: Exception) -> str:
+    return str(getattr(error, 'detail', error))
+
+async def stream_batch_predictions(items: List[Tuple[str, bytes]]):
+    """Yield one NDJSON line per image, in input order, one chunk at a time.
+
+    Decoding and preprocessing of the next chunk runs on the thread pool while
+    the current chunk goes through the batched ResNet forward and detectors.
+    """
+    def schedule(start):
+        return [asyncio.ensure_future(_preprocess_safe(contents))
+                for _, contents in items[start:start + BATCH_CHUNK_SIZE]]
+
+    pending = schedule(0)
+    for start in range(0, len(items), BATCH_CHUNK_SIZE):
+        images = await asyncio.gather(*pending)
+        pending = schedule(start + BATCH_CHUNK_SIZE)
+
+        outcomes = await asyncio.gather(
+            *[batcher.submit(image) for image in images if not isinstance(image, Exception)],
+            return_exceptions=True
+        )
+        outcomes = iter(outcomes)
+        for offset, image in enumerate(images):
+            index = start + offset
+            line = {"index": index, "filename": items[index][0]}
+            result = image if isinstance(image, Exception) else next(outcomes)
+            if isinstance(result, Exception):
+                line["error"] = _error_detail(result)
+            else:
+                line.update(result)
+            yield json.dumps(line) + "\n"
+
+@app.post("/predict/batch")
+async def predict_bulk(files: List[UploadFile] = File(...)):
+    try:
+        items = await read_batch_uploads(files)
+    except zipfile.BadZipFile as e:
+        raise HTTPException(status_code=400, detail=f"Invalid zip archive: {e}")
+    
+    if not items:
+        raise HTTPException(status_code=400, detail="No images found in upload")
+    
+    await ensure_models_loaded()
+    return StreamingResponse(stream_batch_predictions(items), media_type="application/x-ndjson")
+
 @app.get("/health")
 async def health_check():
     return {
         "status": "healthy",
         "models_loaded": {
             "kmeans": kmeans_detector is not None,
-            "autoencoder": autoencoder_detector is not None
+            "autoencoder": autoencoder_detector is not None,
+            "knn": knn_detector is not None
         },
+        "model_bundle": bundle_info,
+        "extractor_backend": resnet_extractor.backend,
+        "threads": thread_plan,
+        "cascade": {"order": cascade_order(loaded_detectors()), "band": CASCADE_BAND} if CASCADE else None,
         "confidence_threshold": CONFIDENCE_THRESHOLD
     }
 
+@app.get("/metrics")
+async def metrics_endpoint():
+    return Response(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/ready")
+async def readiness_check():
+    if models_loading is not None and models_loading.done() and models_loading.exception():
+        return JSONResponse(status_code=503, content={
+            "status": "failed",
+            "error": str(models_loading.exception()),
+            "startup_seconds": startup_timings
+        })
+    if not models_ready:
+        return JSONResponse(status_code=503, content={
+            "status": "loading",
+            "startup_seconds": startup_timings
+        })
+    return {"status": "ready", "startup_seconds": startup_timings}
+
+@app.get("/stats/batching")
+async def batching_stats():
+    return batcher.stats()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
@@ -0,0 +1,278 @@
+"""
+Synthetic counterfeit generation.
+
+Genuine images are decoded and resized to the network input size in worker
+processes, and each batch is transformed as one (N, H, W, 3) uint8 array.
+Each transform draws its parameters per image but runs over the whole batch:
+
+    noise             additive Gaussian sensor/print noise (clipped, never wraps)
+    hue               hue rotation, as from off-spec inks
+    blur              Gaussian blur, as from a low-resolution rescan
+    misregistration   colour channels offset by a few pixels, as from
+                      misaligned printing plates
+    font_jitter       stroke-weight change (erode/dilate), approximating
+                      re-typeset text in a different font weight
+
+Counterfeits can be streamed straight into the extractor without touching
+the disk, or written out as JPEGs:
+
+    python augment.py --source real_medicines --count 5000 --embeddings fake_embeddings.npy
+    python augment.py --source real_medicines --count 500 --out fake_medicines
+"""
+import argparse
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+from PIL import Image
+
+IMAGE_SIZE = 224
+# ImageNet statistics used by resnet_extractor.transform
+MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+
+def gaussian_noise(batch, rng, sigma=(5.0, 25.0)):
+    sigmas = rng.uniform(*sigma, size=(len(batch), 1, 1, 1)).astype(np.float32)
+    noisy = batch.astype(np.float32) + rng.standard_normal(batch.shape, dtype=np.float32) * sigmas
+    return np.clip(noisy, 0, 255).astype(np.uint8)
+
+
+def hue_shift(batch, rng, max_shift=30):
+    n, h, w, _ = batch.shape
+    # OpenCV converts pixel by pixel, so the batch can go through as one tall image
+    hsv = cv2.cvtColor(batch.reshape(n * h, w, 3), cv2.COLOR_RGB2HSV).reshape(n, h, w, 3)
+    shifts = rng.integers(-max_shift, max_shift + 1, size=(n, 1, 1))
+    hsv[..., 0] = (hsv[..., 0].astype(np.int16) + shifts) % 180
+    return cv2.cvtColor(hsv.reshape(n * h, w, 3), cv2.COLOR_HSV2RGB).reshape(n, h, w, 3)
+
+
+def _shifted(padded, dy, dx, h, w, radius):
+    return padded[:, radius + dy:radius + dy + h, radius + dx:radius + dx + w]
+
+
+def blur(batch, rng, sigma=(0.6, 2.0)):
+    n, h, w, _ = batch.shape
+    sigmas = rng.uniform(*sigma, size=n)
+    radius = int(np.ceil(3 * sigma[1]))
+    offsets = np.arange(-radius, radius + 1)
+    # Per-image separable kernels, shape (n, 2r+1)
+    kernels = np.exp(-offsets[None, :] ** 2 / (2 * sigmas[:, None] ** 2)).astype(np.float32)
+    kernels /= kernels.sum(axis=1, keepdims=True)
+
+    out = batch.astype(np.float32)
+    for axis in (1, 2):
+        pad = [(0, 0)] * 4
+        pad[axis] = (radius, radius)
+        padded = np.pad(out, pad, mode='edge')
+        out = np.zeros_like(out)
+        for k, offset in enumerate(offsets):
+            start = radius + offset
+            window = padded[:, start:start + h] if axis == 1 else padded[:, :, start:start + w]
+            out += window * kernels[:, k, None, None, None]
+    return np.clip(np.rint(out), 0, 255).astype(np.uint8)
+
+
+def misregistration(batch, rng, max_offset=4):
+    n, h, w, c = batch.shape
+    dy = rng.integers(-max_offset, max_offset + 1, size=(n, c))
+    dx = rng.integers(-max_offset, max_offset + 1, size=(n, c))
+    # Gather every channel from its own offset grid, clamping at the edges
+    rows = np.clip(np.arange(h)[None, None, :] - dy[:, :, None], 0, h - 1)  # (n, c, h)
+    cols = np.clip(np.arange(w)[None, None, :] - dx[:, :, None], 0, w - 1)  # (n, c, w)
+    shifted = batch[np.arange(n)[:, None, None, None], rows[:, :, :, None], cols[:, :, None, :],
+                    np.arange(c)[None, :, None, None]]
+    return np.ascontiguousarray(shifted.transpose(0, 2, 3, 1))
+
+
+def font_jitter(batch, rng, radius=1):
+    n, h, w, _ = batch.shape
+    padded = np.pad(batch, ((0, 0), (radius, radius), (radius, radius), (0, 0)), mode='edge')
+    windows = [_shifted(padded, dy, dx, h, w, radius)
+               for dy in range(-radius, radius + 1) for dx in range(-radius, radius + 1)]
+    # Dark text on a light box: a min filter thickens strokes, a max filter thins them
+    thicker = np.minimum.reduce(windows)
+    thinner = np.maximum.reduce(windows)
+    choice = rng.random(n)[:, None, None, None] < 0.5
+    return np.where(choice, thicker, thinner)
+
+
+AUGMENTATIONS = {
+    'noise': gaussian_noise,
+    'hue': hue_shift,
+    'blur': blur,
+    'misregistration': misregistration,
+    'font_jitter': font_jitter,
+}
+
+
+def augment_batch(batch, rng, ops=None, p=0.5):
+    """
+    Apply each op to a random subset of a (N, H, W, 3) uint8 batch; every image
+    gets at least one op so no output is an unmodified genuine image.
+    """
+    ops = list(ops or AUGMENTATIONS)
+    n = len(batch)
+    applied = rng.random((len(ops), n)) < p
+    applied[rng.integers(len(ops), size=n), np.arange(n)] = True
+    out = batch.copy()
+    for name, mask in zip(ops, applied):
+        if mask.any():
+            out[mask] = AUGMENTATIONS[name](out[mask], rng)
+    return out
+
+
+def load_batch(paths, size=IMAGE_SIZE):
+    """Decode and resize images to (N, size, size, 3) uint8; unreadable files are skipped"""
+    images, kept = [], []
+    for i, path in enumerate(paths):
+        try:
+            image = Image.open(path)
+            image.draft('RGB', (size, size))
+            array = np.asarray(image.convert('RGB'))
+        except Exception as e:
+            print(f"Error processing {os.path.basename(path)}: {str(e)}")
+            continue
+        images.append(cv2.resize(array, (size, size), interpolation=cv2.INTER_AREA))
+        kept.append(i)
+    if not images:
+        return kept, np.empty((0, size, size, 3), dtype=np.uint8)
+    return kept, np.stack(images)
+
+
+def _init_worker():
+    # Parallelism comes from the pool, not from OpenCV inside each worker
+    cv2.setNumThreads(1)
+
+
+def _make_batch(paths, seed, ops, size):
+    kept, batch = load_batch(paths, size)
+    return kept, augment_batch(batch, np.random.default_rng(seed), ops)
+
+
+def generate_counterfeits(paths, count, batch_size=64, workers=None, ops=None, seed=0, size=IMAGE_SIZE):
+    """
+    Stream `count` counterfeits derived from the given genuine images.
+
+    Source images are drawn in shuffled passes over `paths`; batches are built
+    by a process pool with a bounded number in flight.
+
+    Yields:
+        tuple: (list of source paths, (N, size, size, 3) uint8 array)
+    """
+    if not paths:
+        raise ValueError("No source images")
+    rng = np.random.default_rng(seed)
+    sources = np.concatenate([rng.permutation(len(paths)) for _ in range(-(-count // len(paths)))])[:count]
+    chunks = [sources[i:i + batch_size] for i in range(0, count, batch_size)]
+    seeds = rng.integers(2 ** 63, size=len(chunks))
+    workers = workers or max(1, (os.cpu_count() or 1) - 1)
+
+    # forkserver children import only this module (numpy/OpenCV/PIL), not torch or the caller
+    mp_context = multiprocessing.get_context("forkserver")
+    mp_context.set_forkserver_preload(["augment"])
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context, initializer=_init_worker) as pool:
+        pending = []
+        for chunk, chunk_seed in zip(chunks, seeds):
+            pending.append((chunk, pool.submit(_make_batch, [paths[i] for i in chunk], chunk_seed, ops, size)))
+            if len(pending) >= 2 * workers:
+                chunk, future = pending.pop(0)
+                yield _result(paths, chunk, future)
+        for chunk, future in pending:
+            yield _result(paths, chunk, future)
+
+
+def _result(paths, chunk, future):
+    kept, batch = future.result()
+    return [paths[chunk[i]] for i in kept], batch
+
+
+def to_network_input(batch):
+    """(N, H, W, 3) uint8 images to the normalized (N, 3, H, W) float32 input of the extractor"""
+    return np.ascontiguousarray(((batch.astype(np.float32) / 255 - MEAN) / STD).transpose(0, 3, 1, 2))
+
+
+def iter_counterfeit_embeddings(image_folder, count, batch_size=64, workers=None, ops=None, seed=0):
+    """
+    Embed `count` on-the-fly counterfeits of the images in a folder, without writing them to disk.
+
+    Yields:
+        tuple: (list of source filenames, embeddings array of shape (len(filenames), 512))
+    """
+    from resnet_extractor import embed, list_images
+
+    paths = [os.path.join(image_folder, fname) for fname in list_images(image_folder)]
+    for sources, batch in generate_counterfeits(paths, count, batch_size, workers, ops, seed):
+        if len(batch):
+            yield [os.path.basename(p) for p in sources], embed(to_network_input(batch))
+
+
+def extract_counterfeit_embeddings(image_folder, count, batch_size=64, workers=None, ops=None, seed=0, out=None):
+    """
+    Counterpart of ``extract_embeddings`` for synthetic counterfeits.
+
+    Args:
+        out (str): optional .npy path to write the embeddings to as a memory-mapped array
+
+    Returns:
+        tuple: (embeddings array, list of source filenames)
+    """
+    from resnet_extractor import EMBEDDING_DIM, _truncate_npy
+
+    if out is not None:
+        embeddings = np.lib.format.open_memmap(out, mode='w+', dtype=np.float32, shape=(count, EMBEDDING_DIM))
+    else:
+        embeddings = np.empty((count, EMBEDDING_DIM), dtype=np.float32)
+    sources = []
+    for names, emb in iter_counterfeit_embeddings(image_folder, count, batch_size, workers, ops, seed):
+        embeddings[len(sources):len(sources) + len(emb)] = emb
+        sources.extend(names)
+    if out is not None:
+        embeddings.flush()
+        if len(sources) < count:
+            embeddings = _truncate_npy(out, embeddings, len(sources))
+        return embeddings, sources
+    return embeddings[:len(sources)], sources
+
+
+def save_counterfeits(image_folder, out_folder, count, batch_size=64, workers=None, ops=None, seed=0):
+    """Write `count` counterfeits as JPEGs named fake_<n>_<source>.jpg"""
+    from resnet_extractor import list_images
+
+    os.makedirs(out_folder, exist_ok=True)
+    paths = [os.path.join(image_folder, fname) for fname in list_images(image_folder)]
+    written = 0
+    for sources, batch in generate_counterfeits(paths, count, batch_size, workers, ops, seed):
+        for source, image in zip(sources, batch):
+            name = os.path.splitext(os.path.basename(source))[0]
+            Image.fromarray(image).save(os.path.join(out_folder, f"fake_{written}_{name}.jpg"), "JPEG", quality=95)
+            written += 1
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic counterfeits from genuine images")
+    parser.add_argument("--source", default="real_medicines", help="Folder of genuine images")
+    parser.add_argument("--count", type=int, default=1000)
+    parser.add_argument("--ops", nargs="+", choices=list(AUGMENTATIONS), default=None)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--out", help="Write counterfeits as JPEGs to this folder")
+    target.add_argument("--embeddings", help="Embed counterfeits on the fly and save them to this .npy path")
+    args = parser.parse_args()
+
+    if args.out:
+        written = save_counterfeits(args.source, args.out, args.count, args.batch_size, args.workers,
+                                    args.ops, args.seed)
+        print(f"Wrote {written} counterfeits to {args.out}")
+    else:
+        embeddings, sources = extract_counterfeit_embeddings(args.source, args.count, args.batch_size,
+                                                             args.workers, args.ops, args.seed, out=args.embeddings)
+        print(f"Embedded {len(sources)} counterfeits into {args.embeddings}")
+
+
+if __name__ == "__main__":
+    main()
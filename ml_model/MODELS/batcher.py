@@ -0,0 +1,169 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+
+class MicroBatcher:
+    """Coalesce concurrent requests into batches for a single batched call.
+
+    Items submitted while a batch is being collected are grouped until either
+    ``max_batch_size`` items are waiting or ``max_wait_ms`` has passed since the
+    first item of the batch arrived. ``process_batch`` receives the list of
+    items and must return one result per item, in the same order. Up to
+    ``max_concurrency`` batches run in the executor at once; while they are all
+    busy new items keep queueing, so batches grow under load. ``on_batch``,
+    if given, is called with the batch size and the queue wait of each item
+    (seconds) whenever a batch is dispatched.
+    """
+
+    def __init__(self, process_batch: Callable[[List[Any]], List[Any]],
+                 max_batch_size: int = 16, max_wait_ms: float = 5.0,
+                 executor=None, history_size: int = 1024, max_concurrency: int = 1,
+                 on_batch: Optional[Callable[[int, List[float]], None]] = None):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.executor = executor
+        self.max_concurrency = max(1, max_concurrency)
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._inflight = set()
+        self.on_batch = on_batch
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+        # Statistics
+        self.batches = 0
+        self.items = 0
+        self.errors = 0
+        self.batch_size_counts: Dict[int, int] = {}
+        self._waits = deque(maxlen=history_size)
+        self._batch_times = deque(maxlen=history_size)
+
+    async def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._inflight):
+            task.cancel()
+
+    async def submit(self, item: Any) -> Any:
+        """Queue an item and wait for its result"""
+        if self._task is None:
+            await self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future, time.perf_counter()))
+        return await future
+
+    async def _collect(self) -> list:
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            # Take everything that is already waiting without yielding
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            await self._slots.acquire()
+            try:
+                batch = await self._collect()
+            except BaseException:
+                self._slots.release()
+                raise
+            # Drop requests whose callers have already gone away
+            batch = [entry for entry in batch if not entry[1].done()]
+            if not batch:
+                self._slots.release()
+                continue
+
+            start = time.perf_counter()
+            waits = [start - enqueued for _, _, enqueued in batch]
+            self._waits.extend(waits)
+            if self.on_batch is not None:
+                self.on_batch(len(batch), waits)
+            self.batches += 1
+            self.items += len(batch)
+            self.batch_size_counts[len(batch)] = self.batch_size_counts.get(len(batch), 0) + 1
+
+            task = asyncio.get_running_loop().create_task(self._process(batch, start))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _process(self, batch, start):
+        loop = asyncio.get_running_loop()
+        items = [item for item, _, _ in batch]
+        try:
+            results = await loop.run_in_executor(self.executor, self.process_batch, items)
+            if len(results) != len(items):
+                raise RuntimeError(f"Batch returned {len(results)} results for {len(items)} items")
+        except Exception as e:
+            self.errors += 1
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (_, future, _), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self._batch_times.append(time.perf_counter() - start)
+            self._slots.release()
+
+    def stats(self) -> Dict[str, Any]:
+        """Batch-size and queue-wait statistics for tuning"""
+        waits_ms = sorted(w * 1000 for w in self._waits)
+        batch_ms = sorted(t * 1000 for t in self._batch_times)
+
+        def percentile(values, q):
+            if not values:
+                return 0.0
+            return values[min(len(values) - 1, int(q * len(values)))]
+
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "max_concurrency": self.max_concurrency,
+            "in_flight": len(self._inflight),
+            "batches": self.batches,
+            "items": self.items,
+            "errors": self.errors,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+            "batch_size_counts": dict(sorted(self.batch_size_counts.items())),
+            "queue_wait_ms": {
+                "mean": sum(waits_ms) / len(waits_ms) if waits_ms else 0.0,
+                "p50": percentile(waits_ms, 0.50),
+                "p95": percentile(waits_ms, 0.95),
+                "max": waits_ms[-1] if waits_ms else 0.0,
+            },
+            "batch_time_ms": {
+                "mean": sum(batch_ms) / len(batch_ms) if batch_ms else 0.0,
+                "p50": percentile(batch_ms, 0.50),
+                "p95": percentile(batch_ms, 0.95),
+                "max": batch_ms[-1] if batch_ms else 0.0,
+            },
+        }
@@ -0,0 +1,374 @@
+"""
+Offline benchmark suite for the verification pipeline.
+
+Generates synthetic medicine-package images (no dataset or network needed)
+and times preprocessing, embedding extraction at several batch sizes and
+thread counts, detector scoring and the full /predict round trip through an
+in-process client. Results are written as JSON; pass a previous run as the
+baseline to fail on regressions:
+
+    python benchmark.py --baseline benchmark_baseline.json --tolerance 0.25
+
+benchmark_baseline.json is a run with the default settings; its environment
+block records the machine it came from. Regenerate it on the machine that
+runs the comparison (and commit it when the change is intended) with:
+
+    python benchmark.py --output benchmark_baseline.json
+
+The preprocess subcommand compares the fast preprocessing path with
+preprocess_image on a folder of real images, per-image latency and the cosine
+similarity of the embeddings they produce, and fails when the two diverge
+(FAST_PREPROCESS should only be enabled after this passes on production data):
+
+    python benchmark.py preprocess real_medicines --images 64 --min-cosine 0.98
+
+Timings are only comparable between runs on the same machine.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import numpy as np
+import torch
+from PIL import Image, ImageDraw, ImageFilter
+
+
+def synthetic_medicine_image(rng, size=(800, 600)):
+    """A blister pack or box photo lookalike: a labelled, striped package on a noisy background"""
+    width, height = size
+    background = rng.integers(120, 230, 3)
+    pixels = np.clip(background + rng.normal(0, 12, (height, width, 3)), 0, 255).astype(np.uint8)
+    image = Image.fromarray(pixels)
+    draw = ImageDraw.Draw(image)
+
+    # Package body
+    x0, y0 = int(width * rng.uniform(0.1, 0.25)), int(height * rng.uniform(0.1, 0.25))
+    x1, y1 = int(width * rng.uniform(0.75, 0.9)), int(height * rng.uniform(0.75, 0.9))
+    draw.rectangle([x0, y0, x1, y1], fill=tuple(int(c) for c in rng.integers(200, 256, 3)),
+                   outline=(40, 40, 40), width=3)
+
+    # Brand stripe, label lines and pill pockets
+    stripe = tuple(int(c) for c in rng.integers(0, 200, 3))
+    draw.rectangle([x0, y0, x1, y0 + (y1 - y0) // 5], fill=stripe)
+    for i in range(int(rng.integers(3, 7))):
+        ty = y0 + (y1 - y0) // 4 + i * 18
+        draw.rectangle([x0 + 20, ty, x0 + 20 + int(rng.integers(80, x1 - x0 - 40)), ty + 8], fill=(30, 30, 30))
+    for row in range(2):
+        for col in range(5):
+            cx = x0 + (col + 1) * (x1 - x0) // 6
+            cy = y0 + (y1 - y0) * (row + 3) // 5
+            draw.ellipse([cx - 18, cy - 12, cx + 18, cy + 12], outline=(90, 90, 90), width=2)
+
+    return image.filter(ImageFilter.GaussianBlur(float(rng.uniform(0, 1.2))))
+
+
+def make_dataset(folder, n_images, size, seed=0):
+    """Write n synthetic JPEGs to folder; returns their encoded bytes"""
+    rng = np.random.default_rng(seed)
+    blobs = []
+    for i in range(n_images):
+        buffer = io.BytesIO()
+        synthetic_medicine_image(rng, size).save(buffer, format='JPEG', quality=90)
+        blobs.append(buffer.getvalue())
+        with open(os.path.join(folder, f"synthetic_{i:04d}.jpg"), 'wb') as f:
+            f.write(blobs[-1])
+    return blobs
+
+
+def timeit(fn, repeats=5, warmup=1, items=1):
+    """Median/p95 wall time of fn() over repeats, with per-item throughput"""
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    timings = np.array(timings) * 1000
+    median = float(np.median(timings))
+    return {"median_ms": round(median, 3), "p95_ms": round(float(np.percentile(timings, 95)), 3),
+            "items": items, "items_per_s": round(items * 1000 / median, 2) if median else None}
+
+
+def legacy_preprocess(contents):
+    """preprocess_image from the encoded upload, as served with FAST_PREPROCESS=0"""
+    from preprocessing import preprocess_image
+
+    return preprocess_image(Image.open(io.BytesIO(contents)).convert('RGB'))
+
+
+def bench_preprocess(blobs, repeats):
+    from preprocessing import preprocess_fast
+
+    # Both paths start from the encoded upload, since the fast one decodes at reduced size
+    return {
+        "preprocess/legacy": timeit(lambda: [legacy_preprocess(b) for b in blobs], repeats, items=len(blobs)),
+        "preprocess/fast": timeit(lambda: [preprocess_fast(b) for b in blobs], repeats, items=len(blobs)),
+    }
+
+
+def preprocess_parity(blobs, names, min_cosine=0.98, batch_size=32):
+    """
+    Cosine similarity between the embeddings of the fast and the legacy preprocessing path.
+
+    Returns:
+        dict: mean/p5/min cosine, the worst images, and whether min >= min_cosine
+    """
+    from preprocessing import preprocess_fast
+    from resnet_extractor import embed
+
+    def embed_all(images):
+        return np.concatenate([embed(images[start:start + batch_size])
+                               for start in range(0, len(images), batch_size)])
+
+    legacy = embed_all([legacy_preprocess(b) for b in blobs])
+    fast = embed_all([preprocess_fast(b) for b in blobs])
+    cosine = np.sum(legacy * fast, axis=1) / (
+        np.linalg.norm(legacy, axis=1) * np.linalg.norm(fast, axis=1) + 1e-12)
+    return {"mean": round(float(np.mean(cosine)), 5), "p5": round(float(np.percentile(cosine, 5)), 5),
+            "min": round(float(np.min(cosine)), 5), "worst": [names[i] for i in np.argsort(cosine)[:5]],
+            "min_cosine": min_cosine, "passed": bool(np.min(cosine) >= min_cosine)}
+
+
+def bench_extractor(folder, n_images, batch_sizes, thread_counts, repeats):
+    from resnet_extractor import extract_embeddings, load_model
+
+    load_model()
+    results = {}
+    default_threads = torch.get_num_threads()
+    try:
+        for threads in thread_counts:
+            torch.set_num_threads(threads)
+            for batch_size in batch_sizes:
+                results[f"extract_embeddings/bs{batch_size}/threads{threads}"] = timeit(
+                    lambda: extract_embeddings(folder, batch_size=batch_size, num_workers=0),
+                    repeats, items=n_images)
+    finally:
+        torch.set_num_threads(default_threads)
+    return results
+
+
+def fit_detectors(X):
+    """Fit both serving detectors on synthetic embeddings, half labelled fake for the thresholds"""
+    from anomaly_detector import AnomalyDetector
+
+    rng = np.random.default_rng(1)
+    fake = X + rng.normal(0, X.std(), X.shape).astype(np.float32)
+    X_val = np.vstack([X, fake])
+    y_val = np.array([0] * len(X) + [1] * len(fake))
+
+    detectors = {}
+    for method in ('kmeans', 'autoencoder'):
+        torch.manual_seed(0)
+        detector = AnomalyDetector(method=method)
+        detector.fit(X, X_val, y_val)
+        detectors[method] = detector
+    return detectors
+
+
+def bench_detectors(detectors, X, repeats):
+    results = {}
+    for name, detector in detectors.items():
+        results[f"detector/{name}/predict"] = timeit(lambda: detector.predict(X), repeats, items=len(X))
+        results[f"detector/{name}/predict_proba"] = timeit(lambda: detector.predict_proba(X),
+                                                           repeats, items=len(X))
+    return results
+
+
+def bench_api(detectors, blobs, repeats, concurrency=8):
+    """Sequential and concurrent /predict through httpx's in-process ASGI transport"""
+    import httpx
+    import api
+
+    api.kmeans_detector = detectors['kmeans']
+    api.autoencoder_detector = detectors['autoencoder']
+    api.models_ready = True
+
+    async def run():
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            async def post(contents):
+                response = await client.post("/predict", files={"file": ("medicine.jpg", contents, "image/jpeg")})
+                response.raise_for_status()
+
+            async def sequential():
+                for contents in blobs:
+                    await post(contents)
+
+            async def concurrent():
+                semaphore = asyncio.Semaphore(concurrency)
+
+                async def bounded(contents):
+                    async with semaphore:
+                        await post(contents)
+                await asyncio.gather(*[bounded(contents) for contents in blobs])
+
+            results = {}
+            for name, scenario in (("sequential", sequential), ("concurrent", concurrent)):
+                await scenario()  # warm-up
+                timings = []
+                for _ in range(repeats):
+                    start = time.perf_counter()
+                    await scenario()
+                    timings.append(time.perf_counter() - start)
+                timings = np.array(timings) * 1000
+                median = float(np.median(timings))
+                results[f"api/predict/{name}"] = {
+                    "median_ms": round(median, 3), "p95_ms": round(float(np.percentile(timings, 95)), 3),
+                    "items": len(blobs), "items_per_s": round(len(blobs) * 1000 / median, 2)}
+        await api.batcher.stop()
+        return results
+
+    return asyncio.run(run())
+
+
+def run_suite(n_images=16, image_size=(800, 600), batch_sizes=(1, 8, 32), thread_counts=None,
+              repeats=3, sections=('preprocess', 'extractor', 'detectors', 'api')):
+    from resnet_extractor import embed, extractor_id
+
+    torch.manual_seed(0)
+    thread_counts = thread_counts or sorted({1, torch.get_num_threads()})
+    report = {
+        "environment": {"python": platform.python_version(), "torch": torch.__version__,
+                        "machine": platform.machine(), "cpus": os.cpu_count(),
+                        "torch_threads": torch.get_num_threads(), "extractor": extractor_id()},
+        "config": {"images": n_images, "image_size": list(image_size), "repeats": repeats},
+        "results": {},
+    }
+
+    with tempfile.TemporaryDirectory() as folder:
+        blobs = make_dataset(folder, n_images, image_size)
+        results = report["results"]
+        if 'preprocess' in sections:
+            print("Benchmarking preprocessing...")
+            results.update(bench_preprocess(blobs, repeats))
+            report["preprocess_parity"] = preprocess_parity(blobs, [f"synthetic_{i:04d}.jpg"
+                                                                    for i in range(len(blobs))])
+        if 'extractor' in sections:
+            print("Benchmarking feature extraction...")
+            results.update(bench_extractor(folder, n_images, batch_sizes, thread_counts, repeats))
+        if 'detectors' in sections or 'api' in sections:
+            print("Fitting detectors on synthetic embeddings...")
+            X = embed([Image.open(io.BytesIO(b)).convert('RGB') for b in blobs])
+            detectors = fit_detectors(np.repeat(X, max(1, 256 // len(X)), axis=0))
+            if 'detectors' in sections:
+                print("Benchmarking detectors...")
+                results.update(bench_detectors(detectors, np.repeat(X, 64, axis=0), repeats))
+            if 'api' in sections:
+                print("Benchmarking /predict...")
+                results.update(bench_api(detectors, blobs, repeats))
+    return report
+
+
+def compare(report, baseline, tolerance=0.25):
+    """Names of benchmarks whose median time grew by more than tolerance over the baseline"""
+    regressions = []
+    for name, result in report["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if base is None:
+            continue
+        ratio = result["median_ms"] / base["median_ms"] if base["median_ms"] else 1.0
+        result["baseline_median_ms"] = base["median_ms"]
+        result["ratio"] = round(ratio, 3)
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def run_preprocess(image_folder, n_images=64, repeats=3, min_cosine=0.98):
+    """Latency and embedding parity of both preprocessing paths on a folder of real images"""
+    from resnet_extractor import list_images
+
+    names = list_images(image_folder)[:n_images]
+    blobs = []
+    for name in names:
+        with open(os.path.join(image_folder, name), 'rb') as f:
+            blobs.append(f.read())
+    print(f"Benchmarking preprocessing on {len(blobs)} images from {image_folder}...")
+    results = bench_preprocess(blobs, repeats)
+    parity = preprocess_parity(blobs, names, min_cosine)
+    speedup = results["preprocess/legacy"]["median_ms"] / results["preprocess/fast"]["median_ms"]
+    return {"config": {"image_folder": image_folder, "images": len(blobs), "repeats": repeats},
+            "results": results, "speedup": round(speedup, 2), "preprocess_parity": parity}
+
+
+def print_parity(parity):
+    verdict = "ok" if parity["passed"] else f"FAILED (below {parity['min_cosine']})"
+    print(f"\nPreprocessing parity: embedding cosine mean {parity['mean']:.4f}, "
+          f"min {parity['min']:.4f} {verdict}")
+    if not parity["passed"]:
+        print(f"Worst images: {', '.join(parity['worst'])}")
+
+
+def preprocess_main(args):
+    report = run_preprocess(args.image_folder, args.images, args.repeats, args.min_cosine)
+    for name, result in report["results"].items():
+        print(f"{name:<45} {result['median_ms']:>10.2f} ms {result['items_per_s']:>10} images/s")
+    print(f"Speedup {report['speedup']}x")
+    print_parity(report["preprocess_parity"])
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if not report["preprocess_parity"]["passed"]:
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark preprocessing, extractor, detectors and API")
+    subparsers = parser.add_subparsers(dest="command")
+    preprocess = subparsers.add_parser("preprocess", help="Compare fast and original preprocessing on real images")
+    preprocess.add_argument("image_folder", nargs="?", default="real_medicines")
+    preprocess.add_argument("--images", type=int, default=64)
+    preprocess.add_argument("--repeats", type=int, default=3)
+    preprocess.add_argument("--min-cosine", type=float, default=0.98,
+                            help="Smallest allowed embedding cosine between the two paths")
+    preprocess.add_argument("--output", help="Write the report as JSON to this path")
+    parser.add_argument("--images", type=int, default=16)
+    parser.add_argument("--image-size", type=int, nargs=2, default=(800, 600), metavar=("W", "H"))
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--threads", type=int, nargs="+", default=None,
+                        help="torch thread counts for the extractor (default: 1 and all cores)")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--sections", nargs="+", default=['preprocess', 'extractor', 'detectors', 'api'],
+                        choices=['preprocess', 'extractor', 'detectors', 'api'])
+    parser.add_argument("--output", help="Write the report as JSON to this path")
+    parser.add_argument("--baseline", help="Previous report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed fractional slowdown of a median before it counts as a regression")
+    args = parser.parse_args()
+    if args.command == "preprocess":
+        preprocess_main(args)
+        return
+
+    report = run_suite(args.images, tuple(args.image_size), args.batch_sizes, args.threads,
+                       args.repeats, args.sections)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        report["regressions"] = regressions
+
+    print(f"\n{'benchmark':<45} {'median ms':>10} {'items/s':>10} {'vs base':>8}")
+    for name, result in report["results"].items():
+        ratio = f"{result['ratio']:.2f}x" if "ratio" in result else ""
+        print(f"{name:<45} {result['median_ms']:>10.2f} {result['items_per_s']:>10} {ratio:>8}")
+    if "preprocess_parity" in report:
+        print_parity(report["preprocess_parity"])
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+"""
+Versioned single-file model bundle for the serving detectors.
+
+Layout (all integers little-endian):
+
+    magic        8 bytes   b"FMDBNDL\\0"
+    header_len   uint64
+    header       JSON: format version, bundle id, extractor id, per-detector
+                 settings (method, threshold, calibration, ...) and an array table
+    padding      up to a 64-byte boundary
+    arrays       raw C-ordered array data, each aligned to 64 bytes
+
+Arrays are returned as read-only views into one ``np.memmap`` of the file, so
+worker processes loading the same bundle share the pages through the OS page
+cache instead of each unpickling their own copy. Autoencoder weights are
+tensors over the same views and are frozen; retraining builds a new network.
+"""
+import argparse
+import json
+import os
+import struct
+import time
+import uuid
+import warnings
+import zlib
+import numpy as np
+import torch
+from anomaly_detector import AnomalyDetector
+from knn_index import IVFIndex
+from resnet_extractor import extractor_id
+
+BUNDLE_MAGIC = b"FMDBNDL\0"
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+DEFAULT_BUNDLE_NAME = "model_bundle.fmd"
+INDEX_ARRAYS = ('centroids', 'vectors', 'norms', 'ids', 'offsets')
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _detector_entry(name, detector, arrays):
+    """Header entry for one detector; its arrays are added to `arrays`"""
+    if detector.threshold is None:
+        raise ValueError(f"Detector '{name}' has no threshold; fit it before bundling")
+
+    entry = {
+        "method": detector.method,
+        "threshold": float(detector.threshold),
+        "calibration": dict(getattr(detector, 'calibration', None) or {"scale": 1.0}),
+    }
+    if detector.method == 'kmeans':
+        centroids = getattr(detector, 'centroids', None)
+        if centroids is None:
+            centroids = detector.kmeans.cluster_centers_
+        arrays[f"{name}/centroids"] = np.asarray(centroids, dtype=np.float32)
+        entry["n_clusters"] = int(len(centroids))
+        # Streaming state, so a loaded detector can keep taking partial_fit updates
+        if getattr(detector, 'cluster_counts', None) is not None:
+            arrays[f"{name}/cluster_counts"] = np.asarray(detector.cluster_counts, dtype=np.float64)
+        if getattr(detector, 'distance_stats', None) is not None:
+            entry["distance_stats"] = {k: float(v) for k, v in detector.distance_stats.items()}
+    elif detector.method == 'autoencoder':
+        state = detector.autoencoder.state_dict()
+        entry["input_dim"] = int(state['encoder.0.weight'].shape[1])
+        entry["hidden_dims"] = list(getattr(detector, 'hidden_dims', (256, 128, 64)))
+        entry["state_keys"] = list(state)
+        for key, value in state.items():
+            arrays[f"{name}/autoencoder/{key}"] = value.detach().cpu().numpy()
+    elif detector.method == 'knn':
+        index = detector.index.merge()
+        entry["n_neighbors"] = int(detector.n_neighbors)
+        entry["index"] = {"dim": index.dim, "n_lists": index.n_lists, "auto_lists": index.auto_lists,
+                          "nprobe": index.nprobe, "max_candidates": index.max_candidates,
+                          "merge_threshold": index.merge_threshold, "ntotal": index.ntotal}
+        for key in INDEX_ARRAYS:
+            arrays[f"{name}/index/{key}"] = np.asarray(getattr(index, key))
+    else:
+        raise ValueError(f"Unknown method '{detector.method}' for detector '{name}'")
+    return entry
+
+
+def save_bundle(path, detectors, metadata=None):
+    """
+    Write detectors (name -> fitted AnomalyDetector) to a single bundle file.
+
+    Returns:
+        dict: the bundle header
+    """
+    arrays = {}
+    header = {
+        "format_version": FORMAT_VERSION,
+        "bundle_id": uuid.uuid4().hex,
+        "created": time.time(),
+        "extractor_id": extractor_id(),
+        "metadata": metadata or {},
+        "detectors": {name: _detector_entry(name, det, arrays) for name, det in detectors.items()},
+        "arrays": {},
+    }
+
+    offset = 0
+    for key, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        arrays[key] = array
+        header["arrays"][key] = {
+            "offset": offset,
+            "shape": list(array.shape),
+            "dtype": array.dtype.str,
+            "crc32": zlib.crc32(array.tobytes()),
+        }
+        offset = _align(offset + array.nbytes)
+
+    header_bytes = json.dumps(header).encode()
+    data_start = _align(len(BUNDLE_MAGIC) + 8 + len(header_bytes))
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(BUNDLE_MAGIC)
+        f.write(struct.pack('<Q', len(header_bytes)))
+        f.write(header_bytes)
+        for key, array in arrays.items():
+            f.seek(data_start + header["arrays"][key]["offset"])
+            f.write(array.tobytes())
+    os.replace(tmp_path, path)
+    return header
+
+
+def read_header(path):
+    """Read and validate the bundle header without touching the array data"""
+    with open(path, 'rb') as f:
+        magic = f.read(len(BUNDLE_MAGIC))
+        if magic != BUNDLE_MAGIC:
+            raise ValueError(f"'{path}' is not a model bundle")
+        (header_len,) = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(header_len))
+
+    if header.get("format_version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported bundle format version {header.get('format_version')}, "
+                         f"expected {FORMAT_VERSION}")
+    header["data_start"] = _align(len(BUNDLE_MAGIC) + 8 + header_len)
+    return header
+
+
+def load_arrays(path, header, verify=True):
+    """Map every array in the bundle as a read-only view of one shared memmap"""
+    data = np.memmap(path, dtype=np.uint8, mode='r')
+    arrays = {}
+    for key, spec in header["arrays"].items():
+        dtype = np.dtype(spec["dtype"])
+        count = int(np.prod(spec["shape"], dtype=np.int64))
+        start = header["data_start"] + spec["offset"]
+        end = start + count * dtype.itemsize
+        if end > len(data):
+            raise ValueError(f"Bundle '{path}' is truncated: array '{key}' ends past the file")
+        array = data[start:end].view(dtype).reshape(spec["shape"])
+        if verify and zlib.crc32(array.tobytes()) != spec["crc32"]:
+            raise ValueError(f"Bundle '{path}' is corrupt: checksum mismatch for '{key}'")
+        arrays[key] = array
+    return arrays
+
+
+def _build_detector(name, entry, arrays):
+    detector = AnomalyDetector(method=entry["method"], hidden_dims=entry.get("hidden_dims", (256, 128, 64)))
+    detector.threshold = entry["threshold"]
+    detector.calibration = entry["calibration"]
+
+    if entry["method"] == 'kmeans':
+        detector.n_clusters = entry["n_clusters"]
+        detector.centroids = arrays[f"{name}/centroids"]
+        if f"{name}/cluster_counts" in arrays:
+            detector.cluster_counts = np.array(arrays[f"{name}/cluster_counts"])
+        detector.distance_stats = entry.get("distance_stats")
+    elif entry["method"] == 'autoencoder':
+        detector.autoencoder = detector.build_autoencoder(entry["input_dim"])
+        with warnings.catch_warnings():
+            # The tensors share the read-only memmap; nothing writes to them once frozen below
+            warnings.filterwarnings("ignore", message="The given NumPy array is not writable")
+            state = {key: torch.from_numpy(arrays[f"{name}/autoencoder/{key}"])
+                     for key in entry["state_keys"]}
+        detector.autoencoder.load_state_dict(state, assign=True)
+        detector.autoencoder.requires_grad_(False)
+        detector.autoencoder.eval()
+    elif entry["method"] == 'knn':
+        detector.n_neighbors = entry["n_neighbors"]
+        meta = entry["index"]
+        index = IVFIndex(meta["dim"], meta["n_lists"], meta["nprobe"], meta["max_candidates"],
+                         meta["merge_threshold"])
+        index.auto_lists = meta["auto_lists"]
+        index.ntotal = meta["ntotal"]
+        for key in INDEX_ARRAYS:
+            setattr(index, key, arrays[f"{name}/index/{key}"])
+        index._centroid_norms = np.einsum('ij,ij->i', index.centroids, index.centroids)
+        detector.index = index
+    else:
+        raise ValueError(f"Unknown method '{entry['method']}' for detector '{name}'")
+    return detector
+
+
+def load_bundle(path, verify=True, backend=None):
+    """
+    Load and validate a bundle.
+
+    Args:
+        path (str): bundle file
+        verify (bool): check array checksums (reads every array page once)
+        backend (str): extractor backend the detectors will score embeddings of;
+            defaults to the current one
+
+    Returns:
+        tuple: (header dict, dict of detector name -> AnomalyDetector)
+    """
+    header = read_header(path)
+    expected = extractor_id(backend)
+    if header["extractor_id"] != expected:
+        raise ValueError(f"Bundle was built for extractor '{header['extractor_id']}', "
+                         f"but the current extractor is '{expected}'")
+
+    arrays = load_arrays(path, header, verify)
+    detectors = {name: _build_detector(name, entry, arrays)
+                 for name, entry in header["detectors"].items()}
+    return header, detectors
+
+
+def load_legacy_autoencoder(path, threshold):
+    """Autoencoder detector from a legacy weights-only autoencoder_detector.pth"""
+    if threshold is None:
+        raise ValueError("autoencoder_detector.pth does not store a threshold; pass one explicitly")
+    detector = AnomalyDetector(method='autoencoder')
+    detector.autoencoder = detector.build_autoencoder()
+    state = torch.load(path, map_location='cpu')
+    if set(state) != set(detector.autoencoder.state_dict()):
+        state = _insert_dropout_slots(state)
+    detector.autoencoder.load_state_dict(state)
+    detector.autoencoder.eval()
+    detector.threshold = float(threshold)
+    return detector
+
+
+def _insert_dropout_slots(state):
+    """
+    Renumber weights saved by networks built without Dropout (Linear, BatchNorm,
+    ReLU per block) to the current layout (Linear, BatchNorm, ReLU, Dropout).
+    Dropout has no weights and is a no-op in eval mode, so scores are unchanged.
+    """
+    renamed = {}
+    for key, value in state.items():
+        part, layer, name = key.split('.', 2)
+        layer = int(layer)
+        renamed[f"{part}.{layer // 3 * 4 + layer % 3}.{name}"] = value
+    return renamed
+
+
+def convert_legacy(kmeans_path, autoencoder_path, autoencoder_threshold, output):
+    """Bundle the legacy kmeans_detector.joblib / autoencoder_detector.pth pair"""
+    import joblib
+
+    detectors = {}
+    if kmeans_path:
+        detectors['kmeans'] = joblib.load(kmeans_path)
+    if autoencoder_path:
+        detectors['autoencoder'] = load_legacy_autoencoder(autoencoder_path, autoencoder_threshold)
+    return save_bundle(output, detectors, metadata={"converted_from": [kmeans_path, autoencoder_path]})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or create model bundles")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    info = subparsers.add_parser("info", help="Validate a bundle and report its contents and load time")
+    info.add_argument("path", nargs="?", default=DEFAULT_BUNDLE_NAME)
+    info.add_argument("--backend", default=None, help="Extractor backend to validate against (default: eager)")
+
+    convert = subparsers.add_parser("convert", help="Bundle legacy joblib/pth detector files")
+    convert.add_argument("--kmeans", default=None)
+    convert.add_argument("--autoencoder", default=None)
+    convert.add_argument("--autoencoder-threshold", type=float, default=None)
+    convert.add_argument("--output", default=DEFAULT_BUNDLE_NAME)
+
+    args = parser.parse_args()
+    if args.command == "convert":
+        header = convert_legacy(args.kmeans, args.autoencoder, args.autoencoder_threshold, args.output)
+        print(f"Wrote {args.output} with detectors {list(header['detectors'])}")
+        return
+
+    start = time.perf_counter()
+    header, detectors = load_bundle(args.path, backend=args.backend)
+    load_ms = (time.perf_counter() - start) * 1000
+    print(f"Bundle {header['bundle_id']} (format v{header['format_version']}, "
+          f"extractor {header['extractor_id']}), loaded in {load_ms:.1f} ms")
+    for name, entry in header["detectors"].items():
+        print(f"  {name}: method={entry['method']} threshold={entry['threshold']:.6g}")
+
+
+if __name__ == "__main__":
+    main()
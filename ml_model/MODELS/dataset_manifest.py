@@ -0,0 +1,240 @@
+"""
+Columnar manifest of the labelled image dataset.
+
+One .npz file holds a column per field (path, label, sha256, size, mtime_ns,
+width, height, embedding_row), so training code can load, filter and split
+the dataset, and fetch its embeddings from the embedding store, without
+opening a single image. Rescans are incremental: files whose size and mtime
+are unchanged keep their hash and dimensions, only new or changed files are
+read.
+
+    python dataset_manifest.py scan --store embedding_store
+    python dataset_manifest.py info
+"""
+import argparse
+import os
+import numpy as np
+from PIL import Image
+
+DEFAULT_MANIFEST = "dataset_manifest.npz"
+LABELS = ("real", "fake")
+DEFAULT_FOLDERS = {"real_medicines": 0, "fake_medicines": 1}
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+COLUMNS = {
+    "path": str,
+    "label": np.int8,
+    "sha256": "S64",
+    "size": np.int64,
+    "mtime_ns": np.int64,
+    "width": np.int32,
+    "height": np.int32,
+    # Row in the embedding store's vectors.npy when last scanned, -1 when not embedded. Rows move
+    # as the store evicts and reuses them, so embeddings() looks them up again by hash
+    "embedding_row": np.int64,
+}
+
+
+class DatasetManifest:
+    def __init__(self, columns=None, extractor_version=""):
+        columns = columns or {}
+        self.columns = {name: np.asarray(columns.get(name, []), dtype=dtype) for name, dtype in COLUMNS.items()}
+        self.extractor_version = extractor_version
+
+    def __len__(self):
+        return len(self.columns["path"])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    @classmethod
+    def load(cls, path=DEFAULT_MANIFEST):
+        with np.load(path) as data:
+            return cls({name: data[name] for name in COLUMNS}, str(data["extractor_version"]))
+
+    def save(self, path=DEFAULT_MANIFEST):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, extractor_version=np.array(self.extractor_version), **self.columns)
+        os.replace(tmp_path, path)
+
+    def select(self, mask_or_indices):
+        """Subset of the rows, as a new manifest"""
+        return DatasetManifest({name: column[mask_or_indices] for name, column in self.columns.items()},
+                               self.extractor_version)
+
+    def filter(self, label=None, folder=None, min_side=None, embedded=None):
+        """
+        Rows matching every given condition.
+
+        Args:
+            label: 0/1 or 'real'/'fake'
+            folder (str): only paths directly inside this folder
+            min_side (int): smallest allowed width and height
+            embedded (bool): only rows with (or without) a stored embedding
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if label is not None:
+            mask &= self["label"] == (LABELS.index(label) if isinstance(label, str) else label)
+        if folder is not None:
+            folder = os.path.normpath(folder)
+            mask &= np.array([os.path.dirname(p) == folder for p in self["path"]], dtype=bool)
+        if min_side is not None:
+            mask &= np.minimum(self["width"], self["height"]) >= min_side
+        if embedded is not None:
+            mask &= (self["embedding_row"] >= 0) == embedded
+        return self.select(mask)
+
+    def split(self, val_size=0.2, test_size=0.0, random_state=42):
+        """
+        Stratified split by label.
+
+        Returns:
+            tuple: (train, val) manifests, or (train, val, test) when test_size > 0
+        """
+        from sklearn.model_selection import train_test_split
+
+        idx = np.arange(len(self))
+        labels = self["label"]
+        train, rest = train_test_split(idx, test_size=val_size + test_size, random_state=random_state,
+                                       stratify=labels)
+        if not test_size:
+            return self.select(np.sort(train)), self.select(np.sort(rest))
+        val, test = train_test_split(rest, test_size=test_size / (val_size + test_size),
+                                     random_state=random_state, stratify=labels[rest])
+        return self.select(np.sort(train)), self.select(np.sort(val)), self.select(np.sort(test))
+
+    def embeddings(self, store):
+        """
+        Embeddings of the rows that have one, read from an EmbeddingStore.
+
+        Rows are resolved by content hash at read time, so rows the store has
+        moved since the scan still get their own vectors.
+
+        Returns:
+            tuple: (embeddings array, labels array)
+        """
+        if self.extractor_version and self.extractor_version != store.extractor_version:
+            raise ValueError(f"Manifest rows point into a {self.extractor_version} store, "
+                             f"not {store.extractor_version}; rescan with this store")
+        store_rows = store.index["rows"]
+        rows = np.array([store_rows.get(store.key(digest.decode()), -1) for digest in self["sha256"]],
+                        dtype=np.int64)
+        found = rows >= 0
+        return np.asarray(store.vectors[rows[found]]), self["label"][found]
+
+    def summary(self):
+        counts = {name: int(np.sum(self["label"] == i)) for i, name in enumerate(LABELS)}
+        return {"rows": len(self), **counts, "embedded": int(np.sum(self["embedding_row"] >= 0)),
+                "bytes": int(self["size"].sum()), "extractor_version": self.extractor_version}
+
+
+def image_size(path):
+    """(width, height) from the image header, without decoding the pixels"""
+    with Image.open(path) as image:
+        return image.size
+
+
+def scan(folders=None, previous=None, store=None, embed=False):
+    """
+    Build a manifest for the images in `folders` (folder -> label), reusing the
+    hash and dimensions from `previous` for files whose size and mtime match.
+
+    Args:
+        store: optional EmbeddingStore to fill embedding_row from; without one,
+            unchanged files keep their embedding_row from `previous`
+        embed (bool): embed files missing from the store first
+
+    Returns:
+        tuple: (DatasetManifest, counts of added/changed/unchanged/removed/unreadable files)
+    """
+    from embedding_store import file_hash
+
+    folders = folders or DEFAULT_FOLDERS
+    known = {}
+    if previous is not None:
+        for i, path in enumerate(previous["path"]):
+            known[path] = i
+
+    rows = {name: [] for name in COLUMNS}
+    carried_rows = []
+    counts = {"added": 0, "changed": 0, "unchanged": 0, "removed": 0, "unreadable": 0}
+    seen = set()
+    for folder, label in folders.items():
+        with os.scandir(folder) as entries:
+            files = sorted((entry.name, entry.stat()) for entry in entries
+                           if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS))
+        for name, st in files:
+            path = os.path.join(os.path.normpath(folder), name)
+            seen.add(path)
+            i = known.get(path)
+            if i is not None and previous["size"][i] == st.st_size and previous["mtime_ns"][i] == st.st_mtime_ns:
+                digest, width, height = previous["sha256"][i].decode(), previous["width"][i], previous["height"][i]
+                carried_rows.append(previous["embedding_row"][i])
+                counts["unchanged"] += 1
+            else:
+                try:
+                    width, height = image_size(path)
+                except Exception as e:
+                    print(f"Error processing {name}: {str(e)}")
+                    counts["unreadable"] += 1
+                    continue
+                digest = file_hash(path)
+                carried_rows.append(-1)
+                counts["changed" if i is not None else "added"] += 1
+            for column, value in (("path", path), ("label", label), ("sha256", digest), ("size", st.st_size),
+                                  ("mtime_ns", st.st_mtime_ns), ("width", width), ("height", height)):
+                rows[column].append(value)
+    if previous is not None:
+        counts["removed"] = sum(1 for path in previous["path"] if path not in seen)
+
+    if store is not None and embed:
+        store.embed_paths(rows["path"])
+    if store is not None:
+        store_rows = store.index["rows"]
+        rows["embedding_row"] = [store_rows.get(store.key(digest), -1) for digest in rows["sha256"]]
+        extractor_version = store.extractor_version
+    else:
+        rows["embedding_row"] = carried_rows
+        extractor_version = previous.extractor_version if previous is not None else ""
+
+    return DatasetManifest(rows, extractor_version), counts
+
+
+def update_manifest(path=DEFAULT_MANIFEST, folders=None, store=None, embed=False):
+    """Rescan incrementally against the manifest at `path` and save it back"""
+    previous = DatasetManifest.load(path) if os.path.exists(path) else None
+    manifest, counts = scan(folders, previous, store, embed)
+    manifest.save(path)
+    return manifest, counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or inspect the dataset manifest")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    scan_parser = sub.add_parser("scan", help="Incrementally rescan the image folders")
+    scan_parser.add_argument("--real", default="real_medicines")
+    scan_parser.add_argument("--fake", default="fake_medicines")
+    scan_parser.add_argument("--output", default=DEFAULT_MANIFEST)
+    scan_parser.add_argument("--store", help="Embedding store directory to link embedding rows from")
+    scan_parser.add_argument("--embed", action="store_true", help="Embed files missing from the store")
+
+    info_parser = sub.add_parser("info", help="Print a summary of a manifest")
+    info_parser.add_argument("path", nargs="?", default=DEFAULT_MANIFEST)
+    args = parser.parse_args()
+
+    if args.command == "scan":
+        store = None
+        if args.store:
+            from embedding_store import EmbeddingStore
+            store = EmbeddingStore(args.store)
+        manifest, counts = update_manifest(args.output, {args.real: 0, args.fake: 1}, store, args.embed)
+        print(f"Scanned {len(manifest)} images: " + ", ".join(f"{v} {k}" for k, v in counts.items()))
+        print(f"Manifest written to {args.output}")
+    else:
+        print(DatasetManifest.load(args.path).summary())
+
+
+if __name__ == "__main__":
+    main()
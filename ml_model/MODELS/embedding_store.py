@@ -0,0 +1,175 @@
+import hashlib
+import json
+import os
+import numpy as np
+from resnet_extractor import EMBEDDING_DIM, extractor_id, iter_path_embeddings, list_images
+
+DEFAULT_STORE_DIR = os.environ.get("EMBEDDING_STORE_DIR", "embedding_store")
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """SHA-256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class EmbeddingStore:
+    """
+    Persistent embedding cache keyed by image content hash plus extractor version.
+
+    Vectors live in a memory-mapped ``vectors.npy`` and a small ``index.json``
+    maps keys to rows and remembers the size/mtime of every path seen so
+    unchanged files are not even rehashed. Rows of evicted entries are reused
+    by later inserts.
+    """
+
+    def __init__(self, root=DEFAULT_STORE_DIR, extractor_version=None, dim=EMBEDDING_DIM):
+        self.root = root
+        self.extractor_version = extractor_version or extractor_id()
+        self.dim = dim
+        self.index_path = os.path.join(root, 'index.json')
+        self.vectors_path = os.path.join(root, 'vectors.npy')
+        os.makedirs(root, exist_ok=True)
+
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+        else:
+            self.index = {"dim": dim, "size": 0, "rows": {}, "paths": {}, "free": []}
+
+        if self.index["dim"] != dim or not os.path.exists(self.vectors_path):
+            self.index = {"dim": dim, "size": 0, "rows": {}, "paths": {}, "free": []}
+            self.vectors = np.lib.format.open_memmap(self.vectors_path, mode='w+',
+                                                     dtype=np.float32, shape=(1024, dim))
+        else:
+            self.vectors = np.load(self.vectors_path, mmap_mode='r+')
+
+    def __len__(self):
+        return len(self.index["rows"])
+
+    def key(self, content_hash):
+        return f"{self.extractor_version}/{content_hash}"
+
+    def _path_key(self, path):
+        """Content key for a file, reusing the stored hash when size and mtime match"""
+        st = os.stat(path)
+        cached = self.index["paths"].get(path)
+        if cached is not None and cached[1] == st.st_size and cached[2] == st.st_mtime_ns:
+            content_hash = cached[0]
+        else:
+            content_hash = file_hash(path)
+        self.index["paths"][path] = [content_hash, st.st_size, st.st_mtime_ns]
+        return self.key(content_hash)
+
+    def _allocate_row(self):
+        if self.index["free"]:
+            return self.index["free"].pop()
+        row = self.index["size"]
+        if row >= len(self.vectors):
+            self._grow(2 * len(self.vectors))
+        self.index["size"] += 1
+        return row
+
+    def _grow(self, capacity, chunk_size=65536):
+        tmp_path = self.vectors_path + '.tmp'
+        grown = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32,
+                                          shape=(capacity, self.dim))
+        used = self.index["size"]
+        for start in range(0, used, chunk_size):
+            end = min(start + chunk_size, used)
+            grown[start:end] = self.vectors[start:end]
+        grown.flush()
+        del grown
+        self.vectors = None
+        os.replace(tmp_path, self.vectors_path)
+        self.vectors = np.load(self.vectors_path, mmap_mode='r+')
+
+    def embed_paths(self, paths, batch_size=32, num_workers=None):
+        """
+        Embeddings for a list of image files, running the extractor only on
+        files whose content is not already in the store.
+
+        Returns:
+            tuple: (embeddings array, list of paths that were embedded successfully)
+        """
+        paths = [os.path.abspath(p) for p in paths]
+        keys = [self._path_key(p) for p in paths]
+        rows = self.index["rows"]
+
+        missing = {}
+        for path, key in zip(paths, keys):
+            if key not in rows and key not in missing:
+                missing[key] = path
+
+        if missing:
+            print(f"Embedding {len(missing)} new or changed images "
+                  f"({len(paths) - len(missing)} cached)")
+            missing_keys = list(missing)
+            missing_paths = [missing[k] for k in missing_keys]
+            for indices, emb in iter_path_embeddings(missing_paths, batch_size, num_workers):
+                for i, vector in zip(indices, emb):
+                    row = self._allocate_row()
+                    self.vectors[row] = vector
+                    rows[missing_keys[i]] = row
+            self.save()
+
+        found = [(path, rows[key]) for path, key in zip(paths, keys) if key in rows]
+        if not found:
+            return np.empty((0, self.dim), dtype=np.float32), []
+        found_paths, found_rows = zip(*found)
+        return np.asarray(self.vectors[list(found_rows)]), list(found_paths)
+
+    def get_embeddings(self, image_folder, batch_size=32, num_workers=None):
+        """
+        Cached drop-in for ``extract_embeddings``: returns (embeddings, filenames)
+        for a folder and evicts entries for files that left or changed in it.
+        """
+        image_files = list_images(image_folder)
+        folder = os.path.abspath(image_folder)
+        paths = [os.path.join(folder, fname) for fname in image_files]
+
+        # Forget paths in this folder that no longer exist
+        current = set(paths)
+        for path in list(self.index["paths"]):
+            if os.path.dirname(path) == folder and path not in current:
+                del self.index["paths"][path]
+
+        embeddings, found = self.embed_paths(paths, batch_size, num_workers)
+        self.evict_stale()
+
+        if not found:
+            raise ValueError("No images were successfully processed")
+        return embeddings, [os.path.basename(p) for p in found]
+
+    def iter_vectors(self, chunk_size=65536):
+        """Yield (keys, embeddings) chunks for every live entry in the store"""
+        items = sorted(self.index["rows"].items(), key=lambda item: item[1])
+        for start in range(0, len(items), chunk_size):
+            keys, rows = zip(*items[start:start + chunk_size])
+            yield list(keys), np.asarray(self.vectors[list(rows)])
+
+    def evict_stale(self):
+        """Free rows whose key is no longer referenced by any known path or extractor version"""
+        live = {self.key(entry[0]) for entry in self.index["paths"].values()}
+        stale = [key for key in self.index["rows"] if key not in live]
+        for key in stale:
+            self.index["free"].append(self.index["rows"].pop(key))
+        if stale:
+            self.save()
+        return len(stale)
+
+    def save(self):
+        self.vectors.flush()
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self.index_path)
+
+
+def cached_extract_embeddings(image_folder, store_dir=DEFAULT_STORE_DIR, batch_size=32, num_workers=None):
+    """``extract_embeddings`` backed by the persistent embedding store"""
+    store = EmbeddingStore(store_dir)
+    return store.get_embeddings(image_folder, batch_size, num_workers)
@@ -0,0 +1,275 @@
+"""
+Alternative inference backends for the ResNet-18 feature extractor.
+
+Every backend is built from the eager model and returns a runner that maps a
+float tensor of shape (N, 3, 224, 224) to a numpy array of shape (N, 512):
+
+    eager         fp32 PyTorch eager mode (the default)
+    torchscript   traced, frozen and inference-optimized TorchScript
+    onnx          fp32 ONNX Runtime
+    dynamic_int8  ONNX Runtime with int8 weights, activations quantized on the fly
+    static_int8   ONNX Runtime with int8 weights and activations, calibrated on images
+
+ONNX Runtime is only imported when one of its backends is selected; install
+it with `pip install -r requirements-onnx.txt`.
+
+Run this module directly to compare backends on a folder of images:
+
+    python inference_backends.py real_medicines --backends eager onnx static_int8
+"""
+import argparse
+import copy
+import hashlib
+import inspect
+import json
+import os
+import time
+import numpy as np
+import torch
+
+BACKENDS = ('eager', 'torchscript', 'onnx', 'dynamic_int8', 'static_int8')
+INT8_BACKENDS = ('dynamic_int8', 'static_int8')
+DEFAULT_CACHE_DIR = os.environ.get("BACKEND_CACHE_DIR", "backend_cache")
+DEFAULT_CALIBRATION_FOLDER = os.environ.get("CALIBRATION_FOLDER", "real_medicines")
+INPUT_SHAPE = (3, 224, 224)
+
+
+def build_backend(name, model, calibration_folder=DEFAULT_CALIBRATION_FOLDER,
+                  cache_dir=DEFAULT_CACHE_DIR, calibration_images=64, model_id="resnet18"):
+    """
+    Build a runner for the named backend from the eager extractor.
+    
+    Exported and quantized ONNX files are cached in cache_dir under model_id,
+    so change model_id whenever the weights change. Static int8 models are
+    additionally keyed by the calibration set (see calibration_key).
+    """
+    if name == 'eager':
+        device = next(model.parameters()).device
+
+        def run(batch):
+            with torch.no_grad():
+                return model(batch.to(device, non_blocking=True)).cpu().numpy()
+        return run
+
+    # The remaining backends run on CPU
+    cpu_model = copy.deepcopy(model).cpu().eval()
+
+    if name == 'torchscript':
+        example = torch.zeros((1,) + INPUT_SHAPE)
+        with torch.no_grad():
+            scripted = torch.jit.optimize_for_inference(
+                torch.jit.freeze(torch.jit.trace(cpu_model, example)))
+
+        def run(batch):
+            with torch.no_grad():
+                return scripted(batch.cpu()).numpy()
+        return run
+
+    if name in ('onnx',) + INT8_BACKENDS:
+        os.makedirs(cache_dir, exist_ok=True)
+        prefix = os.path.join(cache_dir, model_id)
+        fp32_path = export_onnx(cpu_model, prefix + '.onnx')
+        if name == 'onnx':
+            return _ort_runner(fp32_path)
+        if name == 'dynamic_int8':
+            return _ort_runner(quantize_onnx_dynamic(fp32_path, prefix))
+        return _ort_runner(quantize_onnx_static(fp32_path, prefix, calibration_folder,
+                                                calibration_images))
+
+    raise ValueError(f"Unknown backend '{name}', expected one of {BACKENDS}")
+
+
+def _build_once(path, build):
+    """
+    Create a cached artifact with build(tmp_path) unless it already exists.
+
+    The file is written under a per-process name and renamed into place, so
+    server workers building the same artifact concurrently never load a
+    half-written model.
+    """
+    if os.path.exists(path):
+        return path
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        build(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
+
+
+def export_onnx(model, path):
+    """Export the extractor to ONNX with a dynamic batch dimension"""
+    # Newer torch defaults to the dynamo exporter; older releases have no such flag
+    options = {}
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        options['dynamo'] = False
+
+    def build(tmp_path):
+        example = torch.zeros((1,) + INPUT_SHAPE)
+        torch.onnx.export(model, (example,), tmp_path, input_names=['input'],
+                          output_names=['embedding'], opset_version=17,
+                          dynamic_axes={'input': {0: 'batch'}, 'embedding': {0: 'batch'}},
+                          **options)
+    return _build_once(path, build)
+
+
+def _ort_runner(path):
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.intra_op_num_threads = torch.get_num_threads()
+    options.inter_op_num_threads = 1
+    session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+
+    def run(batch):
+        inputs = np.ascontiguousarray(batch.cpu().numpy(), dtype=np.float32)
+        return session.run(None, {'input': inputs})[0]
+    return run
+
+
+def quantize_onnx_dynamic(fp32_path, prefix):
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    return _build_once(prefix + '.dynamic_int8.onnx',
+                       lambda tmp_path: quantize_dynamic(fp32_path, tmp_path, weight_type=QuantType.QInt8))
+
+
+def calibration_batches(image_folder, n_images=64, batch_size=16):
+    """Transformed network inputs from the first n_images of a folder"""
+    from resnet_extractor import list_images, ImageFileDataset, _collate
+
+    image_files = list_images(image_folder)[:n_images]
+    dataset = ImageFileDataset([os.path.join(image_folder, f) for f in image_files])
+    samples = [dataset[i] for i in range(len(dataset))]
+    for start in range(0, len(samples), batch_size):
+        _, batch = _collate(samples[start:start + batch_size])
+        if batch is not None:
+            yield batch
+
+
+def calibration_key(image_folder, n_images=64):
+    """
+    Short digest of the calibration set: the folder, the image count and the
+    name, size and mtime of every image used, so a different or changed
+    calibration set never reuses a cached static int8 model.
+    """
+    from resnet_extractor import list_images
+
+    digest = hashlib.sha256(f"{os.path.abspath(image_folder)}:{n_images}".encode())
+    for fname in list_images(image_folder)[:n_images]:
+        st = os.stat(os.path.join(image_folder, fname))
+        digest.update(f":{fname}:{st.st_size}:{st.st_mtime_ns}".encode())
+    return digest.hexdigest()[:12]
+
+
+def quantize_onnx_static(fp32_path, prefix, calibration_folder, n_images=64):
+    from onnxruntime.quantization import (CalibrationDataReader, QuantFormat, QuantType,
+                                          quantize_static)
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    class ImageReader(CalibrationDataReader):
+        def __init__(self):
+            self.batches = ({'input': batch.numpy()}
+                            for batch in calibration_batches(calibration_folder, n_images))
+
+        def get_next(self):
+            return next(self.batches, None)
+
+    def build(tmp_path):
+        # The shape-inferred intermediate is private to this build
+        prepared_path = f"{prefix}.prepared.{os.getpid()}.onnx"
+        try:
+            quant_pre_process(fp32_path, prepared_path)
+            quantize_static(prepared_path, tmp_path, ImageReader(), quant_format=QuantFormat.QDQ,
+                            per_channel=True, weight_type=QuantType.QInt8,
+                            activation_type=QuantType.QUInt8)
+        finally:
+            if os.path.exists(prepared_path):
+                os.remove(prepared_path)
+    key = calibration_key(calibration_folder, n_images)
+    return _build_once(f"{prefix}.static_int8.{key}.onnx", build)
+
+
+def _rss_mb():
+    """Resident set size of this process in MB"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def compare_backends(image_folder, backends=BACKENDS, batch_size=16, n_images=64,
+                     repeats=5, calibration_folder=DEFAULT_CALIBRATION_FOLDER):
+    """
+    Embedding drift versus fp32 eager, latency and memory for each backend.
+
+    Returns:
+        dict: backend name -> report
+    """
+    from resnet_extractor import load_model, EXTRACTOR_VERSION
+
+    resnet = load_model()
+
+    batches = list(calibration_batches(image_folder, n_images, batch_size))
+    inputs = torch.cat(batches)
+    reference = build_backend('eager', resnet)(inputs)
+
+    reports = {}
+    for name in backends:
+        rss_before = _rss_mb()
+        start = time.perf_counter()
+        run = build_backend(name, resnet, calibration_folder,
+                            model_id=EXTRACTOR_VERSION)
+        build_seconds = time.perf_counter() - start
+
+        run(batches[0])  # warm-up
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            outputs = [run(batch) for batch in batches]
+            timings.append(time.perf_counter() - start)
+        embeddings = np.concatenate(outputs)
+
+        cosine = np.sum(embeddings * reference, axis=1) / (
+            np.linalg.norm(embeddings, axis=1) * np.linalg.norm(reference, axis=1) + 1e-12)
+        per_image_ms = np.median(timings) * 1000 / len(inputs)
+        reports[name] = {
+            "build_seconds": round(build_seconds, 3),
+            "latency_ms_per_image": round(float(per_image_ms), 3),
+            "throughput_images_per_s": round(1000 / per_image_ms, 1),
+            "rss_delta_mb": round(_rss_mb() - rss_before, 1),
+            "drift_max_abs": float(np.max(np.abs(embeddings - reference))),
+            "drift_mean_cosine": float(np.mean(cosine)),
+            "drift_min_cosine": float(np.min(cosine)),
+        }
+        print(f"{name:>13}: {per_image_ms:7.2f} ms/image, "
+              f"min cosine vs fp32 {reports[name]['drift_min_cosine']:.5f}, "
+              f"RSS +{reports[name]['rss_delta_mb']} MB")
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare feature extractor inference backends")
+    parser.add_argument("image_folder", nargs="?", default=DEFAULT_CALIBRATION_FOLDER)
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--images", type=int, default=64)
+    parser.add_argument("--output", help="Write the report as JSON to this path")
+    args = parser.parse_args()
+
+    reports = compare_backends(args.image_folder, args.backends, args.batch_size, args.images)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
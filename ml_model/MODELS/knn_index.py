@@ -0,0 +1,243 @@
+import json
+import os
+import numpy as np
+
+
+def train_centroids(X, n_lists, n_iter=10, random_state=42, chunk_size=8192):
+    """Lloyd k-means in numpy, splitting the largest list whenever one ends up empty"""
+    rng = np.random.default_rng(random_state)
+    centroids = X[rng.choice(len(X), n_lists, replace=False)].astype(np.float32)
+    for _ in range(n_iter):
+        assign = assign_lists(X, centroids, chunk_size)
+        counts = np.bincount(assign, minlength=n_lists)
+        order = np.argsort(assign, kind='stable')
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        nonempty = counts > 0
+        sums = np.add.reduceat(X[order], starts[nonempty], axis=0)
+        centroids[nonempty] = sums / counts[nonempty, None]
+        for empty in np.flatnonzero(~nonempty):
+            big = np.argmax(counts)
+            eps = rng.normal(scale=1e-3, size=X.shape[1]).astype(np.float32) * np.linalg.norm(centroids[big])
+            centroids[empty] = centroids[big] + eps
+            centroids[big] = centroids[big] - eps
+            counts[empty] = counts[big] // 2
+            counts[big] -= counts[empty]
+    return centroids
+
+
+def assign_lists(X, centroids, chunk_size=8192):
+    """Index of the nearest centroid for each row of X"""
+    centroid_norms = np.einsum('ij,ij->i', centroids, centroids)
+    return np.concatenate([
+        np.argmin(centroid_norms[None, :] - 2 * (X[start:start + chunk_size] @ centroids.T), axis=1)
+        for start in range(0, len(X), chunk_size)
+    ])
+
+
+def default_n_lists(n):
+    """Exact search (one list) for small galleries, ~4*sqrt(n) lists beyond that"""
+    return 1 if n < 10000 else int(4 * np.sqrt(n))
+
+
+class IVFIndex:
+    """
+    Inverted-file (IVF) index for approximate nearest-neighbour search in L2.
+
+    Vectors are assigned to the nearest of ``n_lists`` coarse centroids and
+    stored contiguously per list, so a query only scans the ``nprobe`` lists
+    whose centroids are closest to it, stopping early once ``max_candidates``
+    vectors have been scanned. New vectors go to a small delta buffer that is
+    searched alongside the main lists and merged in once it grows; when the
+    index outgrows its list count it is retrained on merge. The arrays are
+    saved as .npy files and can be memory-mapped on load.
+    """
+
+    def __init__(self, dim=512, n_lists=None, nprobe=8, max_candidates=16384,
+                 merge_threshold=65536):
+        self.dim = dim
+        self.n_lists = n_lists
+        self.auto_lists = n_lists is None
+        self.nprobe = nprobe
+        self.max_candidates = max_candidates
+        self.merge_threshold = merge_threshold
+        self.centroids = None
+        self.ntotal = 0
+        self._reset_lists()
+
+    def _reset_lists(self):
+        self.vectors = np.empty((0, self.dim), dtype=np.float32)
+        self.norms = np.empty(0, dtype=np.float32)
+        self.ids = np.empty(0, dtype=np.int64)
+        self.offsets = np.zeros((self.n_lists or 0) + 1, dtype=np.int64)
+        self._clear_delta()
+
+    def _clear_delta(self):
+        self.delta_vectors = np.empty((0, self.dim), dtype=np.float32)
+        self.delta_norms = np.empty(0, dtype=np.float32)
+        self.delta_ids = np.empty(0, dtype=np.int64)
+        self.delta_lists = np.empty(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.ids) + len(self.delta_ids)
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    def train(self, X, samples_per_list=32, random_state=42):
+        """Learn the coarse centroids from a sample of X; clears stored vectors"""
+        X = np.asarray(X, dtype=np.float32)
+        if self.auto_lists:
+            self.n_lists = default_n_lists(len(X))
+        self.n_lists = max(1, min(self.n_lists, len(X)))
+
+        n_samples = samples_per_list * self.n_lists
+        if len(X) > n_samples:
+            rng = np.random.default_rng(random_state)
+            X = X[np.sort(rng.choice(len(X), n_samples, replace=False))]
+
+        if self.n_lists == 1:
+            self.centroids = X.mean(axis=0, keepdims=True)
+        else:
+            self.centroids = train_centroids(X, self.n_lists, random_state=random_state)
+        self._centroid_norms = np.einsum('ij,ij->i', self.centroids, self.centroids)
+        self._reset_lists()
+        return self
+
+    def _assign(self, X):
+        return assign_lists(X, self.centroids)
+
+    def add(self, X, ids=None):
+        """Add vectors; the first call trains the centroids if needed"""
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if len(X) == 0:
+            return self
+        if not self.is_trained:
+            self.train(X)
+        if ids is None:
+            ids = np.arange(self.ntotal, self.ntotal + len(X), dtype=np.int64)
+        self.ntotal = max(self.ntotal, int(np.max(ids)) + 1)
+
+        self.delta_vectors = np.concatenate([self.delta_vectors, X])
+        self.delta_norms = np.concatenate([self.delta_norms, np.einsum('ij,ij->i', X, X)])
+        self.delta_ids = np.concatenate([self.delta_ids, np.asarray(ids, dtype=np.int64)])
+        self.delta_lists = np.concatenate([self.delta_lists, self._assign(X)])
+
+        if len(self.delta_ids) >= max(self.merge_threshold, len(self.ids) // 10):
+            self.merge()
+        return self
+
+    def merge(self):
+        """Fold the delta buffer into the per-list storage"""
+        if len(self.delta_ids) == 0:
+            return self
+        if self.auto_lists and default_n_lists(len(self)) >= 2 * self.n_lists:
+            return self.retrain()
+        lists = np.concatenate([np.repeat(np.arange(self.n_lists), np.diff(self.offsets)),
+                                self.delta_lists])
+        order = np.argsort(lists, kind='stable')
+        self.vectors = np.concatenate([self.vectors, self.delta_vectors])[order]
+        self.norms = np.concatenate([self.norms, self.delta_norms])[order]
+        self.ids = np.concatenate([self.ids, self.delta_ids])[order]
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(lists, minlength=self.n_lists))])
+        self._clear_delta()
+        return self
+
+    def retrain(self):
+        """Re-learn the centroids for the current size and redistribute every vector"""
+        vectors = np.concatenate([self.vectors, self.delta_vectors])
+        ids = np.concatenate([self.ids, self.delta_ids])
+        self.train(vectors)
+        self.delta_vectors = vectors
+        self.delta_norms = np.einsum('ij,ij->i', vectors, vectors)
+        self.delta_ids = ids
+        self.delta_lists = self._assign(vectors)
+        return self.merge()
+
+    def search(self, Q, k=5):
+        """
+        Find the k nearest stored vectors for each query.
+
+        Returns:
+            tuple: (distances (n, k), ids (n, k)); missing neighbours are inf / -1
+        """
+        Q = np.atleast_2d(np.asarray(Q, dtype=np.float32))
+        n = len(Q)
+        out_dist = np.full((n, k), np.inf, dtype=np.float32)
+        out_ids = np.full((n, k), -1, dtype=np.int64)
+        if not self.is_trained or len(self) == 0:
+            return out_dist, out_ids
+
+        nprobe = min(self.nprobe, self.n_lists)
+        centroid_dists = self._centroid_norms[None, :] - 2 * (Q @ self.centroids.T)
+        probes = np.argpartition(centroid_dists, nprobe - 1, axis=1)[:, :nprobe]
+        probes = np.take_along_axis(
+            probes, np.argsort(np.take_along_axis(centroid_dists, probes, axis=1), axis=1), axis=1)
+        query_norms = np.einsum('ij,ij->i', Q, Q)
+
+        for qi in range(n):
+            q = Q[qi]
+            cand_dists = []
+            cand_ids = []
+            scanned = 0
+            for lst in probes[qi]:
+                lo, hi = self.offsets[lst], self.offsets[lst + 1]
+                if hi > lo:
+                    cand_dists.append(self.norms[lo:hi] - 2 * (self.vectors[lo:hi] @ q))
+                    cand_ids.append(self.ids[lo:hi])
+                    scanned += hi - lo
+                    if self.max_candidates and scanned >= self.max_candidates:
+                        break
+            if len(self.delta_ids):
+                mask = np.isin(self.delta_lists, probes[qi])
+                if mask.any():
+                    cand_dists.append(self.delta_norms[mask] - 2 * (self.delta_vectors[mask] @ q))
+                    cand_ids.append(self.delta_ids[mask])
+            if not cand_dists:
+                continue
+
+            dists = np.concatenate(cand_dists)
+            ids = np.concatenate(cand_ids)
+            kk = min(k, len(dists))
+            top = np.argpartition(dists, kk - 1)[:kk]
+            top = top[np.argsort(dists[top])]
+            out_dist[qi, :kk] = np.sqrt(np.maximum(dists[top] + query_norms[qi], 0))
+            out_ids[qi, :kk] = ids[top]
+
+        return out_dist, out_ids
+
+    def save(self, path):
+        """Write the index as .npy arrays plus meta.json in a directory"""
+        self.merge()
+        os.makedirs(path, exist_ok=True)
+        for name in ('centroids', 'vectors', 'norms', 'ids', 'offsets'):
+            np.save(os.path.join(path, f'{name}.npy'), getattr(self, name))
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump({"dim": self.dim, "n_lists": self.n_lists, "auto_lists": self.auto_lists,
+                       "nprobe": self.nprobe, "max_candidates": self.max_candidates,
+                       "ntotal": self.ntotal, "merge_threshold": self.merge_threshold}, f)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Load a saved index; with mmap the list storage stays on disk and is shared between processes"""
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        index = cls(meta["dim"], meta["n_lists"], meta["nprobe"], meta["max_candidates"],
+                    meta["merge_threshold"])
+        index.auto_lists = meta["auto_lists"]
+        mmap_mode = 'r' if mmap else None
+        for name in ('centroids', 'vectors', 'norms', 'ids', 'offsets'):
+            setattr(index, name, np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode))
+        index.centroids = np.asarray(index.centroids)
+        index.offsets = np.asarray(index.offsets)
+        index._centroid_norms = np.einsum('ij,ij->i', index.centroids, index.centroids)
+        index.ntotal = meta["ntotal"]
+        return index
+
+
+def build_index_from_store(store, index=None, chunk_size=65536):
+    """Add every embedding in an EmbeddingStore to an IVF index, chunk by chunk"""
+    index = index or IVFIndex(dim=store.dim)
+    for _, vectors in store.iter_vectors(chunk_size):
+        index.add(vectors)
+    return index
@@ -0,0 +1,313 @@
+"""
+Load generator for the verification API.
+
+Replays a folder of images against /predict, either closed-loop (a fixed
+number of concurrent clients, each sending its next request as soon as the
+previous one returns) or open-loop (requests arrive at a fixed average rate
+regardless of how fast the server answers, so queueing shows up in the
+latencies). Only the standard library is used for HTTP, and --local starts
+the app in-process on a loopback port, so no network access is needed:
+
+    python loadtest.py --local --concurrency 8 --duration 30
+    python loadtest.py --url http://localhost:8000 --rate 20 --duration 60 --output load.json
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import numpy as np
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+PERCENTILES = (50, 90, 95, 99)
+
+
+def load_images(folder, limit=None):
+    """(filename, bytes) for the images in a folder, in sorted order"""
+    names = sorted(f for f in os.listdir(folder) if f.lower().endswith(IMAGE_EXTENSIONS))[:limit]
+    if not names:
+        raise ValueError(f"No images found in {folder}")
+    images = []
+    for name in names:
+        with open(os.path.join(folder, name), 'rb') as f:
+            images.append((name, f.read()))
+    return images
+
+
+def multipart_body(filename, contents, field="file"):
+    boundary = uuid.uuid4().hex
+    content_type = 'image/png' if filename.lower().endswith('.png') else 'image/jpeg'
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n').encode() + contents + f'\r\n--{boundary}--\r\n'.encode()
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+class Client:
+    """One keep-alive HTTP connection per thread"""
+
+    def __init__(self, url, timeout=60):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.https = parts.scheme == 'https'
+        self.path = (parts.path.rstrip('/') or '') + '/predict'
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+            conn = self._local.conn = cls(self.host, self.port, timeout=self.timeout)
+        return conn
+
+    def predict(self, filename, contents):
+        """POST one image; returns (status, parsed JSON body or None)"""
+        body, content_type = multipart_body(filename, contents)
+        conn = self._connection()
+        try:
+            conn.request('POST', self.path, body, {'Content-Type': content_type})
+            response = conn.getresponse()
+            payload = response.read()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            self._local.conn = None
+            raise
+        try:
+            return response.status, json.loads(payload)
+        except ValueError:
+            return response.status, None
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = []  # (start offset, latency seconds, status, model_details or None)
+        self._lock = threading.Lock()
+
+    def record(self, start, latency, status, details):
+        with self._lock:
+            self.samples.append((start, latency, status, details))
+
+
+def send(client, recorder, image, scheduled, t0):
+    """Issue one request; latency counts from the scheduled send time"""
+    filename, contents = image
+    try:
+        status, data = client.predict(filename, contents)
+        details = data.get('model_details') if status == 200 and isinstance(data, dict) else None
+    except Exception as e:
+        status, details = type(e).__name__, None
+    recorder.record(scheduled - t0, time.perf_counter() - scheduled, status, details)
+
+
+def run_closed_loop(client, images, concurrency, duration, max_requests):
+    recorder = Recorder()
+    cycle = itertools.cycle(images)
+    lock = threading.Lock()
+    issued = itertools.count()
+    t0 = time.perf_counter()
+    deadline = t0 + duration
+
+    def worker():
+        while time.perf_counter() < deadline:
+            with lock:
+                if max_requests and next(issued) >= max_requests:
+                    return
+                image = next(cycle)
+            send(client, recorder, image, time.perf_counter(), t0)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder, time.perf_counter() - t0
+
+
+def run_open_loop(client, images, rate, duration, max_requests, max_inflight=256, poisson=True, seed=0):
+    """Send at `rate` requests/s (Poisson arrivals by default); arrivals beyond max_inflight are dropped"""
+    recorder = Recorder()
+    rng = random.Random(seed)
+    cycle = itertools.cycle(images)
+    inflight = threading.BoundedSemaphore(max_inflight)
+    dropped = 0
+    t0 = time.perf_counter()
+    deadline = t0 + duration
+    next_time = t0
+
+    def task(image, scheduled):
+        try:
+            send(client, recorder, image, scheduled, t0)
+        finally:
+            inflight.release()
+
+    with ThreadPoolExecutor(max_workers=max_inflight) as pool:
+        sent = 0
+        while next_time < deadline and not (max_requests and sent >= max_requests):
+            delay = next_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            if inflight.acquire(blocking=False):
+                pool.submit(task, next(cycle), next_time)
+            else:
+                dropped += 1
+            sent += 1
+            next_time += rng.expovariate(rate) if poisson else 1.0 / rate
+    return recorder, time.perf_counter() - t0, dropped
+
+
+def percentiles_ms(latencies):
+    if len(latencies) == 0:
+        return {}
+    ms = np.asarray(latencies) * 1000
+    report = {f"p{p}": round(float(np.percentile(ms, p)), 2) for p in PERCENTILES}
+    report.update(mean=round(float(ms.mean()), 2), max=round(float(ms.max()), 2))
+    return report
+
+
+def summarize(recorder, elapsed, dropped=0):
+    samples = recorder.samples
+    ok = [s for s in samples if s[2] == 200]
+    statuses = {}
+    for s in samples:
+        statuses[str(s[2])] = statuses.get(str(s[2]), 0) + 1
+
+    # Latency by which models answered, and verdict mix per model
+    by_models = {}
+    per_model = {}
+    for _, latency, _, details in ok:
+        details = details or {}
+        by_models.setdefault("+".join(sorted(details)) or "none", []).append(latency)
+        for name, detail in details.items():
+            stats = per_model.setdefault(name, {"responses": 0, "fake": 0, "confidence": []})
+            stats["responses"] += 1
+            stats["fake"] += bool(detail.get('is_fake'))
+            stats["confidence"].append(detail.get('confidence', 0.0))
+
+    total = len(samples) + dropped
+    return {
+        "requests": len(samples),
+        "dropped": dropped,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+        "error_rate": round(1 - len(ok) / total, 4) if total else 0.0,
+        "status_counts": statuses,
+        "latency_ms": percentiles_ms([s[1] for s in ok]),
+        "latency_ms_by_models": {key: percentiles_ms(values) for key, values in sorted(by_models.items())},
+        "model_details": {
+            name: {"responses": stats["responses"],
+                   "fake_rate": round(stats["fake"] / stats["responses"], 4),
+                   "mean_confidence": round(float(np.mean(stats["confidence"])), 4)}
+            for name, stats in sorted(per_model.items())
+        },
+    }
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_local_server(port=None, ready_timeout=300):
+    """Run api:app with uvicorn in a background thread; returns (url, server)"""
+    import uvicorn
+
+    port = port or _free_port()
+    config = uvicorn.Config("api:app", host="127.0.0.1", port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, daemon=True).start()
+
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + ready_timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', '/ready')
+            status = conn.getresponse().status
+            conn.close()
+            if status == 200:
+                return url, server
+        except OSError:
+            pass
+        time.sleep(0.2)
+    server.should_exit = True
+    raise RuntimeError(f"Local server did not become ready within {ready_timeout}s")
+
+
+def print_report(report):
+    print(f"\n{report['requests']} requests in {report['elapsed_s']}s: "
+          f"{report['throughput_rps']} req/s, error rate {report['error_rate']:.2%}"
+          + (f", {report['dropped']} dropped" if report['dropped'] else ""))
+    print(f"Status codes: {report['status_counts']}")
+    latency = report['latency_ms']
+    if latency:
+        print("Latency ms: " + ", ".join(f"{k} {v}" for k, v in latency.items()))
+    for key, values in report['latency_ms_by_models'].items():
+        print(f"  models {key}: p50 {values['p50']} p99 {values['p99']}")
+    for name, stats in report['model_details'].items():
+        print(f"  {name}: {stats['responses']} responses, fake rate {stats['fake_rate']:.2%}, "
+              f"mean confidence {stats['mean_confidence']:.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the /predict endpoint")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="Base URL of a running API, e.g. http://localhost:8000")
+    target.add_argument("--local", action="store_true", help="Start api:app in-process on a loopback port")
+    parser.add_argument("--images", default="test_images", help="Folder of images to replay")
+    parser.add_argument("--limit", type=int, default=None, help="Use at most this many images")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--concurrency", type=int, default=4, help="Closed-loop client count")
+    mode.add_argument("--rate", type=float, help="Open-loop arrival rate in requests/s")
+    parser.add_argument("--uniform", action="store_true", help="Evenly spaced instead of Poisson arrivals")
+    parser.add_argument("--max-inflight", type=int, default=256)
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to generate load")
+    parser.add_argument("--requests", type=int, default=None, help="Stop after this many requests")
+    parser.add_argument("--warmup", type=int, default=4, help="Untimed requests sent first")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--output", help="Write the report as JSON to this path")
+    args = parser.parse_args()
+
+    images = load_images(args.images, args.limit)
+    server = None
+    url = args.url
+    if args.local:
+        print("Starting local server...")
+        url, server = start_local_server()
+
+    try:
+        client = Client(url, args.timeout)
+        for image in images[:args.warmup]:
+            client.predict(*image)
+
+        if args.rate:
+            print(f"Open loop at {args.rate} req/s for {args.duration}s against {url}")
+            recorder, elapsed, dropped = run_open_loop(client, images, args.rate, args.duration, args.requests,
+                                                       args.max_inflight, poisson=not args.uniform)
+        else:
+            print(f"Closed loop with {args.concurrency} clients for {args.duration}s against {url}")
+            recorder, elapsed = run_closed_loop(client, images, args.concurrency, args.duration, args.requests)
+            dropped = 0
+    finally:
+        if server is not None:
+            server.should_exit = True
+
+    report = summarize(recorder, elapsed, dropped)
+    report["config"] = {"url": url, "images": len(images), "concurrency": None if args.rate else args.concurrency,
+                        "rate": args.rate, "duration": args.duration}
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import io
+import os
+import cv2
+import numpy as np
+from PIL import Image
+
+# Network input size; the crop is resized straight to this
+INPUT_SIZE = 224
+# JPEGs are decoded at a reduced DCT scale, keeping at least this many pixels per side
+DECODE_SIZE = int(os.environ.get("PREPROCESS_DECODE_SIZE", 512))
+# Longest side of the proxy image used to find the medicine bounding box
+PROXY_SIZE = int(os.environ.get("PREPROCESS_PROXY_SIZE", 256))
+# Padding around the detected box, in pixels of the original image
+BOX_PADDING = 10
+
+
+def preprocess_image(image):
+    """Enhanced image preprocessing"""
+    # Convert to numpy array
+    img_array = np.array(image)
+    
+    # Convert to grayscale for edge detection
+    gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
+    
+    # Apply adaptive thresholding
+    thresh = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
+                                 cv2.THRESH_BINARY, 11, 2)
+    
+    # Find contours
+    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    
+    if contours:
+        # Find the largest contour (assuming it's the medicine)
+        largest_contour = max(contours, key=cv2.contourArea)
+        x, y, w, h = cv2.boundingRect(largest_contour)
+        
+        # Add padding
+        padding = 10
+        x = max(0, x - padding)
+        y = max(0, y - padding)
+        w = min(img_array.shape[1] - x, w + 2*padding)
+        h = min(img_array.shape[0] - y, h + 2*padding)
+        
+        # Crop the image
+        cropped = img_array[y:y+h, x:x+w]
+        image = Image.fromarray(cropped)
+    
+    # Resize maintaining aspect ratio
+    max_size = 800
+    ratio = min(max_size/image.size[0], max_size/image.size[1])
+    new_size = tuple(int(dim * ratio) for dim in image.size)
+    image = image.resize(new_size, Image.Resampling.LANCZOS)
+    
+    return image
+
+
+def decode_image(contents, min_size=DECODE_SIZE):
+    """
+    Decode image bytes to an RGB array, letting libjpeg skip detail that would
+    be thrown away anyway.
+
+    Returns:
+        tuple: (RGB uint8 array, scale of the decoded image relative to the original)
+    """
+    image = Image.open(io.BytesIO(contents))
+    original_width = image.size[0]
+    if image.format == 'JPEG':
+        image.draft('RGB', (min_size, min_size))
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    return np.asarray(image), image.size[0] / original_width
+
+
+def find_medicine_box(img_array, proxy_size=PROXY_SIZE):
+    """
+    Bounding box (x, y, w, h) of the largest contour, searched on a small proxy
+    of the image and mapped back to its coordinates; None when nothing is found.
+    """
+    height, width = img_array.shape[:2]
+    scale = min(1.0, proxy_size / max(height, width))
+    if scale < 1.0:
+        proxy = cv2.resize(img_array, (max(1, round(width * scale)), max(1, round(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+    else:
+        proxy = img_array
+
+    gray = cv2.cvtColor(proxy, cv2.COLOR_RGB2GRAY)
+    thresh = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                   cv2.THRESH_BINARY, 11, 2)
+    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None
+
+    x, y, w, h = cv2.boundingRect(max(contours, key=cv2.contourArea))
+    x0, y0 = int(x / scale), int(y / scale)
+    x1, y1 = min(width, int(np.ceil((x + w) / scale))), min(height, int(np.ceil((y + h) / scale)))
+    return x0, y0, x1 - x0, y1 - y0
+
+
+def preprocess_fast(contents, input_size=INPUT_SIZE):
+    """
+    Reduced-resolution counterpart of ``preprocess_image`` working straight
+    from the uploaded bytes: draft decode, box search on a proxy, then one
+    INTER_AREA resize of the crop to the network input size.
+
+    Returns:
+        PIL.Image: input_size x input_size RGB image, ready for ``embed``
+    """
+    img_array, decode_scale = decode_image(contents)
+    height, width = img_array.shape[:2]
+
+    box = find_medicine_box(img_array)
+    if box is not None:
+        x, y, w, h = box
+        padding = max(1, round(BOX_PADDING * decode_scale))
+        x0, y0 = max(0, x - padding), max(0, y - padding)
+        x1, y1 = min(width, x + w + padding), min(height, y + h + padding)
+        img_array = img_array[y0:y1, x0:x1]
+
+    resized = cv2.resize(img_array, (input_size, input_size), interpolation=cv2.INTER_AREA)
+    return Image.fromarray(resized)
+
+
+def decode_and_preprocess(contents, fast=True):
+    """Uploaded bytes to the image handed to the extractor, via either pipeline"""
+    if fast:
+        return preprocess_fast(contents)
+
+    image = Image.open(io.BytesIO(contents))
+
+    # Convert to RGB if necessary
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    return preprocess_image(image)
@@ -1,8 +1,10 @@
 # resnet_extractor.py
 import torch
+from torch.utils.data import Dataset, DataLoader
 from torchvision import models, transforms
 from PIL import Image
 import os
+import threading
 import numpy as np
 
 def get_device():
@@ -11,12 +13,43 @@ def get_device():
         return torch.device('cuda')
     return torch.device('cpu')
 
-# Initialize ResNet with the new weights parameter
 device = get_device()
-resnet = models.resnet18(weights=models.ResNet18_Weights.IMAGENET1K_V1)
-resnet.fc = torch.nn.Identity()
-resnet = resnet.to(device)
-resnet.eval()
+
+# The ResNet is built on first use (or explicitly via load_model) rather than at import
+_resnet = None
+_resnet_lock = threading.Lock()
+
+def load_model():
+    """Build the ResNet-18 extractor once; safe to call from several threads."""
+    global _resnet
+    if _resnet is None:
+        with _resnet_lock:
+            if _resnet is None:
+                # Initialize ResNet with the new weights parameter
+                model = models.resnet18(weights=models.ResNet18_Weights.IMAGENET1K_V1)
+                model.fc = torch.nn.Identity()
+                model = model.to(device)
+                model.eval()
+                _resnet = model
+    return _resnet
+
+def __getattr__(name):
+    # Keep `resnet_extractor.resnet` working without building the model at import
+    if name == 'resnet':
+        return load_model()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def is_loaded():
+    return _resnet is not None
+
+EMBEDDING_DIM = 512
+# Bump when the network, weights or transform change so cached embeddings are recomputed
+EXTRACTOR_VERSION = "resnet18-IMAGENET1K_V1-224"
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# Inference backend selected with set_backend (see inference_backends.py)
+backend = 'eager'
+_runner = None
 
 # Image transformations
 transform = transforms.Compose([
@@ -26,48 +59,233 @@ transform = transforms.Compose([
                         [0.229, 0.224, 0.225])
 ])
 
-def extract_embeddings(image_folder):
+def to_tensor(image):
     """
-    Extract embeddings from images in the specified folder.
+    Convert one in-memory image to a normalized network input of shape (3, 224, 224).
+    
+    PIL images, HxW / HxWxC uint8 arrays and CxHxW uint8 tensors are treated as
+    raw images and go through `transform`. Float arrays and tensors of shape
+    CxHxW are assumed to be already transformed and are used as-is.
+    """
+    if isinstance(image, Image.Image):
+        return transform(image.convert("RGB"))
+    if isinstance(image, np.ndarray):
+        if image.dtype == np.uint8:
+            return transform(Image.fromarray(image).convert("RGB"))
+        image = torch.from_numpy(image)
+    if isinstance(image, torch.Tensor):
+        if image.dtype == torch.uint8:
+            return transform(transforms.functional.to_pil_image(image).convert("RGB"))
+        return image.float()
+    raise TypeError(f"Unsupported image type: {type(image).__name__}")
+
+def _is_single(images):
+    if isinstance(images, Image.Image):
+        return True
+    if isinstance(images, np.ndarray) and images.dtype == np.uint8:
+        # HxW grayscale or HxWxC color image; a batch is NxHxWxC
+        return images.ndim == 2 or (images.ndim == 3 and images.shape[-1] in (3, 4))
+    if isinstance(images, (np.ndarray, torch.Tensor)):
+        return images.ndim == 3
+    return False
+
+def embed(images):
+    """
+    Extract embeddings for in-memory images without touching the filesystem.
     
     Args:
-        image_folder (str): Path to the folder containing images
+        images: a single PIL image, numpy array or tensor, or a batch given as a
+            list of those or as a 4-D array/tensor (NxHxWxC uint8 or NxCxHxW float)
         
     Returns:
-        tuple: (embeddings array, list of filenames)
+        np.ndarray: embedding of shape (512,) for a single image, or (N, 512) for a batch
     """
+    single = _is_single(images)
+    if single:
+        batch = to_tensor(images).unsqueeze(0)
+    elif isinstance(images, torch.Tensor) and images.dtype != torch.uint8:
+        batch = images.float()
+    elif isinstance(images, np.ndarray) and images.dtype != np.uint8:
+        batch = torch.from_numpy(images).float()
+    else:
+        batch = torch.stack([to_tensor(img) for img in images])
+    
+    emb = _forward(batch)
+    return emb[0] if single else emb
+
+def _forward(batch):
+    """Run a batch of network inputs through the extractor"""
+    if _runner is not None:
+        return _runner(batch)
+    model = load_model()
+    with torch.no_grad():
+        return model(batch.to(device, non_blocking=True)).cpu().numpy()
+
+def warm_up(batch_sizes=(1, 4)):
+    """Run dummy batches so lazy allocations and kernel selection happen before real traffic"""
+    for batch_size in batch_sizes:
+        _forward(torch.zeros((batch_size, 3, 224, 224)))
+
+def set_backend(name, calibration_folder=None):
+    """
+    Select the inference backend used by `embed` and `extract_embeddings`.
+    
+    Args:
+        name (str): one of inference_backends.BACKENDS
+        calibration_folder (str): images used to calibrate 'static_int8'
+    """
+    global backend, _runner
+    from inference_backends import build_backend, DEFAULT_CALIBRATION_FOLDER
+    
+    _runner = None if name == 'eager' else build_backend(
+        name, load_model(), calibration_folder or DEFAULT_CALIBRATION_FOLDER, model_id=EXTRACTOR_VERSION)
+    backend = name
+
+def extractor_id(for_backend=None):
+    """Identifier of the current extractor, or of it under another backend; int8 backends produce different embeddings"""
+    from inference_backends import INT8_BACKENDS
+    
+    name = for_backend or backend
+    if name in INT8_BACKENDS:
+        return f"{EXTRACTOR_VERSION}+{name}"
+    return EXTRACTOR_VERSION
+
+def list_images(image_folder):
+    """Sorted image filenames in a folder"""
     if not os.path.exists(image_folder):
         raise ValueError(f"Image folder '{image_folder}' does not exist")
-        
-    embeddings = []
-    filenames = []
     
-    # Get all image files
-    image_files = [f for f in sorted(os.listdir(image_folder)) 
-                  if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
+    with os.scandir(image_folder) as entries:
+        image_files = sorted(entry.name for entry in entries
+                             if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS))
     
     if not image_files:
         raise ValueError(f"No image files found in '{image_folder}'")
     
-    for fname in image_files:
-        path = os.path.join(image_folder, fname)
+    return image_files
+
+class ImageFileDataset(Dataset):
+    """Decode and transform image files; unreadable files yield None"""
+    def __init__(self, paths):
+        self.paths = paths
+    
+    def __len__(self):
+        return len(self.paths)
+    
+    def __getitem__(self, idx):
+        path = self.paths[idx]
         try:
-            # Load and preprocess image
-            img = Image.open(path).convert("RGB")
-            img_tensor = transform(img).unsqueeze(0).to(device)
-            
-            # Extract features
-            with torch.no_grad():
-                emb = resnet(img_tensor).squeeze().cpu().numpy()
-            
-            embeddings.append(emb)
-            filenames.append(fname)
-            
+            return idx, transform(Image.open(path).convert("RGB"))
         except Exception as e:
-            print(f"Error processing {fname}: {str(e)}")
+            print(f"Error processing {os.path.basename(path)}: {str(e)}")
+            return idx, None
+
+def _collate(samples):
+    samples = [(idx, tensor) for idx, tensor in samples if tensor is not None]
+    if not samples:
+        return [], None
+    indices, tensors = zip(*samples)
+    return list(indices), torch.stack(tensors)
+
+def default_num_workers():
+    return min(8, max(0, (os.cpu_count() or 1) - 1))
+
+def iter_path_embeddings(paths, batch_size=32, num_workers=None):
+    """
+    Embed a list of image files in batches, decoding in worker processes.
+    
+    Args:
+        paths (list): image file paths
+        batch_size (int): images per forward pass
+        num_workers (int): decode/transform worker processes (None picks from the CPU count)
+        
+    Yields:
+        tuple: (indices into paths, embeddings array of shape (len(indices), 512))
+    """
+    if num_workers is None:
+        num_workers = default_num_workers() if len(paths) > batch_size else 0
+    
+    loader = DataLoader(
+        ImageFileDataset(paths),
+        batch_size=batch_size,
+        num_workers=num_workers,
+        collate_fn=_collate,
+        pin_memory=device.type == 'cuda',
+        prefetch_factor=2 if num_workers else None
+    )
+    
+    for indices, batch in loader:
+        if batch is None:
             continue
+        yield indices, _forward(batch)
+
+def iter_embeddings(image_folder, batch_size=32, num_workers=None):
+    """
+    Stream embeddings for the images in a folder without holding them all in memory.
+    
+    Yields:
+        tuple: (list of filenames, embeddings array of shape (len(filenames), 512))
+    """
+    image_files = list_images(image_folder)
+    paths = [os.path.join(image_folder, fname) for fname in image_files]
+    
+    for indices, emb in iter_path_embeddings(paths, batch_size, num_workers):
+        yield [image_files[i] for i in indices], emb
+
+def extract_embeddings(image_folder, batch_size=32, num_workers=None, out=None):
+    """
+    Extract embeddings from images in the specified folder.
     
-    if not embeddings:
+    Args:
+        image_folder (str): Path to the folder containing images
+        batch_size (int): Images per forward pass
+        num_workers (int): Decode/transform worker processes (None picks from the CPU count)
+        out (str): Optional .npy path; embeddings are written straight into a
+            memory-mapped array there instead of being collected in memory
+        
+    Returns:
+        tuple: (embeddings array, list of filenames)
+    """
+    image_files = list_images(image_folder)
+    paths = [os.path.join(image_folder, fname) for fname in image_files]
+    
+    if out is not None:
+        embeddings = np.lib.format.open_memmap(out, mode='w+', dtype=np.float32,
+                                               shape=(len(paths), EMBEDDING_DIM))
+    else:
+        embeddings = np.empty((len(paths), EMBEDDING_DIM), dtype=np.float32)
+    
+    filenames = []
+    count = 0
+    for indices, emb in iter_path_embeddings(paths, batch_size, num_workers):
+        embeddings[count:count + len(emb)] = emb
+        filenames.extend(image_files[i] for i in indices)
+        count += len(emb)
+    
+    if not filenames:
         raise ValueError("No images were successfully processed")
     
-    return np.array(embeddings), filenames
+    if count < len(paths):
+        # Some files failed to decode; shrink the output to the processed rows
+        if out is not None:
+            embeddings.flush()
+            embeddings = _truncate_npy(out, embeddings, count)
+        else:
+            embeddings = embeddings[:count]
+    elif out is not None:
+        embeddings.flush()
+    
+    return embeddings, filenames
+
+def _truncate_npy(path, embeddings, count, chunk_size=65536):
+    """Rewrite a memory-mapped .npy file keeping only its first `count` rows"""
+    tmp_path = path + '.tmp'
+    truncated = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=embeddings.dtype,
+                                          shape=(count,) + embeddings.shape[1:])
+    for start in range(0, count, chunk_size):
+        end = min(start + chunk_size, count)
+        truncated[start:end] = embeddings[start:end]
+    truncated.flush()
+    del truncated, embeddings
+    os.replace(tmp_path, path)
+    return np.load(path, mmap_mode='r+')
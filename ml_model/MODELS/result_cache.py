@@ -0,0 +1,199 @@
+"""
+Exact-match cache of /predict results, stored in one SQLite file that every
+server process using the same path reads and writes.
+
+The database runs in WAL mode, so concurrent readers never block each other
+and a writer only briefly blocks other writers. An entry is keyed by the
+SHA-256 of the uploaded bytes together with the model version it was
+computed with, so servers with different models can share a file without
+serving or overwriting each other's results; entries of versions nobody asks
+for any more simply expire. Size is bounded by evicting the least recently
+used entries, and entries older than the TTL are treated as misses.
+
+A process about to score a missing key first claims it with a row in the
+pending table (INSERT OR IGNORE, so exactly one process wins). The others
+poll until the result is stored or the claim goes away, so identical uploads
+arriving at different workers at once are scored once. A claim older than
+the claim timeout is presumed abandoned by a crashed worker and can be taken
+over. Within a process, api.py additionally collapses identical uploads onto
+one future.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+# Bump when the table layout changes; files with another version are recreated
+SCHEMA_VERSION = 1
+SCHEMA = """
+DROP TABLE IF EXISTS results;
+DROP TABLE IF EXISTS pending;
+CREATE TABLE results (
+    key TEXT NOT NULL,
+    model_version TEXT NOT NULL,
+    value TEXT NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL,
+    PRIMARY KEY (key, model_version)
+);
+CREATE INDEX results_accessed ON results (accessed);
+CREATE TABLE pending (
+    key TEXT NOT NULL,
+    model_version TEXT NOT NULL,
+    owner INTEGER NOT NULL,
+    claimed REAL NOT NULL,
+    PRIMARY KEY (key, model_version)
+);
+"""
+
+
+class ResultCache:
+    def __init__(self, path, max_entries=10000, ttl=3600.0, evict_every=64, busy_timeout=0.05,
+                 claim_timeout=30.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.claim_timeout = claim_timeout
+        self.evict_every = evict_every
+        self.busy_timeout = busy_timeout
+        self.model_version = None
+        self._local = threading.local()
+        self._puts = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with closing(self._connect(timeout=5.0)) as conn:
+            if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                conn.executescript(f"BEGIN IMMEDIATE; {SCHEMA} PRAGMA user_version = {SCHEMA_VERSION}; COMMIT;")
+
+    def _connect(self, timeout=None):
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout if timeout is None else timeout,
+                               isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _connection(self):
+        # One connection per thread and per process: connections must not cross a fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._connect()
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def set_model_version(self, version):
+        """Read and write entries of this model version only"""
+        self.model_version = version
+
+    def get(self, key):
+        """Cached value for key under the current model version, or None"""
+        if self.model_version is None:
+            return None
+        conn = self._connection()
+        try:
+            row = conn.execute("SELECT value, created FROM results WHERE key = ? AND model_version = ?",
+                               (key, self.model_version)).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            if now - row[1] > self.ttl:
+                conn.execute("DELETE FROM results WHERE key = ? AND model_version = ?", (key, self.model_version))
+                return None
+            conn.execute("UPDATE results SET accessed = ? WHERE key = ? AND model_version = ?",
+                         (now, key, self.model_version))
+        except sqlite3.OperationalError:
+            # Busy or locked: answer as a miss rather than stall the request
+            return None
+        return json.loads(row[0])
+
+    def claim(self, key):
+        """
+        Reserve key for scoring by this process.
+
+        Returns:
+            bool: True when the caller should compute the result (it now holds
+            the claim, or the cache cannot coordinate), False when another
+            process holds a live claim and the caller should wait for its result
+        """
+        if self.model_version is None:
+            return True
+        now = time.time()
+        conn = self._connection()
+        try:
+            # Take over claims whose owner never stored a result
+            conn.execute("DELETE FROM pending WHERE key = ? AND model_version = ? AND claimed < ?",
+                         (key, self.model_version, now - self.claim_timeout))
+            return conn.execute("INSERT OR IGNORE INTO pending (key, model_version, owner, claimed) "
+                                "VALUES (?, ?, ?, ?)", (key, self.model_version, os.getpid(), now)).rowcount == 1
+        except sqlite3.OperationalError:
+            return True
+
+    def is_claimed(self, key):
+        """Whether some process holds a live claim on key"""
+        if self.model_version is None:
+            return False
+        try:
+            row = self._connection().execute(
+                "SELECT claimed FROM pending WHERE key = ? AND model_version = ?",
+                (key, self.model_version)).fetchone()
+        except sqlite3.OperationalError:
+            # Cannot tell; let the waiter stop waiting and score it
+            return False
+        return row is not None and time.time() - row[0] <= self.claim_timeout
+
+    def release(self, key):
+        """Give up a claim without storing a result, so waiters score the key themselves"""
+        if self.model_version is None:
+            return
+        try:
+            self._connection().execute("DELETE FROM pending WHERE key = ? AND model_version = ?",
+                                       (key, self.model_version))
+        except sqlite3.OperationalError:
+            pass
+
+    def put(self, key, value):
+        """Store the result for key and release any claim on it"""
+        if self.model_version is None:
+            return
+        now = time.time()
+        try:
+            # Stored before the claim is dropped, so a waiter never sees neither
+            self._connection().execute(
+                "INSERT OR REPLACE INTO results (key, model_version, value, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?)", (key, self.model_version, json.dumps(value), now, now))
+        except sqlite3.OperationalError:
+            self.release(key)
+            return
+        self.release(key)
+        with self._lock:
+            self._puts += 1
+            evict = self._puts % self.evict_every == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """Drop expired entries, then the least recently used ones beyond max_entries"""
+        conn = self._connection()
+        try:
+            expired = conn.execute("DELETE FROM results WHERE created < ?", (time.time() - self.ttl,)).rowcount
+            conn.execute("DELETE FROM pending WHERE claimed < ?", (time.time() - self.claim_timeout,))
+            excess = conn.execute("SELECT COUNT(*) FROM results").fetchone()[0] - self.max_entries
+            if excess > 0:
+                conn.execute("DELETE FROM results WHERE rowid IN "
+                             "(SELECT rowid FROM results ORDER BY accessed LIMIT ?)", (excess,))
+        except sqlite3.OperationalError:
+            return 0
+        return expired + max(0, excess)
+
+    def __len__(self):
+        try:
+            return self._connection().execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        except sqlite3.OperationalError:
+            return 0
+
+    def clear(self):
+        conn = self._connection()
+        conn.execute("DELETE FROM results")
+        conn.execute("DELETE FROM pending")
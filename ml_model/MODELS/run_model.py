@@ -2,7 +2,7 @@ import os
 import numpy as np
 import shutil
 from anomaly_detector import AnomalyDetector
-from resnet_extractor import extract_embeddings
+from embedding_store import cached_extract_embeddings
 from sklearn.model_selection import train_test_split
 
 def setup_test_data():
@@ -48,12 +48,12 @@ def main():
     try:
         # Load features from real medicine images
         print("Processing real medicine images...")
-        X_real, real_filenames = extract_embeddings("real_medicines")
+        X_real, real_filenames = cached_extract_embeddings("real_medicines")
         print(f"Processed {len(real_filenames)} real medicine images")
         
         # Load features from fake medicine images
         print("\nProcessing fake medicine images...")
-        X_fake, fake_filenames = extract_embeddings("fake_medicines")
+        X_fake, fake_filenames = cached_extract_embeddings("fake_medicines")
         print(f"Processed {len(fake_filenames)} fake medicine images")
         
         # Combine data for training
@@ -73,10 +73,10 @@ def main():
         
         print("\n4. Evaluating models...")
         print("\nKMeans Model Evaluation:")
-        kmeans_detector.evaluate(X_val, y_val)
+        kmeans_detector.evaluate(X_val, y_val, plot=True)
         
         print("\nAutoencoder Model Evaluation:")
-        autoencoder_detector.evaluate(X_val, y_val)
+        autoencoder_detector.evaluate(X_val, y_val, plot=True)
         
         print("\nModel training and evaluation completed successfully!")
         
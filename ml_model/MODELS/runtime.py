@@ -0,0 +1,72 @@
+"""
+CPU thread sizing for serving.
+
+Torch's intra-op pool, OpenCV's pool and our own executors all default to one
+thread per core, so with several inference workers (or several server
+processes) the machine ends up with many times more runnable threads than
+cores. ``configure_threads`` splits the available cores between them instead.
+Every value can be overridden from the environment.
+"""
+import os
+import cv2
+import torch
+
+
+def available_cores():
+    """Cores this process may use, honouring CPU affinity and a cgroup v2 quota"""
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            cores = min(cores, max(1, int(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return cores
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def thread_plan(processes=None, inference_workers=None):
+    """
+    Thread counts per process for the given number of server processes and
+    concurrent inference batches per process.
+
+    Returns:
+        dict: cores, processes, inference_workers, preprocess_workers,
+            torch_threads, torch_interop_threads, opencv_threads
+    """
+    cores = available_cores()
+    processes = processes or _env_int("WEB_CONCURRENCY", 1)
+    inference_workers = inference_workers or _env_int("INFERENCE_WORKERS", 1)
+    cores_per_process = max(1, cores // processes)
+    return {
+        "cores": cores,
+        "processes": processes,
+        "inference_workers": inference_workers,
+        "preprocess_workers": _env_int("PREPROCESS_WORKERS", cores_per_process),
+        "torch_threads": _env_int("TORCH_THREADS", max(1, cores_per_process // inference_workers)),
+        # Inference runs one model call at a time per worker, so inter-op parallelism only adds threads
+        "torch_interop_threads": _env_int("TORCH_INTEROP_THREADS", 1),
+        # Preprocessing is parallelised across images by the pool, not inside OpenCV
+        "opencv_threads": _env_int("OPENCV_THREADS", 1),
+    }
+
+
+def configure_threads(processes=None, inference_workers=None):
+    """Apply thread_plan to torch and OpenCV in this process and return it"""
+    plan = thread_plan(processes, inference_workers)
+    torch.set_num_threads(plan["torch_threads"])
+    try:
+        torch.set_num_interop_threads(plan["torch_interop_threads"])
+    except RuntimeError:
+        # Only allowed once, before any inter-op work has started
+        plan["torch_interop_threads"] = torch.get_num_interop_threads()
+    cv2.setNumThreads(plan["opencv_threads"])
+    return plan
@@ -0,0 +1,251 @@
+"""
+Pre-fork multi-process server for the verification API.
+
+The parent imports the API, loads the ResNet-18 extractor and the detector
+bundle once, freezes the garbage collector so later collections do not write
+to those objects' pages, then forks the workers. Workers share the weights
+copy-on-write (and the memory-mapped bundle through the page cache) and
+accept connections on a socket bound by the parent. The parent supervises
+them: a worker that exits or stops sending heartbeats is replaced.
+
+    python serve.py --workers 4 --port 8000
+
+Worker RSS/PSS and the time until every worker is ready are printed once all
+workers are up, and again every --report-interval seconds.
+"""
+import argparse
+import asyncio
+import gc
+import mmap
+import os
+import signal
+import socket
+import sys
+import time
+import numpy as np
+
+HEARTBEAT_INTERVAL = 1.0
+
+
+def process_memory(pid):
+    """RSS, PSS, shared and private memory of a process in MB, from /proc/<pid>/smaps_rollup"""
+    fields = {}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == 'kB':
+                    fields[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    except OSError:
+        return None
+    return {
+        "rss_mb": round(fields.get('Rss', 0), 1),
+        "pss_mb": round(fields.get('Pss', 0), 1),
+        "shared_mb": round(fields.get('Shared_Clean', 0) + fields.get('Shared_Dirty', 0), 1),
+        "private_mb": round(fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0), 1),
+    }
+
+
+def bind_socket(host, port, backlog=2048):
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+class Supervisor:
+    """Forks, watches and restarts the worker processes"""
+
+    def __init__(self, app_module, sock, workers, heartbeat_timeout=30.0, log_level="info"):
+        self.api = app_module
+        self.sock = sock
+        self.n_workers = workers
+        self.heartbeat_timeout = heartbeat_timeout
+        self.log_level = log_level
+        # Per worker slot: last heartbeat, time it became ready, restarts (shared with the children)
+        self._shared = mmap.mmap(-1, workers * 3 * 8)
+        self.status = np.frombuffer(self._shared, dtype=np.float64).reshape(workers, 3)
+        self.pids = {}  # pid -> slot
+        self.started = {}  # slot -> fork time
+        self.stopping = False
+
+    def spawn(self, slot):
+        self.status[slot, :2] = 0.0
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                self._run_worker(slot)
+            except BaseException:
+                import traceback
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        self.pids[pid] = slot
+        self.started[slot] = time.time()
+        return pid
+
+    def _run_worker(self, slot):
+        import torch
+        import uvicorn
+
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        gc.unfreeze()
+        torch.set_num_threads(self.api.thread_plan["torch_threads"])
+
+        status = self.status
+
+        async def heartbeat():
+            # Runs on the worker's event loop, so a blocked loop stops the heartbeat
+            while True:
+                now = time.time()
+                status[slot, 0] = now
+                if self.api.models_ready and status[slot, 1] == 0:
+                    status[slot, 1] = now
+                await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+        async def start_heartbeat():
+            asyncio.get_running_loop().create_task(heartbeat())
+
+        self.api.app.router.on_startup.append(start_heartbeat)
+        config = uvicorn.Config(self.api.app, log_level=self.log_level, lifespan="on")
+        uvicorn.Server(config).run(sockets=[self.sock])
+
+    def reap(self):
+        """Collect exited workers; returns their slots"""
+        exited = []
+        while self.pids:
+            try:
+                pid, code = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            slot = self.pids.pop(pid, None)
+            if slot is not None and not self.stopping:
+                print(f"Worker {slot} (pid {pid}) exited with status {os.waitstatus_to_exitcode(code)}")
+                exited.append(slot)
+        return exited
+
+    def check_heartbeats(self):
+        now = time.time()
+        for pid, slot in list(self.pids.items()):
+            last = self.status[slot, 0] or self.started[slot]
+            if now - last > self.heartbeat_timeout:
+                print(f"Worker {slot} (pid {pid}) missed heartbeats for {now - last:.0f}s, killing it")
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+
+    def memory_report(self):
+        report = {"parent": process_memory(os.getpid()), "workers": {}}
+        for pid, slot in sorted(self.pids.items(), key=lambda item: item[1]):
+            report["workers"][slot] = {"pid": pid, **(process_memory(pid) or {})}
+        workers = [w for w in report["workers"].values() if "pss_mb" in w]
+        report["total_pss_mb"] = round(sum(w["pss_mb"] for w in workers) + (report["parent"] or {}).get("pss_mb", 0), 1)
+        return report
+
+    def print_memory_report(self):
+        report = self.memory_report()
+        parent = report["parent"] or {}
+        print(f"Memory: parent RSS {parent.get('rss_mb')} MB, total PSS {report['total_pss_mb']} MB")
+        for slot, worker in report["workers"].items():
+            print(f"  worker {slot} (pid {worker['pid']}): RSS {worker.get('rss_mb')} MB, "
+                  f"PSS {worker.get('pss_mb')} MB, shared {worker.get('shared_mb')} MB, "
+                  f"private {worker.get('private_mb')} MB")
+
+    def stop(self, *_):
+        self.stopping = True
+
+    def run(self, start_time, report_interval=60.0, restart_delay=1.0):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for slot in range(self.n_workers):
+            self.spawn(slot)
+
+        all_ready = False
+        next_report = None
+        while not self.stopping:
+            time.sleep(0.2)
+            for slot in self.reap():
+                if not self.stopping:
+                    # Back off when a worker dies right after starting
+                    if time.time() - self.started[slot] < 5:
+                        time.sleep(restart_delay)
+                    self.status[slot, 2] += 1
+                    self.spawn(slot)
+            self.check_heartbeats()
+
+            ready = [slot for slot in self.pids.values() if self.status[slot, 1] > 0]
+            if not all_ready and len(ready) == self.n_workers:
+                all_ready = True
+                print(f"{self.n_workers} workers ready {max(self.status[:, 1]) - start_time:.2f}s after start")
+                self.print_memory_report()
+                next_report = time.time() + report_interval
+            elif next_report and report_interval and time.time() >= next_report:
+                self.print_memory_report()
+                next_report = time.time() + report_interval
+
+        self.shutdown()
+
+    def shutdown(self, timeout=30.0):
+        for pid in list(self.pids):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.time() + timeout
+        while self.pids and time.time() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid in list(self.pids):
+            os.kill(pid, signal.SIGKILL)
+        self.reap()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the API from pre-forked workers sharing the models")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", 2)))
+    parser.add_argument("--heartbeat-timeout", type=float, default=30.0)
+    parser.add_argument("--report-interval", type=float, default=300.0,
+                        help="Seconds between memory reports (0 disables them after the first)")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    # The API sizes its thread pools from WEB_CONCURRENCY at import time
+    os.environ["WEB_CONCURRENCY"] = str(args.workers)
+    import torch
+    import api
+    import resnet_extractor
+
+    # Load with a single torch thread: the OpenMP pool does not survive fork, and each
+    # worker sizes its own. Backends with their own thread pools (ONNX Runtime) and the
+    # warm-up pass are set up in the workers after the fork.
+    torch.set_num_threads(1)
+    load_start = time.perf_counter()
+    resnet_extractor.load_model()
+    api.load_models()
+    print(f"Parent loaded extractor and detectors in {time.perf_counter() - load_start:.2f}s, "
+          f"forking {args.workers} workers")
+
+    gc.collect()
+    gc.freeze()
+
+    sock = bind_socket(args.host, args.port)
+    supervisor = Supervisor(api, sock, args.workers, args.heartbeat_timeout, args.log_level)
+    supervisor.run(start_time, args.report_interval)
+    sock.close()
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""
+Hyperparameter and threshold sweep for the anomaly detectors.
+
+Embeddings are extracted once (through the embedding store), written to a
+memory-mapped .npy file and shared read-only by a pool of worker processes,
+each fitting one detector configuration. Every fitted detector is scored
+with each threshold strategy:
+
+    f1      threshold maximising F1 on the validation split
+    std2    mean + 2 * std of the training scores
+    p95     95th percentile of the training scores
+
+Rows are ranked by test F1. The best detector per method can be written as
+the serving bundle:
+
+    python sweep.py --n-clusters 2 3 5 8 --hidden-dims 256,128,64 128,64,32 --bundle model_bundle.fmd
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+THRESHOLD_STRATEGIES = ('f1', 'std2', 'p95')
+
+# Set in each worker by _init_worker
+_data = {}
+
+
+def load_dataset(real_folder="real_medicines", fake_folder="fake_medicines", manifest_path=None):
+    """Cached embeddings for both folders with labels (1 = fake), or for the rows of a dataset manifest"""
+    from embedding_store import cached_extract_embeddings
+    
+    if manifest_path:
+        from dataset_manifest import update_manifest
+        from embedding_store import EmbeddingStore
+        
+        # Rescan so new images get embedded; unchanged files are neither reread nor rehashed
+        store = EmbeddingStore()
+        manifest, _ = update_manifest(manifest_path, {real_folder: 0, fake_folder: 1}, store=store, embed=True)
+        X, y = manifest.embeddings(store)
+        return X.astype(np.float32), y.astype(np.int8)
+
+    X_real, _ = cached_extract_embeddings(real_folder)
+    X_fake, _ = cached_extract_embeddings(fake_folder)
+    X = np.vstack([X_real, X_fake]).astype(np.float32)
+    y = np.array([0] * len(X_real) + [1] * len(X_fake), dtype=np.int8)
+    return X, y
+
+
+def split_indices(y, val_size=0.2, test_size=0.2, random_state=42):
+    """Stratified train/validation/test row indices"""
+    from sklearn.model_selection import train_test_split
+
+    idx = np.arange(len(y))
+    train, rest = train_test_split(idx, test_size=val_size + test_size, random_state=random_state, stratify=y)
+    val, test = train_test_split(rest, test_size=test_size / (val_size + test_size),
+                                 random_state=random_state, stratify=y[rest])
+    return np.sort(train), np.sort(val), np.sort(test)
+
+
+def _init_worker(data_path, splits_path, threads):
+    import torch
+
+    torch.set_num_threads(threads)
+    X = np.load(data_path, mmap_mode='r')
+    splits = np.load(splits_path)
+    _data.update(X=X, **{name: splits[name] for name in splits.files})
+
+
+def threshold_for(strategy, detector, train_scores, val_scores, y_val):
+    if strategy == 'f1':
+        return float(detector.find_optimal_threshold(val_scores, y_val))
+    if strategy == 'std2':
+        return float(np.mean(train_scores) + 2 * np.std(train_scores))
+    if strategy == 'p95':
+        return float(np.percentile(train_scores, 95))
+    raise ValueError(f"Unknown threshold strategy '{strategy}'")
+
+
+def inference_latency_ms(detector, X, repeats=5):
+    """Median per-sample latency scoring X in one batch and scoring a single sample"""
+    def median_ms(fn):
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - start)
+        return float(np.median(timings)) * 1000
+
+    return {"batch_ms_per_sample": median_ms(lambda: detector.score(X)) / len(X),
+            "single_ms": median_ms(lambda: detector.score(X[:1]))}
+
+
+def run_config(config):
+    """Fit one configuration in a worker; returns one row per threshold strategy plus the detector"""
+    import torch
+    from anomaly_detector import AnomalyDetector, classification_metrics
+
+    X, y = _data["X"], _data["y"]
+    X_train = np.asarray(X[_data["train"]])
+    X_val, y_val = np.asarray(X[_data["val"]]), y[_data["val"]]
+    X_test, y_test = np.asarray(X[_data["test"]]), y[_data["test"]]
+
+    torch.manual_seed(42)
+    detector = AnomalyDetector(method=config["method"], n_clusters=config.get("n_clusters", 3),
+                               n_neighbors=config.get("n_neighbors", 5),
+                               hidden_dims=config.get("hidden_dims", (256, 128, 64)))
+    start = time.perf_counter()
+    detector.fit(X_train, **config.get("train_options", {}))
+    fit_seconds = time.perf_counter() - start
+
+    # Leave each training sample out of its own kNN neighbourhood
+    train_scores = (detector.knn_distances(X_train, exclude_self=True) if config["method"] == 'knn'
+                    else detector.raw_scores(X_train))
+    val_scores = detector.raw_scores(X_val)
+    test_scores = detector.raw_scores(X_test)
+    latency = inference_latency_ms(detector, X_test)
+
+    rows = []
+    for strategy in config["thresholds"]:
+        threshold = threshold_for(strategy, detector, train_scores, val_scores, y_val)
+        rows.append({
+            "method": config["method"],
+            "params": {k: v for k, v in config.items() if k not in ("method", "thresholds", "train_options")},
+            "threshold_strategy": strategy,
+            "threshold": threshold,
+            **classification_metrics(y_test, test_scores > threshold),
+            "fit_seconds": round(fit_seconds, 3),
+            **{k: round(v, 4) for k, v in latency.items()},
+        })
+    return rows, detector
+
+
+def build_grid(methods, n_clusters, hidden_dims, n_neighbors, thresholds, epochs):
+    configs = []
+    for method in methods:
+        if method == 'kmeans':
+            configs += [{"method": method, "n_clusters": k} for k in n_clusters]
+        elif method == 'autoencoder':
+            configs += [{"method": method, "hidden_dims": list(dims), "train_options": {"epochs": epochs}}
+                        for dims in hidden_dims]
+        elif method == 'knn':
+            configs += [{"method": method, "n_neighbors": k} for k in n_neighbors]
+    for config in configs:
+        config["thresholds"] = list(thresholds)
+    return configs
+
+
+def run_sweep(X, y, configs, workers=None, threads_per_worker=1, random_state=42):
+    """
+    Evaluate every configuration on a shared memmap of X across a process pool.
+
+    Returns:
+        tuple: (rows ranked by test F1, dict of row index -> fitted detector)
+    """
+    workers = workers or max(1, (os.cpu_count() or 1) // threads_per_worker)
+    train, val, test = split_indices(y, random_state=random_state)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data_path = os.path.join(tmp, 'embeddings.npy')
+        shared = np.lib.format.open_memmap(data_path, mode='w+', dtype=np.float32, shape=X.shape)
+        shared[:] = X
+        shared.flush()
+        del shared
+        splits_path = os.path.join(tmp, 'splits.npz')
+        np.savez(splits_path, y=y, train=train, val=val, test=test)
+
+        rows, detectors = [], {}
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(data_path, splits_path, threads_per_worker)) as pool:
+            for config_rows, detector in pool.map(run_config, configs):
+                for row in config_rows:
+                    detectors[id(row)] = (detector, row["threshold"])
+                    rows.append(row)
+                print(f"Finished {config_rows[0]['method']} {config_rows[0]['params']}")
+
+    rows.sort(key=lambda row: (row["f1"], -row["batch_ms_per_sample"]), reverse=True)
+    ranked_detectors = {rank: detectors[id(row)] for rank, row in enumerate(rows)}
+    return rows, ranked_detectors
+
+
+def print_table(rows, limit=None):
+    header = f"{'rank':>4} {'method':<12} {'params':<28} {'thresh':<6} {'prec':>6} {'recall':>6} " \
+             f"{'f1':>6} {'ms/sample':>10}"
+    print(header)
+    print("-" * len(header))
+    for rank, row in enumerate(rows[:limit]):
+        params = ",".join(f"{k}={v}" for k, v in row["params"].items()).replace(" ", "")
+        print(f"{rank:>4} {row['method']:<12} {params:<28} {row['threshold_strategy']:<6} "
+              f"{row['precision']:>6.3f} {row['recall']:>6.3f} {row['f1']:>6.3f} "
+              f"{row['batch_ms_per_sample']:>10.4f}")
+
+
+def write_bundle(path, rows, detectors, methods=('kmeans', 'autoencoder')):
+    """Bundle the best-ranked detector of each serving method with its swept threshold"""
+    from bundle import save_bundle
+
+    chosen = {}
+    for rank, row in enumerate(rows):
+        if row["method"] in methods and row["method"] not in chosen:
+            detector, threshold = detectors[rank]
+            detector.threshold = threshold
+            chosen[row["method"]] = (detector, row)
+    save_bundle(path, {name: detector for name, (detector, _) in chosen.items()},
+                metadata={"sweep": {name: row for name, (_, row) in chosen.items()}})
+    print(f"Wrote {path} with " + ", ".join(f"{name} ({row['params']}, {row['threshold_strategy']})"
+                                           for name, (_, row) in chosen.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep detector hyperparameters and threshold strategies")
+    parser.add_argument("--real", default="real_medicines")
+    parser.add_argument("--fake", default="fake_medicines")
+    parser.add_argument("--manifest", help="Dataset manifest to rescan and load labels and embeddings from")
+    parser.add_argument("--methods", nargs="+", default=['kmeans', 'autoencoder'],
+                        choices=['kmeans', 'autoencoder', 'knn'])
+    parser.add_argument("--n-clusters", type=int, nargs="+", default=[2, 3, 5, 8])
+    parser.add_argument("--hidden-dims", nargs="+", default=["256,128,64", "128,64,32"],
+                        help="Autoencoder layer widths, comma separated, one grid point per argument")
+    parser.add_argument("--n-neighbors", type=int, nargs="+", default=[1, 5, 10])
+    parser.add_argument("--thresholds", nargs="+", default=list(THRESHOLD_STRATEGIES), choices=THRESHOLD_STRATEGIES)
+    parser.add_argument("--epochs", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--threads-per-worker", type=int, default=1)
+    parser.add_argument("--output", help="Write the ranked rows as JSON to this path")
+    parser.add_argument("--bundle", help="Write the best kmeans and autoencoder as a model bundle")
+    args = parser.parse_args()
+
+    X, y = load_dataset(args.real, args.fake, args.manifest)
+    hidden_dims = [tuple(int(d) for d in dims.split(",")) for dims in args.hidden_dims]
+    configs = build_grid(args.methods, args.n_clusters, hidden_dims, args.n_neighbors,
+                         args.thresholds, args.epochs)
+    print(f"Sweeping {len(configs)} configurations x {len(args.thresholds)} threshold strategies "
+          f"over {len(X)} embeddings")
+
+    rows, detectors = run_sweep(X, y, configs, args.workers, args.threads_per_worker)
+    print_table(rows)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(rows, f, indent=2)
+    if args.bundle:
+        write_bundle(args.bundle, rows, detectors)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,9 @@
 import torch
 import numpy as np
 from anomaly_detector import AnomalyDetector
-from resnet_extractor import extract_embeddings, fine_tune_model
+from resnet_extractor import fine_tune_model
+from embedding_store import cached_extract_embeddings
+from bundle import save_bundle, DEFAULT_BUNDLE_NAME
 import os
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import classification_report, confusion_matrix
@@ -25,11 +27,11 @@ def load_and_prepare_data():
     
     # Extract features
     print("Extracting features from real medicines...")
-    X_real, real_filenames = extract_embeddings(real_path)
+    X_real, real_filenames = cached_extract_embeddings(real_path)
     print(f"Found {len(X_real)} real medicine images")
     
     print("Extracting features from fake medicines...")
-    X_fake, fake_filenames = extract_embeddings(fake_path)
+    X_fake, fake_filenames = cached_extract_embeddings(fake_path)
     print(f"Found {len(X_fake)} fake medicine images")
     
     # Combine data
@@ -99,6 +101,7 @@ def train_models():
         print("\nSaving models...")
         joblib.dump(kmeans_detector, 'kmeans_detector.joblib')
         torch.save(autoencoder_detector.autoencoder.state_dict(), 'autoencoder_detector.pth')
+        save_bundle(DEFAULT_BUNDLE_NAME, {'kmeans': kmeans_detector, 'autoencoder': autoencoder_detector})
         
         # Print final results
         print("\nTraining completed successfully!")
@@ -1,6 +1,18 @@
+"""
+Writes labels.csv (filename, label) from the dataset manifest.
+
+The manifest (MODELS/dataset_manifest.py) is rescanned incrementally first,
+so only new or changed images are read. Prefer loading the manifest directly:
+
+    python MODELS/dataset_manifest.py scan
+"""
 import os
+import sys
 import csv
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "MODELS"))
+from dataset_manifest import LABELS, update_manifest
+
 # Folder paths
 real_folder = "real_medicines"
 fake_folder = "fake_medicines"
@@ -8,18 +20,12 @@ fake_folder = "fake_medicines"
 # Output CSV file
 csv_filename = "labels.csv"
 
+manifest, counts = update_manifest(folders={real_folder: 0, fake_folder: 1})
+
 with open(csv_filename, mode='w', newline='') as file:
     writer = csv.writer(file)
     writer.writerow(["filename", "label"])
+    for path, label in zip(manifest["path"], manifest["label"]):
+        writer.writerow([path, LABELS[label]])
 
-    # Real medicines
-    for fname in os.listdir(real_folder):
-        if fname.lower().endswith((".jpg", ".png", ".jpeg")):
-            writer.writerow([os.path.join(real_folder, fname), "real"])
-
-    # Fake medicines
-    for fname in os.listdir(fake_folder):
-        if fname.lower().endswith((".jpg", ".png", ".jpeg")):
-            writer.writerow([os.path.join(fake_folder, fname), "fake"])
-
-print(f"✅ CSV file created: {csv_filename}")
+print(f"✅ CSV file created: {csv_filename} ({counts['added'] + counts['changed']} images rescanned)")
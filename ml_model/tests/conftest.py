@@ -0,0 +1,87 @@
+import io
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# The ml_model scripts and the MODELS modules import each other by bare name
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, "MODELS")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+
+
+@pytest.fixture(scope="session")
+def embeddings():
+    """Synthetic 512-d genuine embeddings with a labelled validation set (1 = fake)"""
+    rng = np.random.default_rng(0)
+    centers = rng.normal(0, 1, (3, 512))
+    X = (centers[rng.integers(3, size=600)] + rng.normal(0, 0.3, (600, 512))).astype(np.float32)
+    real = (centers[rng.integers(3, size=100)] + rng.normal(0, 0.3, (100, 512))).astype(np.float32)
+    fake = rng.normal(0, 1.2, (100, 512)).astype(np.float32)
+    X_val = np.vstack([real, fake])
+    y_val = np.array([0] * len(real) + [1] * len(fake))
+    return X, X_val, y_val
+
+
+@pytest.fixture(scope="session")
+def detectors(embeddings):
+    """One fitted detector per method"""
+    import torch
+    from anomaly_detector import AnomalyDetector
+
+    X, X_val, y_val = embeddings
+    torch.manual_seed(0)
+    fitted = {}
+    for method in ("kmeans", "autoencoder", "knn"):
+        detector = AnomalyDetector(method=method)
+        if method == "autoencoder":
+            detector.fit(X, X_val, y_val, epochs=3, batch_size=64)
+        else:
+            detector.fit(X, X_val, y_val)
+        fitted[method] = detector
+    return fitted
+
+
+class ThresholdDetector:
+    """Flags an image as fake when its (stubbed) embedding is above 0.5"""
+
+    def score(self, features):
+        return {'scores': features[:, 0], 'labels': features[:, 0] > 0.5,
+                'probabilities': np.full(len(features), 0.9)}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """API test client with a stub embedding (mean brightness) and a single stub detector"""
+    from fastapi.testclient import TestClient
+    import api
+
+    batches = []
+
+    def embed(images):
+        batches.append(len(images))
+        return np.array([[np.asarray(image, dtype=np.float32).mean() / 255] for image in images])
+
+    monkeypatch.setattr(api, "load_models", lambda: None)
+    monkeypatch.setattr(api, "embed", embed)
+    monkeypatch.setattr(api, "kmeans_detector", ThresholdDetector())
+    monkeypatch.setattr(api, "autoencoder_detector", None)
+    monkeypatch.setattr(api, "knn_detector", None)
+    with TestClient(api.app) as client:
+        client.batches = batches
+        yield client
+
+
+@pytest.fixture
+def png():
+    """Encode a solid-colour 64x64 PNG"""
+    from PIL import Image
+
+    def encode(color):
+        buffer = io.BytesIO()
+        Image.new("RGB", (64, 64), color).save(buffer, format="PNG")
+        return buffer.getvalue()
+    return encode
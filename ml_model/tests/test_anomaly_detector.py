@@ -0,0 +1,204 @@
+import numpy as np
+import pytest
+
+from anomaly_detector import AnomalyDetector, classification_metrics
+from knn_index import IVFIndex
+
+
+def matched(a, b):
+    """Rows of b reordered to line up with the closest rows of a"""
+    return b[[int(np.argmin(((b - row) ** 2).sum(1))) for row in a]]
+
+
+def test_knn_separates_genuine_from_fake(embeddings):
+    X, X_val, y_val = embeddings
+    detector = AnomalyDetector(method='knn')
+    detector.fit(X, X_val, y_val)
+
+    predictions = detector.predict(X_val)
+    assert np.mean(predictions == y_val) > 0.95
+    probs = detector.predict_proba(X_val)
+    assert probs[y_val == 0].mean() > probs[y_val == 1].mean()
+
+
+def test_knn_small_gallery_gives_finite_threshold(embeddings):
+    X, _, _ = embeddings
+    detector = AnomalyDetector(method='knn', n_neighbors=5)
+    detector.fit(X[:6])
+    assert np.isfinite(detector.threshold)
+    assert np.all(np.isfinite(detector.knn_distances(X[6:20])))
+
+    with pytest.raises(ValueError):
+        AnomalyDetector(method='knn', n_neighbors=5).fit(X[:5])
+
+
+def test_knn_distances_ignore_missing_neighbours(embeddings):
+    X, _, _ = embeddings
+    detector = AnomalyDetector(method='knn', n_neighbors=100)
+    # Probing a single list of a few hundred vectors returns fewer than k candidates
+    detector.index = IVFIndex(dim=X.shape[1], n_lists=8, nprobe=1, max_candidates=0).add(X[:300])
+    detector.index.merge()
+    distances, _ = detector.index.search(X[300:310], 100)
+    assert not np.all(np.isfinite(distances))
+
+    mean_distances = detector.knn_distances(X[300:310])
+    assert np.all(np.isfinite(mean_distances))
+    expected = [row[np.isfinite(row)].mean() for row in distances]
+    np.testing.assert_allclose(mean_distances, expected, rtol=1e-5)
+
+
+def test_add_genuine_is_searched_immediately(embeddings):
+    X, _, _ = embeddings
+    detector = AnomalyDetector(method='knn', n_neighbors=1)
+    detector.fit(X[:300])
+    outlier = np.full((1, X.shape[1]), 10.0, dtype=np.float32)
+    assert detector.predict(outlier)[0]
+    detector.add_genuine(outlier)
+    assert detector.knn_distances(outlier)[0] == pytest.approx(0.0, abs=1e-2)
+
+
+def test_score_matches_reference_formulas(embeddings):
+    X, X_val, _ = embeddings
+    detector = AnomalyDetector(method='kmeans')
+    detector.fit(X)
+
+    distances = np.min(detector.kmeans.transform(X_val), axis=1)
+    np.testing.assert_allclose(detector.cluster_distances(X_val), distances, rtol=1e-4, atol=1e-4)
+
+    scored = detector.score(X_val)
+    np.testing.assert_array_equal(scored['labels'], detector.predict(X_val))
+    np.testing.assert_allclose(scored['probabilities'],
+                               1 / (1 + np.exp(scored['scores'] - detector.threshold)), rtol=1e-5)
+
+
+def test_autoencoder_score_runs_on_the_weights_device(embeddings):
+    import torch
+
+    _, X_val, _ = embeddings
+    detector = AnomalyDetector(method='autoencoder')
+    detector.autoencoder = detector.build_autoencoder()
+    detector.threshold = 1.0
+
+    X_tensor = torch.as_tensor(X_val)
+    with torch.no_grad():
+        expected = torch.mean((X_tensor - detector.autoencoder.eval()(X_tensor)) ** 2, dim=1).numpy()
+    scored = detector.score(X_val)
+    np.testing.assert_allclose(scored['scores'], expected, rtol=1e-5)
+    np.testing.assert_array_equal(scored['labels'], expected > 1.0)
+
+
+def test_far_outliers_do_not_overflow(embeddings):
+    import warnings
+
+    X, _, _ = embeddings
+    detector = AnomalyDetector(method='kmeans')
+    detector.fit(X)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", RuntimeWarning)
+        probabilities = detector.score(np.full((2, X.shape[1]), 1e4, dtype=np.float32))['probabilities']
+    assert np.all(probabilities < 1e-100)
+
+
+def test_resumed_training_matches_uninterrupted(embeddings, tmp_path):
+    import torch
+
+    X = embeddings[0]
+    torch.manual_seed(0)
+    straight = AnomalyDetector(method='autoencoder')
+    straight.train_autoencoder(X, epochs=4, batch_size=50)
+
+    checkpoint = str(tmp_path / "ae.ckpt")
+    torch.manual_seed(0)
+    AnomalyDetector(method='autoencoder').train_autoencoder(
+        X, epochs=2, batch_size=50, checkpoint_path=checkpoint, checkpoint_every=1)
+    torch.manual_seed(123)
+    resumed = AnomalyDetector(method='autoencoder')
+    history = resumed.train_autoencoder(X, epochs=4, batch_size=50, checkpoint_path=checkpoint, resume=True)
+
+    assert [h["epoch"] for h in history] == [1, 2, 3, 4]
+    assert [h["loss"] for h in history] == pytest.approx([h["loss"] for h in straight.history])
+    for a, b in zip(straight.autoencoder.state_dict().values(), resumed.autoencoder.state_dict().values()):
+        assert torch.equal(a, b)
+
+
+def test_training_keeps_remainder_batch_and_chunks_errors(embeddings):
+    X = embeddings[0][:130]
+    detector = AnomalyDetector(method='autoencoder')
+    history = detector.train_autoencoder(X, epochs=1, batch_size=64)
+    # 64 + 64 + 2: the remainder batch of two trains too
+    assert history[0]["samples_per_s"] * history[0]["seconds"] == pytest.approx(130)
+
+    # One row left over after chunking is still scored
+    errors = detector.reconstruction_errors(X, chunk_size=43)
+    np.testing.assert_allclose(errors, detector.reconstruction_errors(X), rtol=1e-5, atol=1e-7)
+    assert errors.shape == (130,) and np.all(errors >= 0)
+
+
+def test_partial_fit_matches_fit(embeddings):
+    X, _, _ = embeddings
+    full = AnomalyDetector(method='kmeans')
+    full.fit(X)
+
+    streamed = AnomalyDetector(method='kmeans')
+    for start in range(0, len(X), 100):
+        streamed.partial_fit(X[start:start + 100])
+
+    np.testing.assert_allclose(matched(full.centroids, streamed.centroids), full.centroids, atol=0.05)
+    assert streamed.cluster_counts.sum() == len(X)
+    assert streamed.distance_stats["count"] == len(X)
+    assert streamed.threshold == pytest.approx(full.threshold, rel=0.05)
+
+
+def test_fit_stream_equals_partial_fit_without_threshold_updates(embeddings):
+    X, _, _ = embeddings
+    chunks = [X[start:start + 150] for start in range(0, len(X), 150)]
+    streamed = AnomalyDetector(method='kmeans').fit_stream(chunks)
+
+    manual = AnomalyDetector(method='kmeans')
+    for chunk in chunks:
+        manual.partial_fit(chunk, update_threshold=False)
+    np.testing.assert_array_equal(streamed.centroids, manual.centroids)
+    assert streamed.threshold == pytest.approx(manual.stats_threshold())
+
+
+def test_partial_fit_continues_from_fit(embeddings):
+    X, _, _ = embeddings
+    detector = AnomalyDetector(method='kmeans')
+    detector.fit(X[:300])
+    detector.partial_fit(X[300:])
+    assert detector.cluster_counts.sum() == len(X)
+    assert detector.distance_stats["count"] == len(X)
+    assert detector.cluster_counts.sum() == len(X)
+    assert detector.distance_stats["count"] == len(X)
+
+
+def test_chunked_evaluate_matches_single_pass(detectors, embeddings):
+    _, X_val, y_val = embeddings
+    for detector in detectors.values():
+        whole = detector.evaluate(X_val, y_val, chunk_size=len(X_val), verbose=False)
+        chunked = detector.evaluate(X_val, y_val, chunk_size=7, verbose=False)
+        assert chunked["confusion"] == whole["confusion"]
+        assert chunked["threshold_grid"] == whole["threshold_grid"]
+        assert chunked["score_mean"] == pytest.approx(whole["score_mean"])
+        assert chunked["score_std"] == pytest.approx(whole["score_std"])
+
+        expected = classification_metrics(y_val, detector.predict(X_val))
+        for key, value in expected.items():
+            assert chunked["metrics"][key] == pytest.approx(value)
+
+
+def test_threshold_grid_matches_direct_counts(detectors, embeddings):
+    _, X_val, y_val = embeddings
+    detector = detectors['kmeans']
+    report = detector.evaluate(X_val, y_val, chunk_size=50, bins=50, verbose=False)
+    scores = detector.raw_scores(X_val)
+    grid = report["threshold_grid"]
+    for i in (5, 20, 35):
+        threshold = grid["thresholds"][i]
+        # A score counts as fake in the grid when its bin starts at or above the edge
+        edges = np.linspace(0.0, 3 * float(detector.threshold), 51)
+        bins = np.clip(np.searchsorted(edges, scores, side='right') - 1, 0, 49)
+        expected = classification_metrics(y_val, bins >= i)
+        assert grid["precision"][i] == pytest.approx(expected["precision"])
+        assert grid["recall"][i] == pytest.approx(expected["recall"])
+        assert threshold == pytest.approx(edges[i])
@@ -0,0 +1,137 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+import augment
+
+
+@pytest.fixture
+def batch():
+    rng = np.random.default_rng(0)
+    images = rng.integers(0, 256, (4, 32, 40, 3), dtype=np.uint8)
+    # A dark stroke on a light box for the font jitter
+    images[:, :, :] = np.maximum(images, 200)
+    images[:, 14:18, 5:35] = 20
+    return images
+
+
+@pytest.fixture
+def source_folder(tmp_path):
+    folder = tmp_path / "real"
+    folder.mkdir()
+    rng = np.random.default_rng(1)
+    for i in range(3):
+        Image.fromarray(rng.integers(0, 256, (120, 160, 3), dtype=np.uint8)).save(folder / f"real_{i}.jpg")
+    return str(folder)
+
+
+def test_noise_clips_instead_of_wrapping():
+    white = np.full((2, 16, 16, 3), 250, dtype=np.uint8)
+    noisy = augment.gaussian_noise(white, np.random.default_rng(0), sigma=(40.0, 40.0))
+    assert noisy.dtype == np.uint8
+    # Wrapped values would land near 0
+    assert noisy.min() > 100 and noisy.max() == 255
+
+
+def test_hue_shift_keeps_greys_and_rotates_colours():
+    rng = np.random.default_rng(0)
+    grey = np.full((2, 8, 8, 3), 128, dtype=np.uint8)
+    np.testing.assert_array_equal(augment.hue_shift(grey, rng), grey)
+
+    red = np.zeros((3, 8, 8, 3), dtype=np.uint8)
+    red[..., 0] = 255
+    shifted = augment.hue_shift(red, np.random.default_rng(3), max_shift=30)
+    hues = cv2.cvtColor(shifted.reshape(-1, 8, 3), cv2.COLOR_RGB2HSV)[..., 0]
+    # OpenCV hue is 0..179, so a shift of up to 30 from red wraps to at most 30 or at least 150
+    assert np.all((hues <= 30) | (hues >= 150))
+
+
+def test_blur_matches_opencv(batch):
+    rng = np.random.default_rng(5)
+    sigmas = np.random.default_rng(5).uniform(0.6, 2.0, size=len(batch))
+    blurred = augment.blur(batch, rng)
+    for image, out, sigma in zip(batch, blurred, sigmas):
+        expected = cv2.GaussianBlur(image, (13, 13), sigma, borderType=cv2.BORDER_REPLICATE)
+        assert np.abs(out.astype(int) - expected.astype(int)).max() <= 1
+
+
+def test_misregistration_offsets_each_channel(batch):
+    rng = np.random.default_rng(7)
+    replay = np.random.default_rng(7)
+    dy = replay.integers(-4, 5, size=(len(batch), 3))
+    dx = replay.integers(-4, 5, size=(len(batch), 3))
+    shifted = augment.misregistration(batch, rng)
+    assert shifted.shape == batch.shape and shifted.flags.c_contiguous
+    h, w = batch.shape[1:3]
+    for n in range(len(batch)):
+        for c in range(3):
+            rows = np.clip(np.arange(h) - dy[n, c], 0, h - 1)
+            cols = np.clip(np.arange(w) - dx[n, c], 0, w - 1)
+            np.testing.assert_array_equal(shifted[n, :, :, c], batch[n, :, :, c][np.ix_(rows, cols)])
+
+
+def test_font_jitter_changes_stroke_weight(batch):
+    jittered = augment.font_jitter(batch, np.random.default_rng(0))
+    dark_before = (batch < 50).all(axis=-1).sum(axis=(1, 2))
+    dark_after = (jittered < 50).all(axis=-1).sum(axis=(1, 2))
+    assert np.all(dark_after != dark_before)
+
+
+def test_every_image_gets_at_least_one_op(batch):
+    out = augment.augment_batch(batch, np.random.default_rng(0), p=0.0)
+    assert out.shape == batch.shape and out.dtype == np.uint8
+    assert all(not np.array_equal(a, b) for a, b in zip(out, batch))
+
+
+def test_generated_counterfeits_are_deterministic(source_folder):
+    paths = sorted(os.path.join(source_folder, f) for f in os.listdir(source_folder))
+    first = list(augment.generate_counterfeits(paths, 7, batch_size=3, workers=1, seed=4, size=32))
+    second = list(augment.generate_counterfeits(paths, 7, batch_size=3, workers=1, seed=4, size=32))
+    assert [len(b) for _, b in first] == [3, 3, 1]
+    assert sum((s for s, _ in first), []).count(paths[0]) >= 2
+    for (s1, b1), (s2, b2) in zip(first, second):
+        assert s1 == s2
+        np.testing.assert_array_equal(b1, b2)
+    with pytest.raises(ValueError):
+        next(augment.generate_counterfeits([], 1))
+
+
+def test_counterfeit_embeddings_stream_into_the_extractor(source_folder, monkeypatch, tmp_path):
+    import resnet_extractor
+
+    inputs = []
+
+    def embed(tensors):
+        inputs.append(tensors)
+        return np.tile(tensors.mean(axis=(1, 2, 3))[:, None], (1, resnet_extractor.EMBEDDING_DIM))
+
+    monkeypatch.setattr(resnet_extractor, "embed", embed)
+    out = str(tmp_path / "fake.npy")
+    embeddings, sources = augment.extract_counterfeit_embeddings(source_folder, 5, batch_size=2, workers=1, out=out)
+    assert embeddings.shape == (5, resnet_extractor.EMBEDDING_DIM) and len(sources) == 5
+    assert all(batch.shape[1:] == (3, 224, 224) and batch.dtype == np.float32 for batch in inputs)
+    np.testing.assert_array_equal(np.load(out), embeddings)
+
+
+def test_to_network_input_matches_the_extractor_normalization():
+    image = np.random.default_rng(0).integers(0, 256, (224, 224, 3), dtype=np.uint8)
+    from resnet_extractor import transform
+
+    expected = transform(Image.fromarray(image)).numpy()
+    np.testing.assert_allclose(augment.to_network_input(image[None])[0], expected, atol=1e-5)
+
+
+def test_webscape_writes_fakes_through_augment(source_folder, tmp_path, monkeypatch):
+    import webscape
+
+    monkeypatch.chdir(tmp_path)
+    os.rename(source_folder, tmp_path / "real_medicines")
+    written = webscape.generate_fake_medicine_images(4, folder="fakes", workers=1)
+    assert written == 4
+    names = sorted(os.listdir(tmp_path / "fakes"))
+    assert len(names) == 4 and all(name.startswith("fake_") and name.endswith(".jpg") for name in names)
+    with Image.open(tmp_path / "fakes" / names[0]) as image:
+        assert image.size == (224, 224)
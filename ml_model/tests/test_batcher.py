@@ -0,0 +1,127 @@
+import asyncio
+import time
+
+import pytest
+
+from batcher import MicroBatcher
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_concurrent_items_are_coalesced_in_order():
+    batches = []
+
+    def process(items):
+        batches.append(list(items))
+        return [item * 2 for item in items]
+
+    async def main():
+        batcher = MicroBatcher(process, max_batch_size=4, max_wait_ms=50)
+        results = await asyncio.gather(*[batcher.submit(i) for i in range(10)])
+        await batcher.stop()
+        return batcher, results
+
+    batcher, results = run(main())
+    assert results == [i * 2 for i in range(10)]
+    assert [len(b) for b in batches] == [4, 4, 2]
+    assert sum(batches, []) == list(range(10))
+    assert batcher.stats()["batch_size_counts"] == {2: 1, 4: 2}
+
+
+def test_lone_item_is_dispatched_after_max_wait():
+    async def main():
+        batcher = MicroBatcher(lambda items: items, max_batch_size=8, max_wait_ms=30)
+        start = time.perf_counter()
+        result = await batcher.submit("x")
+        elapsed = time.perf_counter() - start
+        await batcher.stop()
+        return result, elapsed
+
+    result, elapsed = run(main())
+    assert result == "x"
+    assert 0.025 <= elapsed < 0.5
+
+
+def test_items_arriving_within_the_window_share_a_batch():
+    sizes = []
+
+    def process(items):
+        sizes.append(len(items))
+        return items
+
+    async def main():
+        batcher = MicroBatcher(process, max_batch_size=8, max_wait_ms=100)
+
+        async def late(i):
+            await asyncio.sleep(0.01 * i)
+            return await batcher.submit(i)
+        await asyncio.gather(*[late(i) for i in range(3)])
+        await batcher.stop()
+
+    run(main())
+    assert sizes == [3]
+
+
+def test_batch_errors_reach_every_caller():
+    def process(items):
+        raise RuntimeError("model failed")
+
+    async def main():
+        batcher = MicroBatcher(process, max_batch_size=4, max_wait_ms=5)
+        results = await asyncio.gather(*[batcher.submit(i) for i in range(3)], return_exceptions=True)
+        await batcher.stop()
+        return batcher, results
+
+    batcher, results = run(main())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert batcher.errors == 1
+
+
+def test_wrong_result_count_is_an_error():
+    async def main():
+        batcher = MicroBatcher(lambda items: items[:-1], max_batch_size=4, max_wait_ms=5)
+        with pytest.raises(RuntimeError, match="2 results for 3 items"):
+            await asyncio.gather(*[batcher.submit(i) for i in range(3)])
+        await batcher.stop()
+
+    run(main())
+
+
+def test_max_batch_size_must_be_positive():
+    with pytest.raises(ValueError):
+        MicroBatcher(lambda items: items, max_batch_size=0)
+
+
+def test_max_concurrency_keeps_several_batches_in_flight():
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+
+    active = []
+    peak = []
+    lock = threading.Lock()
+
+    def process(items):
+        with lock:
+            active.append(1)
+            peak.append(len(active))
+        time.sleep(0.05)
+        with lock:
+            active.pop()
+        return items
+
+    async def main(max_concurrency):
+        peak.clear()
+        executor = ThreadPoolExecutor(max_workers=4)
+        batcher = MicroBatcher(process, max_batch_size=2, max_wait_ms=1, executor=executor,
+                               max_concurrency=max_concurrency)
+        results = await asyncio.gather(*[batcher.submit(i) for i in range(8)])
+        await batcher.stop()
+        executor.shutdown()
+        return results
+
+    assert run(main(1)) == list(range(8))
+    assert max(peak) == 1
+    assert run(main(3)) == list(range(8))
+    assert max(peak) == 3
@@ -0,0 +1,48 @@
+import io
+import json
+import os
+
+import numpy as np
+
+import benchmark
+
+BASELINE = os.path.join(os.path.dirname(benchmark.__file__), "benchmark_baseline.json")
+
+
+def result(median_ms):
+    return {"median_ms": median_ms, "p95_ms": median_ms, "items": 1, "items_per_s": 1000 / median_ms}
+
+
+def test_compare_flags_only_regressions_beyond_tolerance():
+    baseline = {"results": {"fast": result(10.0), "slow": result(10.0), "faster": result(10.0)}}
+    report = {"results": {"fast": result(12.0), "slow": result(13.0), "faster": result(5.0),
+                          "new": result(99.0)}}
+
+    assert benchmark.compare(report, baseline, tolerance=0.25) == ["slow"]
+    assert report["results"]["slow"]["ratio"] == 1.3
+    assert report["results"]["faster"]["baseline_median_ms"] == 10.0
+    assert "ratio" not in report["results"]["new"]
+
+
+def test_committed_baseline_uses_the_documented_settings():
+    with open(BASELINE) as f:
+        baseline = json.load(f)
+    assert baseline["config"] == {"images": 16, "image_size": [800, 600], "repeats": 3}
+    names = set(baseline["results"])
+    assert {"preprocess/legacy", "preprocess/fast", "api/predict/sequential",
+            "api/predict/concurrent", "detector/kmeans/predict"} <= names
+    assert any(name.startswith("extract_embeddings/bs32/") for name in names)
+    assert baseline["preprocess_parity"]["passed"]
+
+
+def test_preprocess_parity_on_synthetic_images():
+    rng = np.random.default_rng(0)
+    blobs = []
+    for _ in range(3):
+        buffer = io.BytesIO()
+        benchmark.synthetic_medicine_image(rng, (640, 480)).save(buffer, format="JPEG", quality=90)
+        blobs.append(buffer.getvalue())
+
+    parity = benchmark.preprocess_parity(blobs, ["a", "b", "c"], min_cosine=0.98)
+    assert parity["passed"] and parity["min"] >= 0.98
+    assert sorted(parity["worst"]) == ["a", "b", "c"]
@@ -0,0 +1,119 @@
+import os
+
+import numpy as np
+import pytest
+
+from bundle import load_bundle, read_header, save_bundle
+
+
+@pytest.fixture
+def bundle_path(detectors, tmp_path):
+    path = str(tmp_path / "model_bundle.fmd")
+    save_bundle(path, detectors, metadata={"run": "test"})
+    return path
+
+
+def test_round_trip_scores_match(detectors, embeddings, bundle_path):
+    _, X_val, _ = embeddings
+    header, loaded = load_bundle(bundle_path)
+    assert header["metadata"] == {"run": "test"}
+    assert set(loaded) == set(detectors)
+    for name, detector in detectors.items():
+        original, restored = detector.score(X_val), loaded[name].score(X_val)
+        assert loaded[name].threshold == pytest.approx(detector.threshold)
+        np.testing.assert_allclose(restored["scores"], original["scores"], rtol=1e-5, atol=1e-6)
+        np.testing.assert_array_equal(restored["labels"], original["labels"])
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/maps"), reason="needs /proc")
+def test_autoencoder_weights_stay_in_the_mapped_file(bundle_path):
+    _, loaded = load_bundle(bundle_path)
+    pointer = loaded["autoencoder"].autoencoder.encoder[0].weight.data_ptr()
+    with open("/proc/self/maps") as f:
+        mapped = [line.split()[0] for line in f if bundle_path in line]
+    ranges = [tuple(int(x, 16) for x in span.split("-")) for span in mapped]
+    assert any(lo <= pointer < hi for lo, hi in ranges)
+
+
+def test_checksum_mismatch_is_rejected(bundle_path):
+    header = read_header(bundle_path)
+    spec = header["arrays"]["kmeans/centroids"]
+    with open(bundle_path, "r+b") as f:
+        f.seek(header["data_start"] + spec["offset"])
+        byte = f.read(1)
+        f.seek(header["data_start"] + spec["offset"])
+        f.write(bytes([byte[0] ^ 0xFF]))
+
+    with pytest.raises(ValueError, match="checksum mismatch for 'kmeans/centroids'"):
+        load_bundle(bundle_path)
+
+
+def test_truncated_bundle_is_rejected(bundle_path):
+    with open(bundle_path, "r+b") as f:
+        f.truncate(f.seek(0, 2) - 4096)
+    with pytest.raises(ValueError, match="truncated"):
+        load_bundle(bundle_path, verify=False)
+
+
+def test_bundle_for_another_backend_is_rejected(bundle_path):
+    with pytest.raises(ValueError, match=r"\+dynamic_int8"):
+        load_bundle(bundle_path, backend="dynamic_int8")
+
+
+def test_not_a_bundle(tmp_path):
+    path = tmp_path / "model.joblib"
+    path.write_bytes(b"not a bundle at all")
+    with pytest.raises(ValueError, match="is not a model bundle"):
+        read_header(str(path))
+
+
+def test_legacy_autoencoder_without_dropout_layout(detectors, embeddings, tmp_path):
+    import torch
+    from bundle import load_legacy_autoencoder
+
+    _, X_val, _ = embeddings
+    detector = detectors["autoencoder"]
+    # Older training code saved Linear, BatchNorm, ReLU blocks without a Dropout slot
+    state = {}
+    for key, value in detector.autoencoder.state_dict().items():
+        part, layer, name = key.split('.', 2)
+        layer = int(layer)
+        state[f"{part}.{layer // 4 * 3 + layer % 4}.{name}"] = value
+    path = str(tmp_path / "autoencoder_detector.pth")
+    torch.save(state, path)
+
+    with pytest.raises(ValueError):
+        load_legacy_autoencoder(path, None)
+    legacy = load_legacy_autoencoder(path, detector.threshold)
+    np.testing.assert_allclose(legacy.score(X_val)["scores"], detector.score(X_val)["scores"], rtol=1e-5)
+
+
+def test_loaded_kmeans_keeps_streaming(embeddings, tmp_path):
+    from anomaly_detector import AnomalyDetector
+
+    X, _, _ = embeddings
+    detector = AnomalyDetector(method='kmeans')
+    detector.fit(X[:300])
+    path = str(tmp_path / "stream.fmd")
+    save_bundle(path, {"kmeans": detector})
+    loaded = load_bundle(path)[1]["kmeans"]
+
+    np.testing.assert_array_equal(loaded.cluster_counts, detector.cluster_counts)
+    assert loaded.distance_stats == pytest.approx(detector.distance_stats)
+    loaded.partial_fit(X[300:])
+    detector.partial_fit(X[300:])
+    np.testing.assert_allclose(loaded.centroids, detector.centroids, rtol=1e-5, atol=1e-6)
+    assert loaded.threshold == pytest.approx(detector.threshold, rel=1e-5)
+
+
+def test_autoencoder_hidden_dims_round_trip(embeddings, tmp_path):
+    from anomaly_detector import AnomalyDetector
+
+    X, X_val, _ = embeddings
+    detector = AnomalyDetector(method='autoencoder', hidden_dims=(64, 32, 16))
+    detector.fit(X, epochs=1, batch_size=64)
+    path = str(tmp_path / "small.fmd")
+    save_bundle(path, {"autoencoder": detector})
+    loaded = load_bundle(path)[1]["autoencoder"]
+    assert tuple(loaded.hidden_dims) == (64, 32, 16)
+    np.testing.assert_allclose(loaded.raw_scores(X_val), detector.raw_scores(X_val), rtol=1e-5, atol=1e-7)
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+import api
+
+
+@pytest.fixture
+def serving(detectors, monkeypatch):
+    monkeypatch.setattr(api, "kmeans_detector", detectors["kmeans"])
+    monkeypatch.setattr(api, "autoencoder_detector", detectors["autoencoder"])
+    monkeypatch.setattr(api, "knn_detector", detectors["knn"])
+
+
+def features(embeddings):
+    X, X_val, _ = embeddings
+    rng = np.random.default_rng(3)
+    # Validation rows plus blends of real and fake ones, so some images are close calls
+    blends = [(1 - w) * X[:50] + w * X_val[-50:] for w in np.linspace(0.2, 0.8, 7)]
+    return np.vstack([X_val] + blends + [rng.normal(0, 1, (50, 512))]).astype(np.float32)
+
+
+def run(batch, monkeypatch, order=None, band=0.25, threshold=None):
+    if threshold is not None:
+        monkeypatch.setattr(api, "CONFIDENCE_THRESHOLD", threshold)
+    monkeypatch.setattr(api, "CASCADE", order is not None)
+    if order is not None:
+        monkeypatch.setattr(api, "CASCADE_ORDER", order)
+        monkeypatch.setattr(api, "CASCADE_BAND", band)
+    return api.ensemble_predictions(api.get_model_predictions(batch))
+
+
+@pytest.mark.parametrize("order", [["kmeans", "autoencoder", "knn"], ["autoencoder", "knn", "kmeans"],
+                                   ["knn", "kmeans"]])
+@pytest.mark.parametrize("band", [0.0, 0.25])
+@pytest.mark.parametrize("threshold", [0.6, 0.8])
+def test_cascade_verdicts_match_full_ensemble(serving, embeddings, monkeypatch, order, band,
+                                                           threshold):
+    batch = features(embeddings)
+    full = run(batch, monkeypatch, threshold=threshold)
+    cascaded = run(batch, monkeypatch, order, band, threshold)
+
+    assert [r["is_fake"] for r in cascaded] == [r["is_fake"] for r in full]
+    assert all(r["stages_run"][0] == order[0] for r in cascaded)
+    assert all(len(r["stages_run"]) == 3 and "confidence_range" not in r for r in full)
+    # Detectors missing from CASCADE_ORDER still run, last
+    assert {name for r in cascaded for name in r["stages_run"]} == {"kmeans", "autoencoder", "knn"}
+
+
+def test_full_confidence_lies_in_the_reported_range(serving, embeddings, monkeypatch):
+    batch = features(embeddings)
+    full = run(batch, monkeypatch)
+    cascaded = run(batch, monkeypatch, ["kmeans", "autoencoder", "knn"], band=0.0)
+
+    partial = [(f, c) for f, c in zip(full, cascaded) if len(c["stages_run"]) < 3]
+    assert partial
+    for f, c in partial:
+        low, high = c["confidence_range"]
+        assert low <= c["confidence"] <= high
+        assert low <= f["confidence"] <= high
+        # Warnings follow the confidence of the stages that ran
+        low_confidence = 1 - api.CONFIDENCE_THRESHOLD < c["confidence"] < api.CONFIDENCE_THRESHOLD
+        assert ("warning" in c) == low_confidence
+    for f, c in zip(full, cascaded):
+        if len(c["stages_run"]) == 3:
+            assert c["confidence"] == pytest.approx(f["confidence"])
+
+
+def test_cascade_skips_settled_images(serving, embeddings, monkeypatch):
+    responses = run(features(embeddings), monkeypatch, ["kmeans", "autoencoder", "knn"], band=0.0)
+    assert any(r["stages_run"] == ["kmeans", "autoencoder"] for r in responses)
+    skipped = next(r for r in responses if r["stages_run"] == ["kmeans", "autoencoder"])
+    assert list(skipped["model_details"]) == ["kmeans", "autoencoder"]
@@ -0,0 +1,82 @@
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from dataset_manifest import scan
+from embedding_store import EmbeddingStore, file_hash
+
+
+@pytest.fixture
+def folders(tmp_path):
+    folders = {}
+    for label, name in enumerate(("real", "fake")):
+        folder = tmp_path / name
+        folder.mkdir()
+        for i in range(3):
+            Image.new("RGB", (16 + i, 16), (label * 200, i * 60, 90)).save(folder / f"{name}_{i}.png")
+        folders[str(folder)] = label
+    return folders
+
+
+def image_paths(folders):
+    return sorted(os.path.join(folder, name) for folder in folders for name in os.listdir(folder))
+
+
+def store_with(tmp_path, paths):
+    """Store holding a distinct vector per image, in reverse path order"""
+    store = EmbeddingStore(str(tmp_path / "store"), extractor_version="test", dim=4)
+    for row, path in enumerate(reversed(paths)):
+        store.index["rows"][store.key(file_hash(path))] = row
+        store.vectors[row] = row
+    store.index["size"] = len(paths)
+    return store
+
+
+def expected(store, manifest):
+    return np.array([store.vectors[store.index["rows"][store.key(h.decode())]] for h in manifest["sha256"]])
+
+
+def test_embeddings_follow_rows_moved_by_the_store(folders, tmp_path):
+    paths = image_paths(folders)
+    store = store_with(tmp_path, paths)
+    manifest, _ = scan(folders, store=store)
+    assert (manifest["embedding_row"] >= 0).all()
+
+    # The store reuses rows after the scan: swap two entries' rows and vectors
+    rows = store.index["rows"]
+    a, b = list(rows)[:2]
+    rows[a], rows[b] = rows[b], rows[a]
+    store.vectors[[rows[a], rows[b]]] = store.vectors[[rows[b], rows[a]]] + 100
+
+    X, y = manifest.embeddings(store)
+    np.testing.assert_array_equal(X, expected(store, manifest))
+    np.testing.assert_array_equal(y, manifest["label"])
+
+
+def test_embeddings_skip_rows_the_store_evicted(folders, tmp_path):
+    paths = image_paths(folders)
+    store = store_with(tmp_path, paths)
+    manifest, _ = scan(folders, store=store)
+    del store.index["rows"][store.key(manifest["sha256"][0].decode())]
+
+    X, y = manifest.embeddings(store)
+    assert len(X) == len(manifest) - 1
+    np.testing.assert_array_equal(y, manifest["label"][1:])
+
+
+def test_rescan_without_store_keeps_embedding_rows(folders, tmp_path):
+    paths = image_paths(folders)
+    store = store_with(tmp_path, paths)
+    linked, _ = scan(folders, store=store)
+
+    changed = paths[0]
+    Image.new("RGB", (40, 40), (1, 2, 3)).save(changed)
+    rescanned, counts = scan(folders, previous=linked)
+
+    assert counts["changed"] == 1 and counts["unchanged"] == len(paths) - 1
+    assert rescanned.extractor_version == "test"
+    keep = rescanned["path"] != changed
+    np.testing.assert_array_equal(rescanned["embedding_row"][keep], linked["embedding_row"][keep])
+    assert rescanned["embedding_row"][~keep].tolist() == [-1]
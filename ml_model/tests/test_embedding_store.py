@@ -0,0 +1,122 @@
+import os
+
+import numpy as np
+import pytest
+
+import embedding_store
+from embedding_store import EmbeddingStore
+
+
+@pytest.fixture
+def extracted(monkeypatch):
+    """Replace the network with a vector derived from file contents and record what was embedded"""
+    calls = []
+
+    def iter_path_embeddings(paths, batch_size=32, num_workers=None):
+        calls.extend(os.path.basename(p) for p in paths)
+        for start in range(0, len(paths), batch_size):
+            chunk = paths[start:start + batch_size]
+            emb = np.array([fake_vector(open(p, "rb").read()) for p in chunk], dtype=np.float32)
+            yield list(range(start, start + len(chunk))), emb
+
+    monkeypatch.setattr(embedding_store, "iter_path_embeddings", iter_path_embeddings)
+    return calls
+
+
+def fake_vector(contents, dim=embedding_store.EMBEDDING_DIM):
+    return np.full(dim, sum(contents) % 997, dtype=np.float32)
+
+
+def write(folder, name, contents):
+    path = folder / name
+    path.write_bytes(contents)
+    return path
+
+
+@pytest.fixture
+def folder(tmp_path):
+    images = tmp_path / "images"
+    images.mkdir()
+    for i in range(3):
+        write(images, f"{i}.jpg", bytes([i + 1]) * (10 + i))
+    return images
+
+
+def test_second_pass_is_served_from_the_store(tmp_path, folder, extracted):
+    store_dir = str(tmp_path / "store")
+    first, names = EmbeddingStore(store_dir).get_embeddings(str(folder))
+    assert names == ["0.jpg", "1.jpg", "2.jpg"]
+    assert extracted == names
+
+    extracted.clear()
+    second, names = EmbeddingStore(store_dir).get_embeddings(str(folder))
+    assert extracted == []
+    np.testing.assert_array_equal(first, second)
+    assert first[1][0] == fake_vector((folder / "1.jpg").read_bytes())[0]
+
+
+def test_changed_content_is_reembedded_but_touched_file_is_not(tmp_path, folder, extracted):
+    store = EmbeddingStore(str(tmp_path / "store"))
+    store.get_embeddings(str(folder))
+    extracted.clear()
+
+    write(folder, "0.jpg", b"\x09" * 40)
+    stat = os.stat(folder / "1.jpg")
+    os.utime(folder / "1.jpg", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    embeddings, _ = store.get_embeddings(str(folder))
+    assert extracted == ["0.jpg"]
+    assert embeddings[0][0] == fake_vector(b"\x09" * 40)[0]
+    assert len(store) == 3
+
+
+def test_duplicate_contents_share_one_row(tmp_path, folder, extracted):
+    write(folder, "copy.jpg", (folder / "0.jpg").read_bytes())
+    store = EmbeddingStore(str(tmp_path / "store"))
+    embeddings, names = store.get_embeddings(str(folder))
+    assert len(names) == 4 and len(store) == 3
+    assert len(extracted) == 3
+    np.testing.assert_array_equal(embeddings[0], embeddings[3])
+
+
+def test_removed_files_are_evicted_and_rows_reused(tmp_path, folder, extracted):
+    store = EmbeddingStore(str(tmp_path / "store"))
+    store.get_embeddings(str(folder))
+    freed_row = store.index["rows"][store.key(store.index["paths"][str(folder / "2.jpg")][0])]
+
+    os.remove(folder / "2.jpg")
+    store.get_embeddings(str(folder))
+    assert len(store) == 2
+    assert store.index["free"] == [freed_row]
+
+    write(folder, "new.jpg", b"\x07" * 33)
+    store.get_embeddings(str(folder))
+    assert store.index["free"] == []
+    assert store.index["size"] == 3
+
+
+def test_extractor_version_change_recomputes_and_evicts_old_rows(tmp_path, folder, extracted):
+    store_dir = str(tmp_path / "store")
+    EmbeddingStore(store_dir, extractor_version="v1").get_embeddings(str(folder))
+    extracted.clear()
+
+    store = EmbeddingStore(store_dir, extractor_version="v2")
+    store.get_embeddings(str(folder))
+    assert sorted(extracted) == ["0.jpg", "1.jpg", "2.jpg"]
+    assert all(key.startswith("v2/") for key in store.index["rows"])
+    assert len(store) == 3
+    assert len(store.index["free"]) == 3
+
+
+def test_store_grows_past_its_initial_capacity(tmp_path, extracted):
+    images = tmp_path / "many"
+    images.mkdir()
+    for i in range(1100):
+        write(images, f"{i:04d}.jpg", i.to_bytes(2, "big") * 3)
+    store = EmbeddingStore(str(tmp_path / "store"))
+    embeddings, names = store.get_embeddings(str(images), batch_size=256)
+    assert len(names) == 1100 and len(store.vectors) >= 1100
+    np.testing.assert_array_equal(embeddings[1099], fake_vector((images / "1099.jpg").read_bytes()))
+
+    reopened = EmbeddingStore(str(tmp_path / "store"))
+    np.testing.assert_array_equal(reopened.get_embeddings(str(images))[0], embeddings)
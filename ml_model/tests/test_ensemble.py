@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+import api
+
+
+def reference_ensemble(results):
+    """The per-image weighted vote the vectorized ensemble replaces"""
+    total_weight = sum(r['confidence'] for r in results.values())
+    if total_weight == 0:
+        return {"is_fake": None, "confidence": 0.0}
+    avg_confidence = sum(r['confidence'] * (0 if r['is_fake'] else 1) for r in results.values()) / total_weight
+    response = {"is_fake": avg_confidence < 0.5, "confidence": avg_confidence}
+    if 1 - api.CONFIDENCE_THRESHOLD < avg_confidence < api.CONFIDENCE_THRESHOLD:
+        response["warning"] = "Low confidence prediction"
+    return response
+
+
+def test_vectorized_ensemble_matches_per_image_vote():
+    rng = np.random.default_rng(0)
+    n = 200
+    outputs = {
+        name: {'labels': rng.random(n) > 0.5, 'probabilities': rng.random(n)}
+        for name in ('kmeans', 'autoencoder', 'knn')
+    }
+    outputs['knn']['probabilities'][:3] = 0.0
+    outputs['kmeans']['probabilities'][:3] = 0.0
+    outputs['autoencoder']['probabilities'][:3] = 0.0
+
+    responses = api.ensemble_predictions(outputs)
+    assert len(responses) == n
+    for i, response in enumerate(responses):
+        details = {name: {'is_fake': bool(out['labels'][i]), 'confidence': float(out['probabilities'][i])}
+                   for name, out in outputs.items()}
+        expected = reference_ensemble(details)
+        assert response["model_details"] == details
+        assert response["is_fake"] == expected["is_fake"]
+        assert response["confidence"] == pytest.approx(expected["confidence"])
+        assert response.get("warning") == expected.get("warning")
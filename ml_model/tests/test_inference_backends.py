@@ -0,0 +1,122 @@
+import os
+
+import numpy as np
+import pytest
+import torch
+
+import inference_backends
+from inference_backends import _build_once, build_backend, calibration_key, export_onnx
+from resnet_extractor import resnet
+
+
+@pytest.fixture(scope="module")
+def inputs():
+    torch.manual_seed(0)
+    return torch.randn(4, 3, 224, 224)
+
+
+def cosine(a, b):
+    return np.sum(a * b, axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+
+
+@pytest.fixture(scope="module")
+def reference(inputs):
+    return build_backend('eager', resnet)(inputs)
+
+
+def test_torchscript_matches_eager(inputs, reference):
+    embeddings = build_backend('torchscript', resnet)(inputs)
+    assert embeddings.shape == (4, 512)
+    assert cosine(embeddings, reference).min() > 0.9999
+
+
+def test_onnx_matches_eager(inputs, reference, tmp_path):
+    pytest.importorskip("onnxruntime")
+    embeddings = build_backend('onnx', resnet, cache_dir=str(tmp_path))(inputs)
+    assert cosine(embeddings, reference).min() > 0.9999
+    assert os.listdir(tmp_path) == ["resnet18.onnx"]
+
+
+def test_unknown_backend_raises():
+    with pytest.raises(ValueError):
+        build_backend('tensorrt', resnet)
+
+
+def test_build_once_leaves_no_partial_file(tmp_path):
+    path = str(tmp_path / "model.onnx")
+
+    def failing_build(tmp):
+        with open(tmp, 'w') as f:
+            f.write("half")
+        raise RuntimeError("export failed")
+
+    with pytest.raises(RuntimeError):
+        _build_once(path, failing_build)
+    assert os.listdir(tmp_path) == []
+
+    calls = []
+
+    def build(tmp):
+        calls.append(tmp)
+        with open(tmp, 'w') as f:
+            f.write("model")
+
+    assert _build_once(path, build) == path
+    assert _build_once(path, build) == path
+    assert len(calls) == 1 and calls[0] != path
+    assert open(path).read() == "model"
+
+
+def test_export_only_passes_dynamo_when_supported(tmp_path, monkeypatch):
+    seen = {}
+
+    def old_export(model, args, f, input_names=None, output_names=None, opset_version=None,
+                   dynamic_axes=None):
+        seen.update(opset_version=opset_version)
+        open(f, 'w').close()
+
+    monkeypatch.setattr(torch.onnx, "export", old_export)
+    export_onnx(torch.nn.Identity(), str(tmp_path / "old.onnx"))
+    assert seen == {"opset_version": 17}
+
+    def new_export(model, args, f, dynamo=True, **kwargs):
+        seen.update(dynamo=dynamo)
+        open(f, 'w').close()
+
+    monkeypatch.setattr(torch.onnx, "export", new_export)
+    export_onnx(torch.nn.Identity(), str(tmp_path / "new.onnx"))
+    assert seen["dynamo"] is False
+
+
+def test_calibration_key_tracks_folder_count_and_contents(tmp_path):
+    from PIL import Image
+
+    first, second = tmp_path / "a", tmp_path / "b"
+    for folder in (first, second):
+        folder.mkdir()
+        for i in range(3):
+            Image.new("RGB", (8, 8), (i, 0, 0)).save(folder / f"{i}.png")
+
+    key = calibration_key(str(first), 3)
+    assert calibration_key(str(first), 3) == key
+    assert calibration_key(str(first), 2) != key
+    assert calibration_key(str(second), 3) != key
+
+    Image.new("RGB", (16, 16)).save(first / "1.png")
+    assert calibration_key(str(first), 3) != key
+
+
+def test_static_int8_cache_is_keyed_by_calibration(tmp_path, monkeypatch):
+    pytest.importorskip("onnxruntime")
+    built = []
+    monkeypatch.setattr(inference_backends, "_build_once",
+                        lambda path, build: built.append(os.path.basename(path)) or path)
+    monkeypatch.setattr(inference_backends, "calibration_key",
+                        lambda folder, n_images: f"{os.path.basename(folder)}-{n_images}")
+
+    prefix = str(tmp_path / "resnet18")
+    inference_backends.quantize_onnx_static("fp32.onnx", prefix, "real", 64)
+    inference_backends.quantize_onnx_static("fp32.onnx", prefix, "real", 16)
+    inference_backends.quantize_onnx_static("fp32.onnx", prefix, "other", 64)
+    assert built == ["resnet18.static_int8.real-64.onnx", "resnet18.static_int8.real-16.onnx",
+                     "resnet18.static_int8.other-64.onnx"]
@@ -0,0 +1,56 @@
+import numpy as np
+
+from knn_index import IVFIndex
+
+
+def clustered(n, dim=32, centers=16, seed=0):
+    rng = np.random.default_rng(seed)
+    means = rng.normal(0, 4, (centers, dim))
+    return (means[rng.integers(centers, size=n)] + rng.normal(0, 1, (n, dim))).astype(np.float32)
+
+
+def brute_force(X, Q, k):
+    d = ((Q[:, None, :] - X[None, :, :]) ** 2).sum(-1)
+    ids = np.argsort(d, axis=1)[:, :k]
+    return np.sqrt(np.take_along_axis(d, ids, axis=1)), ids
+
+
+def recall(found, truth):
+    return np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found, truth)])
+
+
+def test_recall_against_brute_force():
+    X, Q = clustered(4000), clustered(100, seed=1)
+    index = IVFIndex(dim=32, n_lists=32, nprobe=8).add(X)
+    index.merge()
+    _, truth = brute_force(X, Q, 10)
+    _, ids = index.search(Q, 10)
+    assert recall(ids, truth) >= 0.9
+
+
+def test_probing_every_list_is_exact():
+    X, Q = clustered(2000), clustered(50, seed=1)
+    index = IVFIndex(dim=32, n_lists=16, nprobe=16, max_candidates=0).add(X)
+    index.merge()
+    true_dist, truth = brute_force(X, Q, 5)
+    dist, ids = index.search(Q, 5)
+    np.testing.assert_array_equal(ids, truth)
+    np.testing.assert_allclose(dist, true_dist, rtol=1e-3, atol=1e-3)
+
+
+def test_unmerged_vectors_are_searched():
+    X = clustered(2000)
+    index = IVFIndex(dim=32, n_lists=16, nprobe=16, max_candidates=0).add(X)
+    index.merge()
+    extra = clustered(10, seed=2)
+    index.add(extra, ids=np.arange(10000, 10010))
+    _, ids = index.search(extra, 1)
+    assert ids[:, 0].tolist() == list(range(10000, 10010))
+
+
+def test_save_and_memmapped_load(tmp_path):
+    X, Q = clustered(1000), clustered(20, seed=1)
+    index = IVFIndex(dim=32, n_lists=8).add(X)
+    index.save(str(tmp_path))
+    loaded = IVFIndex.load(str(tmp_path))
+    np.testing.assert_array_equal(loaded.search(Q, 5)[1], index.search(Q, 5)[1])
@@ -0,0 +1,80 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from loadtest import Client, Recorder, run_closed_loop, run_open_loop, send, summarize
+
+
+class PredictHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.bodies.append(body)
+        if b'filename="bad.jpg"' in body:
+            status, payload = 500, {"detail": "boom"}
+        else:
+            status, payload = 200, {"is_fake": False, "confidence": 0.9, "model_details": {
+                "kmeans": {"is_fake": False, "confidence": 0.9},
+                "autoencoder": {"is_fake": True, "confidence": 0.6}}}
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), PredictHandler)
+    httpd.bodies = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def url(server):
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def test_closed_loop_stops_at_max_requests_and_summarizes(server):
+    images = [("good.jpg", b"\xff\xd8jpeg"), ("bad.jpg", b"\xff\xd8broken")]
+    recorder, elapsed = run_closed_loop(Client(url(server)), images, concurrency=2,
+                                        duration=30, max_requests=10)
+    report = summarize(recorder, elapsed)
+
+    assert report["requests"] == 10 and len(server.bodies) == 10
+    assert report["status_counts"] == {"200": 5, "500": 5}
+    assert report["error_rate"] == 0.5
+    assert set(report["latency_ms"]) >= {"p50", "p99", "mean", "max"}
+    assert list(report["latency_ms_by_models"]) == ["autoencoder+kmeans"]
+    assert report["model_details"]["autoencoder"] == {"responses": 5, "fake_rate": 1.0, "mean_confidence": 0.6}
+    assert report["model_details"]["kmeans"]["fake_rate"] == 0.0
+
+
+def test_open_loop_sends_at_the_scheduled_rate(server):
+    recorder, elapsed, dropped = run_open_loop(Client(url(server)), [("good.jpg", b"x")], rate=50,
+                                               duration=10, max_requests=20, poisson=False)
+    assert dropped == 0
+    assert len(recorder.samples) == 20
+    starts = sorted(sample[0] for sample in recorder.samples)
+    # Uniform arrivals every 20 ms, measured from the schedule rather than the send
+    assert starts[-1] == pytest.approx(19 / 50, abs=1e-6)
+
+
+def test_unreachable_server_counts_as_errors():
+    recorder = Recorder()
+    client = Client("http://127.0.0.1:9", timeout=1)
+    send(client, recorder, ("a.jpg", b"x"), 0.0, 0.0)
+    report = summarize(recorder, 1.0, dropped=1)
+    assert report["requests"] == 1 and report["dropped"] == 1
+    assert report["error_rate"] == 1.0
+    assert report["latency_ms"] == {}
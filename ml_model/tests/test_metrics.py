@@ -0,0 +1,76 @@
+import pytest
+
+import metrics
+
+
+def test_counter_and_gauge_exposition():
+    registry = metrics.Registry()
+    requests = metrics.Counter("app_requests_total", "Requests", ("path", "status"), registry=registry)
+    ready = metrics.Gauge("app_ready", "Ready flag", registry=registry)
+    requests.inc(path="/predict", status=200)
+    requests.inc(2, path="/predict", status=200)
+    requests.inc(path='/a"b\\c', status=500)
+    ready.set(1)
+
+    assert registry.render().splitlines() == [
+        "# HELP app_requests_total Requests",
+        "# TYPE app_requests_total counter",
+        'app_requests_total{path="/a\\"b\\\\c",status="500"} 1',
+        'app_requests_total{path="/predict",status="200"} 3',
+        "# HELP app_ready Ready flag",
+        "# TYPE app_ready gauge",
+        "app_ready 1",
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = metrics.Registry()
+    latency = metrics.Histogram("app_seconds", "Latency", ("stage",), buckets=(0.1, 1.0), registry=registry)
+    for value in (0.05, 0.1, 0.5, 3.0):
+        latency.observe(value, stage="embed")
+
+    assert registry.render().splitlines()[2:] == [
+        'app_seconds_bucket{stage="embed",le="0.1"} 2',
+        'app_seconds_bucket{stage="embed",le="1.0"} 3',
+        'app_seconds_bucket{stage="embed",le="+Inf"} 4',
+        'app_seconds_sum{stage="embed"} 3.65',
+        'app_seconds_count{stage="embed"} 4',
+    ]
+
+
+def test_histogram_timer_observes_on_error():
+    registry = metrics.Registry()
+    latency = metrics.Histogram("app_seconds", "Latency", registry=registry)
+    with pytest.raises(ValueError):
+        with latency.time():
+            raise ValueError
+    assert "app_seconds_count 1" in registry.render()
+
+
+def test_collectors_run_before_render():
+    registry = metrics.Registry()
+    entries = metrics.Gauge("app_entries", "Entries", registry=registry)
+    size = [0]
+    registry.add_collector(lambda: entries.set(size[0]))
+    size[0] = 7
+    assert "app_entries 7" in registry.render()
+
+
+def test_wrong_labels_are_rejected():
+    registry = metrics.Registry()
+    counter = metrics.Counter("app_total", "Total", ("stage",), registry=registry)
+    with pytest.raises(ValueError):
+        counter.inc(step="x")
+
+
+def test_api_exposes_stage_and_request_metrics(client, png):
+    response = client.post("/predict/batch", files=[("files", ("a.png", png("white"), "image/png")),
+                                                    ("files", ("b.png", png("black"), "image/png"))])
+    assert response.status_code == 200
+
+    text = client.get("/metrics").text
+    for stage in ("preprocess", "queue_wait", "extractor", "detector_kmeans", "ensemble"):
+        assert f'fmd_stage_duration_seconds_count{{stage="{stage}"}}' in text
+    assert 'fmd_requests_total{endpoint="/predict/batch",method="POST",status="200"}' in text
+    assert "fmd_batch_size_bucket" in text
+    assert "fmd_images_scored_total" in text
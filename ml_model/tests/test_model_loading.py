@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+import api
+from bundle import save_bundle
+
+
+@pytest.fixture
+def serve_bundle(monkeypatch, tmp_path):
+    for name in ("kmeans_detector", "autoencoder_detector", "knn_detector", "bundle_info"):
+        monkeypatch.setattr(api, name, None)
+
+    def serve(detectors):
+        path = str(tmp_path / "model_bundle.fmd")
+        save_bundle(path, detectors)
+        monkeypatch.setattr(api, "MODEL_BUNDLE", path)
+        api.load_models()
+        return path
+    return serve
+
+
+def test_every_bundled_detector_is_served(serve_bundle, detectors, embeddings):
+    _, X_val, _ = embeddings
+    serve_bundle(detectors)
+    assert set(api.loaded_detectors()) == {"kmeans", "autoencoder", "knn"}
+
+    responses = api.ensemble_predictions(api.get_model_predictions(X_val[:5]))
+    assert all(set(response["model_details"]) == {"kmeans", "autoencoder", "knn"} for response in responses)
+    knn_labels = detectors["knn"].predict(X_val[:5])
+    assert [r["model_details"]["knn"]["is_fake"] for r in responses] == knn_labels.tolist()
+
+
+def test_unknown_bundled_detector_fails_loudly(serve_bundle, detectors):
+    with pytest.raises(ValueError, match="cannot serve"):
+        serve_bundle({"kmeans": detectors["kmeans"], "kmeans_v2": detectors["kmeans"]})
+
+
+def test_missing_configured_bundle_fails(monkeypatch, tmp_path):
+    monkeypatch.setattr(api, "MODEL_BUNDLE", str(tmp_path / "missing.fmd"))
+    with pytest.raises(FileNotFoundError):
+        api.load_models()
@@ -0,0 +1,65 @@
+import io
+import json
+import zipfile
+
+import api
+
+
+def ndjson(response):
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_one_line_per_file_in_input_order(client, png):
+    files = [("files", (f"{i}.png", png(color), "image/png"))
+             for i, color in enumerate(["white", "black", "white"])]
+    lines = ndjson(client.post("/predict/batch", files=files))
+
+    assert [line["index"] for line in lines] == [0, 1, 2]
+    assert [line["filename"] for line in lines] == ["0.png", "1.png", "2.png"]
+    assert lines[0]["model_details"]["kmeans"]["is_fake"] is True
+    assert lines[1]["model_details"]["kmeans"]["is_fake"] is False
+
+
+def test_zip_archive_is_expanded_and_skips_non_images(client, png):
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("a.png", png("white"))
+        zf.writestr("notes.txt", "not an image")
+        zf.writestr("nested/b.jpg", png("black"))
+    files = [("files", ("images.zip", archive.getvalue(), "application/zip")),
+             ("files", ("c.png", png("white"), "image/png"))]
+    lines = ndjson(client.post("/predict/batch", files=files))
+
+    assert [line["filename"] for line in lines] == ["a.png", "nested/b.jpg", "c.png"]
+    assert all("error" not in line for line in lines)
+
+
+def test_unreadable_file_reports_error_without_failing_the_batch(client, png):
+    files = [("files", ("good.png", png("white"), "image/png")),
+             ("files", ("broken.png", b"not an image", "image/png"))]
+    lines = ndjson(client.post("/predict/batch", files=files))
+
+    assert "error" not in lines[0]
+    assert lines[1]["filename"] == "broken.png" and lines[1]["error"]
+
+
+def test_chunks_go_through_the_batched_forward(client, png, monkeypatch):
+    monkeypatch.setattr(api, "BATCH_CHUNK_SIZE", 4)
+    files = [("files", (f"{i}.png", png("white"), "image/png")) for i in range(10)]
+    lines = ndjson(client.post("/predict/batch", files=files))
+
+    assert len(lines) == 10
+    assert sum(client.batches) == 10
+    assert max(client.batches) > 1
+
+
+def test_rejects_bad_zip_and_empty_upload(client):
+    bad = client.post("/predict/batch", files=[("files", ("x.zip", b"garbage", "application/zip"))])
+    assert bad.status_code == 400
+
+    empty = io.BytesIO()
+    zipfile.ZipFile(empty, "w").close()
+    response = client.post("/predict/batch", files=[("files", ("x.zip", empty.getvalue(), "application/zip"))])
+    assert response.status_code == 400
@@ -0,0 +1,81 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+import api
+from preprocessing import decode_image, find_medicine_box, preprocess_fast, preprocess_image
+from resnet_extractor import embed
+
+
+def package_photo(rng, size, box):
+    """A labelled package on a noisy background, encoded as JPEG"""
+    width, height = size
+    background = rng.integers(120, 230, 3)
+    pixels = np.clip(background + rng.normal(0, 12, (height, width, 3)), 0, 255).astype(np.uint8)
+    image = Image.fromarray(pixels)
+    draw = ImageDraw.Draw(image)
+    x0, y0, x1, y1 = box
+    draw.rectangle(box, fill=tuple(int(c) for c in rng.integers(200, 256, 3)), outline=(40, 40, 40), width=3)
+    draw.rectangle([x0, y0, x1, y0 + (y1 - y0) // 5], fill=tuple(int(c) for c in rng.integers(0, 200, 3)))
+    for i in range(4):
+        ty = y0 + (y1 - y0) // 4 + i * (y1 - y0) // 12
+        draw.rectangle([x0 + (x1 - x0) // 10, ty, x1 - (x1 - x0) // 3, ty + (y1 - y0) // 40], fill=(30, 30, 30))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def legacy(contents):
+    return preprocess_image(Image.open(io.BytesIO(contents)).convert("RGB"))
+
+
+def cosine(a, b):
+    return np.sum(a * b, axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+
+
+@pytest.mark.parametrize("size", [(560, 300), (2400, 1800)])
+def test_fast_path_embeddings_match_preprocess_image(size):
+    rng = np.random.default_rng(0)
+    width, height = size
+    blobs = []
+    for _ in range(6):
+        box = (int(width * rng.uniform(0.1, 0.25)), int(height * rng.uniform(0.1, 0.25)),
+               int(width * rng.uniform(0.75, 0.9)), int(height * rng.uniform(0.75, 0.9)))
+        blobs.append(package_photo(rng, size, box))
+
+    fast = [preprocess_fast(blob) for blob in blobs]
+    assert all(image.size == (224, 224) and image.mode == "RGB" for image in fast)
+    assert cosine(embed(fast), embed([legacy(blob) for blob in blobs])).min() > 0.98
+
+
+def test_large_jpeg_is_decoded_at_reduced_scale():
+    blob = package_photo(np.random.default_rng(1), (4000, 3000), (800, 600, 3200, 2400))
+    pixels, scale = decode_image(blob)
+    assert min(pixels.shape[:2]) >= 512
+    assert pixels.shape[1] < 4000
+    assert scale == pytest.approx(pixels.shape[1] / 4000)
+
+
+def test_box_found_on_proxy_maps_back_to_full_resolution():
+    # Striped background so the flat package interior is the largest contour
+    pixels = np.full((1200, 1600, 3), 200, dtype=np.uint8)
+    for y in range(0, 1200, 32):
+        pixels[y:y + 16] = 90
+    image = Image.fromarray(pixels)
+    ImageDraw.Draw(image).rectangle((400, 300, 1200, 900), fill=(240, 240, 240), outline=(20, 20, 20), width=12)
+    pixels = np.asarray(image)
+
+    x, y, w, h = find_medicine_box(pixels, proxy_size=256)
+    # The package interior, to within a proxy pixel (about 6 px here)
+    np.testing.assert_allclose((x, y, x + w, y + h), (412, 312, 1188, 888), atol=8)
+    np.testing.assert_allclose(find_medicine_box(pixels, proxy_size=800), (x, y, w, h), atol=8)
+
+
+def test_load_image_uses_fast_path_only_when_enabled(monkeypatch):
+    blob = package_photo(np.random.default_rng(3), (560, 300), (80, 50, 480, 250))
+    monkeypatch.setattr(api, "FAST_PREPROCESS", False)
+    assert np.array_equal(np.asarray(api.load_image(blob)), np.asarray(legacy(blob)))
+    monkeypatch.setattr(api, "FAST_PREPROCESS", True)
+    assert np.array_equal(np.asarray(api.load_image(blob)), np.asarray(preprocess_fast(blob)))
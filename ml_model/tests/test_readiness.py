@@ -0,0 +1,81 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import api
+
+
+@pytest.fixture
+def unloaded(monkeypatch):
+    """Fresh loading state with load_and_warm_up replaced by a controllable stub"""
+    monkeypatch.setattr(api, "models_ready", False)
+    monkeypatch.setattr(api, "models_loading", None)
+    release = threading.Event()
+    calls = []
+
+    def load_and_warm_up():
+        calls.append(threading.get_ident())
+        if not release.wait(timeout=10):
+            raise RuntimeError("load never released")
+        api.models_ready = True
+
+    monkeypatch.setattr(api, "load_and_warm_up", load_and_warm_up)
+    return release, calls
+
+
+def test_ready_turns_200_once_loading_finishes(unloaded):
+    release, calls = unloaded
+    with TestClient(api.app) as client:
+        response = client.get("/ready")
+        assert response.status_code == 503
+        assert response.json()["status"] == "loading"
+        assert client.get("/health").status_code == 200
+
+        release.set()
+        for _ in range(100):
+            response = client.get("/ready")
+            if response.status_code == 200:
+                break
+            time.sleep(0.02)
+        assert response.status_code == 200
+        assert response.json()["status"] == "ready"
+    assert len(calls) == 1
+
+
+def test_failed_load_is_reported(monkeypatch):
+    monkeypatch.setattr(api, "models_ready", False)
+    monkeypatch.setattr(api, "models_loading", None)
+
+    def load_and_warm_up():
+        raise RuntimeError("missing weights")
+
+    monkeypatch.setattr(api, "load_and_warm_up", load_and_warm_up)
+    with TestClient(api.app) as client:
+        for _ in range(100):
+            if api.models_loading.done():
+                break
+            time.sleep(0.02)
+        response = client.get("/ready")
+        assert response.status_code == 503
+        assert response.json() == {"status": "failed", "error": "missing weights",
+                                   "startup_seconds": api.startup_timings}
+
+
+def test_concurrent_callers_share_one_load_off_the_event_loop(unloaded):
+    release, calls = unloaded
+
+    async def main():
+        waiters = [asyncio.ensure_future(api.ensure_models_loaded()) for _ in range(5)]
+        # The loop keeps running while the load is blocked on a worker thread
+        await asyncio.sleep(0.05)
+        assert not any(waiter.done() for waiter in waiters)
+        release.set()
+        await asyncio.gather(*waiters)
+
+    asyncio.run(main())
+    assert len(calls) == 1
+    assert calls[0] != threading.get_ident()
+    assert api.models_ready
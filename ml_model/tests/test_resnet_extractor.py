@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+import resnet_extractor
+from resnet_extractor import embed, extract_embeddings, to_tensor
+
+
+def images(n=3, size=48):
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, 256, (size, size, 3), dtype=np.uint8) for _ in range(n)]
+
+
+def test_single_image_types_agree():
+    array = images(1)[0]
+    from_array = embed(array)
+    assert from_array.shape == (512,)
+    np.testing.assert_allclose(embed(Image.fromarray(array)), from_array, atol=1e-4)
+    np.testing.assert_allclose(embed(torch.from_numpy(array).permute(2, 0, 1)), from_array, atol=1e-4)
+    np.testing.assert_allclose(embed(to_tensor(array)), from_array, atol=1e-4)
+
+
+def test_batch_matches_single_images():
+    batch = images()
+    from_list = embed(batch)
+    assert from_list.shape == (3, 512)
+    np.testing.assert_allclose(embed(np.stack(batch)), from_list, atol=1e-4)
+    np.testing.assert_allclose(embed(torch.stack([to_tensor(a) for a in batch])), from_list, atol=1e-4)
+    np.testing.assert_allclose(from_list[1], embed(batch[1]), atol=1e-4)
+
+
+def test_folder_extraction_matches_in_memory(tmp_path):
+    batch = images()
+    for i, array in enumerate(batch):
+        Image.fromarray(array).save(tmp_path / f"{i}.png")
+    (tmp_path / "notes.txt").write_text("skip me")
+
+    embeddings, filenames = extract_embeddings(str(tmp_path))
+    assert filenames == ["0.png", "1.png", "2.png"]
+    np.testing.assert_allclose(embeddings, embed(batch), atol=1e-4)
+
+
+def test_unsupported_type_raises():
+    with pytest.raises(TypeError):
+        to_tensor("image.jpg")
+
+
+def test_batched_workers_stream_and_memmap_output(tmp_path):
+    from resnet_extractor import iter_embeddings
+
+    folder = tmp_path / "images"
+    folder.mkdir()
+    batch = images(5)
+    for i, array in enumerate(batch):
+        Image.fromarray(array).save(folder / f"{i}.png")
+    (folder / "2.png").write_bytes(b"corrupt")
+    expected = embed([a for i, a in enumerate(batch) if i != 2])
+
+    chunks = list(iter_embeddings(str(folder), batch_size=2, num_workers=2))
+    assert [len(names) for names, _ in chunks] == [2, 1, 1]
+    assert sum((names for names, _ in chunks), []) == ["0.png", "1.png", "3.png", "4.png"]
+    np.testing.assert_allclose(np.vstack([emb for _, emb in chunks]), expected, atol=1e-4)
+
+    out = tmp_path / "embeddings.npy"
+    embeddings, filenames = extract_embeddings(str(folder), batch_size=2, num_workers=0, out=str(out))
+    assert filenames == ["0.png", "1.png", "3.png", "4.png"]
+    np.testing.assert_allclose(np.load(out), expected, atol=1e-4)
+    np.testing.assert_allclose(embeddings, expected, atol=1e-4)
@@ -0,0 +1,141 @@
+import result_cache
+from result_cache import ResultCache
+
+
+def cache(tmp_path, **options):
+    c = ResultCache(str(tmp_path / "cache.sqlite"), **options)
+    c.set_model_version("v1")
+    return c
+
+
+def test_round_trip(tmp_path):
+    c = cache(tmp_path)
+    c.put("abc", {"is_fake": False, "confidence": 0.9})
+    assert c.get("abc") == {"is_fake": False, "confidence": 0.9}
+    assert c.get("missing") is None
+
+
+def test_entries_expire_after_ttl(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(result_cache.time, "time", lambda: now[0])
+    c = cache(tmp_path, ttl=60)
+    c.put("abc", {"n": 1})
+    now[0] += 59
+    assert c.get("abc") == {"n": 1}
+    now[0] += 2
+    assert c.get("abc") is None
+    assert len(c) == 0
+
+
+def test_least_recently_used_are_evicted(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(result_cache.time, "time", lambda: now[0])
+    c = cache(tmp_path, max_entries=3, evict_every=1)
+    for key in ("a", "b", "c"):
+        now[0] += 1
+        c.put(key, key)
+    now[0] += 1
+    c.get("a")
+    now[0] += 1
+    c.put("d", "d")
+    assert len(c) == 3
+    assert [c.get(key) for key in "abcd"] == ["a", None, "c", "d"]
+
+
+def test_versions_are_isolated_in_a_shared_file(tmp_path):
+    old, new = cache(tmp_path), cache(tmp_path)
+    new.set_model_version("v2")
+    old.put("abc", "old")
+    new.put("abc", "new")
+    assert old.get("abc") == "old" and new.get("abc") == "new"
+
+    # A restart on another version leaves the first server's entries alone
+    restarted = cache(tmp_path)
+    restarted.set_model_version("v3")
+    assert old.get("abc") == "old"
+
+
+def test_nothing_is_served_before_a_version_is_set(tmp_path):
+    c = ResultCache(str(tmp_path / "cache.sqlite"))
+    c.put("abc", 1)
+    assert c.get("abc") is None and len(c) == 0
+
+
+def _claim_in_child(path, key, barrier, results):
+    c = ResultCache(path)
+    c.set_model_version("v1")
+    barrier.wait()
+    results.put(c.claim(key))
+
+
+def test_only_one_process_wins_a_claim(tmp_path):
+    import multiprocessing
+
+    path = str(tmp_path / "cache.sqlite")
+    ResultCache(path)
+    context = multiprocessing.get_context("fork")
+    barrier, results = context.Barrier(4), context.Queue()
+    children = [context.Process(target=_claim_in_child, args=(path, "abc", barrier, results)) for _ in range(4)]
+    for child in children:
+        child.start()
+    wins = [results.get(timeout=10) for _ in children]
+    for child in children:
+        child.join()
+    assert sorted(wins) == [False, False, False, True]
+
+
+def test_put_and_release_end_a_claim(tmp_path):
+    owner, waiter = cache(tmp_path), cache(tmp_path)
+    assert owner.claim("abc")
+    assert not waiter.claim("abc") and waiter.is_claimed("abc")
+    owner.put("abc", {"n": 1})
+    assert not waiter.is_claimed("abc") and waiter.get("abc") == {"n": 1}
+
+    assert owner.claim("def")
+    owner.release("def")
+    assert waiter.claim("def")
+
+
+def test_abandoned_claims_are_taken_over(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(result_cache.time, "time", lambda: now[0])
+    crashed, waiter = cache(tmp_path, claim_timeout=5), cache(tmp_path, claim_timeout=5)
+    assert crashed.claim("abc")
+    now[0] += 4
+    assert waiter.is_claimed("abc") and not waiter.claim("abc")
+    now[0] += 2
+    assert not waiter.is_claimed("abc")
+    assert waiter.claim("abc")
+
+
+def test_predict_waits_for_a_result_claimed_by_another_process(client, png, tmp_path, monkeypatch):
+    import hashlib
+    import threading
+    import time
+
+    import api
+
+    path = str(tmp_path / "cache.sqlite")
+    monkeypatch.setattr(api, "result_cache", cache(tmp_path))
+    other = ResultCache(path)
+    other.set_model_version("v1")
+
+    stored, released = png((10, 10, 10)), png((250, 250, 250))
+    assert other.claim(hashlib.sha256(stored).hexdigest())
+    assert other.claim(hashlib.sha256(released).hexdigest())
+    threading.Timer(0.2, other.put, (hashlib.sha256(stored).hexdigest(), {"from": "other"})).start()
+    threading.Timer(0.2, other.release, (hashlib.sha256(released).hexdigest(),)).start()
+
+    # Let the warm-up batch go through first
+    while client.get("/ready").status_code != 200:
+        time.sleep(0.01)
+    client.batches.clear()
+    response = client.post("/predict", files={"file": ("a.png", stored, "image/png")})
+    assert response.json() == {"from": "other"}
+    assert client.batches == []
+
+    # The owner gave up without a result, so this process scores the image itself
+    response = client.post("/predict", files={"file": ("b.png", released, "image/png")})
+    assert response.status_code == 200 and "is_fake" in response.json()
+    assert client.batches == [1]
+    assert api.result_cache.get(hashlib.sha256(released).hexdigest()) == response.json()
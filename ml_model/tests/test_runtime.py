@@ -0,0 +1,66 @@
+import io
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import runtime
+from preprocessing import decode_and_preprocess
+
+
+@pytest.fixture
+def cores(monkeypatch):
+    for name in ("WEB_CONCURRENCY", "INFERENCE_WORKERS", "PREPROCESS_WORKERS", "TORCH_THREADS",
+                 "TORCH_INTEROP_THREADS", "OPENCV_THREADS"):
+        monkeypatch.delenv(name, raising=False)
+
+    def set_cores(n):
+        monkeypatch.setattr(runtime, "available_cores", lambda: n)
+    return set_cores
+
+
+def test_cores_are_split_between_processes_and_inference_workers(cores, monkeypatch):
+    cores(16)
+    plan = runtime.thread_plan(processes=2, inference_workers=2)
+    assert plan["preprocess_workers"] == 8
+    assert plan["torch_threads"] == 4
+    assert plan["torch_interop_threads"] == 1 and plan["opencv_threads"] == 1
+
+    monkeypatch.setenv("WEB_CONCURRENCY", "4")
+    monkeypatch.setenv("INFERENCE_WORKERS", "1")
+    plan = runtime.thread_plan()
+    assert (plan["processes"], plan["torch_threads"]) == (4, 4)
+
+
+def test_plan_never_drops_below_one_thread_and_honours_overrides(cores, monkeypatch):
+    cores(2)
+    plan = runtime.thread_plan(processes=4, inference_workers=3)
+    assert plan["torch_threads"] == 1 and plan["preprocess_workers"] == 1
+
+    monkeypatch.setenv("TORCH_THREADS", "6")
+    monkeypatch.setenv("PREPROCESS_WORKERS", "3")
+    plan = runtime.thread_plan(processes=4, inference_workers=3)
+    assert plan["torch_threads"] == 6 and plan["preprocess_workers"] == 3
+
+
+def test_available_cores_respects_affinity():
+    cores = runtime.available_cores()
+    assert 1 <= cores <= len(__import__("os").sched_getaffinity(0))
+
+
+def test_process_pool_preprocessing_matches_in_thread():
+    buffer = io.BytesIO()
+    rng = np.random.default_rng(0)
+    Image.fromarray(rng.integers(0, 256, (300, 400, 3), dtype=np.uint8)).save(buffer, format="PNG")
+    contents = buffer.getvalue()
+
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["preprocessing"])
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        for fast in (False, True):
+            remote = pool.submit(decode_and_preprocess, contents, fast).result(timeout=60)
+            local = decode_and_preprocess(contents, fast)
+            assert remote.size == local.size
+            np.testing.assert_array_equal(np.asarray(remote), np.asarray(local))
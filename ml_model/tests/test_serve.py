@@ -0,0 +1,93 @@
+import os
+import socket
+import time
+
+import serve
+
+
+class SleepingSupervisor(serve.Supervisor):
+    """Workers that sleep instead of running uvicorn; heartbeat only if asked to"""
+
+    def __init__(self, *args, beat=True, exit_after=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.beat = beat
+        self.exit_after = exit_after
+
+    def _run_worker(self, slot):
+        start = time.time()
+        while self.exit_after is None or time.time() - start < self.exit_after:
+            if self.beat:
+                self.status[slot, 0] = time.time()
+                self.status[slot, 1] = self.status[slot, 1] or time.time()
+            time.sleep(0.05)
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_process_memory_reads_smaps_rollup():
+    memory = serve.process_memory(os.getpid())
+    assert memory["rss_mb"] > 0 and memory["pss_mb"] > 0
+    assert serve.process_memory(2 ** 22 + 12345) is None
+
+
+def test_bind_socket_is_inheritable_and_listening():
+    sock = serve.bind_socket("127.0.0.1", 0)
+    try:
+        assert sock.get_inheritable()
+        client = socket.create_connection(sock.getsockname(), timeout=2)
+        client.close()
+    finally:
+        sock.close()
+
+
+def test_exited_worker_is_reaped_and_its_slot_reported():
+    supervisor = SleepingSupervisor(None, None, workers=2, exit_after=0.1)
+    try:
+        for slot in range(2):
+            supervisor.spawn(slot)
+        slots = []
+        assert wait_for(lambda: slots.extend(supervisor.reap()) or len(slots) == 2)
+        assert sorted(slots) == [0, 1] and not supervisor.pids
+    finally:
+        supervisor.shutdown(timeout=1)
+
+
+def test_worker_without_heartbeats_is_killed():
+    supervisor = SleepingSupervisor(None, None, workers=2, heartbeat_timeout=0.3)
+    supervisor.beat = False
+    silent = supervisor.spawn(0)
+    supervisor.beat = True
+    healthy = supervisor.spawn(1)
+    try:
+        assert wait_for(lambda: supervisor.status[1, 1] > 0)
+        time.sleep(0.4)
+        supervisor.check_heartbeats()
+        assert wait_for(lambda: supervisor.reap() == [0])
+        assert silent not in supervisor.pids and healthy in supervisor.pids
+        assert "pss_mb" in supervisor.memory_report()["workers"][1]
+    finally:
+        supervisor.shutdown(timeout=1)
+    assert not supervisor.pids
+
+
+def test_workers_keep_what_the_parent_loaded(monkeypatch):
+    import api
+    import resnet_extractor
+
+    calls = []
+    monkeypatch.setattr(api, "models_ready", False)
+    monkeypatch.setattr(resnet_extractor, "is_loaded", lambda: True)
+    monkeypatch.setattr(resnet_extractor, "load_model", lambda: calls.append("extractor"))
+    monkeypatch.setattr(api, "EXTRACTOR_BACKEND", resnet_extractor.backend)
+    monkeypatch.setattr(api, "loaded_detectors", lambda: ["kmeans"])
+    monkeypatch.setattr(api, "load_models", lambda: calls.append("detectors"))
+    monkeypatch.setattr(api, "warm_up", lambda: calls.append("warmup"))
+    api.load_and_warm_up()
+    assert calls == ["warmup"] and api.models_ready
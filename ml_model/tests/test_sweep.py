@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+import sweep
+from anomaly_detector import AnomalyDetector
+from bundle import load_bundle
+
+
+@pytest.fixture
+def dataset(embeddings):
+    X, X_val, y_val = embeddings
+    X_all = np.vstack([X, X_val]).astype(np.float32)
+    y = np.concatenate([np.zeros(len(X), dtype=np.int8), y_val.astype(np.int8)])
+    return X_all, y
+
+
+def test_split_is_stratified_and_disjoint(dataset):
+    _, y = dataset
+    train, val, test = sweep.split_indices(y)
+    assert len(set(train) | set(val) | set(test)) == len(y)
+    assert not set(train) & set(val) and not set(val) & set(test)
+    for part in (train, val, test):
+        assert y[part].mean() == pytest.approx(y.mean(), abs=0.02)
+
+
+def test_threshold_strategies():
+    scores = np.arange(100, dtype=np.float64)
+    detector = AnomalyDetector(method='kmeans')
+    assert sweep.threshold_for('p95', detector, scores, None, None) == pytest.approx(np.percentile(scores, 95))
+    assert sweep.threshold_for('std2', detector, scores, None, None) == pytest.approx(scores.mean() + 2 * scores.std())
+    labels = (scores > 60).astype(int)
+    assert sweep.threshold_for('f1', detector, None, scores, labels) == pytest.approx(61)
+    with pytest.raises(ValueError):
+        sweep.threshold_for('median', detector, scores, scores, labels)
+
+
+def test_sweep_ranks_rows_and_bundles_the_best(dataset, tmp_path):
+    X, y = dataset
+    configs = sweep.build_grid(['kmeans', 'knn'], n_clusters=[2, 3], hidden_dims=[], n_neighbors=[5],
+                               thresholds=['f1', 'p95'], epochs=1)
+    rows, detectors = sweep.run_sweep(X, y, configs, workers=2)
+
+    assert len(rows) == 3 * 2
+    assert [row["f1"] for row in rows] == sorted((row["f1"] for row in rows), reverse=True)
+    assert {row["method"] for row in rows} == {'kmeans', 'knn'}
+    assert rows[0]["f1"] > 0.8
+    for rank, row in enumerate(rows):
+        detector, threshold = detectors[rank]
+        assert detector.method == row["method"] and threshold == row["threshold"]
+
+    path = str(tmp_path / "swept.fmd")
+    sweep.write_bundle(path, rows, detectors, methods=('kmeans',))
+    header, loaded = load_bundle(path)
+    best = next(row for row in rows if row["method"] == 'kmeans')
+    assert set(loaded) == {'kmeans'}
+    assert loaded['kmeans'].threshold == pytest.approx(best["threshold"])
+    assert header["metadata"]["sweep"]["kmeans"]["params"] == best["params"]
@@ -0,0 +1,116 @@
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+import webscape
+
+IMAGES_PER_PAGE = 4
+
+
+def png(seed):
+    buffer = BytesIO()
+    Image.new("RGB", (32, 32), (seed * 40 % 256, 80, 160)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+class SearchSite(BaseHTTPRequestHandler):
+    """Search pages listing product images, served over keep-alive connections"""
+    protocol_version = "HTTP/1.1"
+    images = {f"/img/product_{i}.png": png(i) for i in range(IMAGES_PER_PAGE)}
+
+    def do_GET(self):
+        host = self.headers["Host"]
+        self.server.requests[host].append((time.monotonic(), self.path))
+        self.server.connections[host].add(self.client_address)
+        if self.path.startswith("/search"):
+            body = "".join(f'<img src="{path}">' for path in self.images).encode()
+            content_type = "text/html"
+        elif self.path in self.images:
+            body, content_type = self.images[self.path], "image/png"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def site():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SearchSite)
+    server.daemon_threads = True
+    server.requests = defaultdict(list)
+    server.connections = defaultdict(set)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def templates(server):
+    # Two host names for the same server, so each gets its own session and rate limit
+    port = server.server_address[1]
+    return [f"http://127.0.0.1:{port}/search?q={{}}", f"http://localhost:{port}/search?q={{}}"]
+
+
+def test_requests_to_a_host_respect_the_interval(site, tmp_path):
+    interval = 0.1
+    collector = webscape.Collector(str(tmp_path), max_workers=4, host_interval=interval, images_per_keyword=2)
+    collector.collect(["dolo", "aspirin"], templates(site))
+
+    assert len(site.requests) == 2
+    for requests in site.requests.values():
+        times = sorted(t for t, _ in requests)
+        gaps = [b - a for a, b in zip(times, times[1:])]
+        assert min(gaps) >= interval * 0.9
+
+
+def test_each_host_reuses_pooled_connections(site, tmp_path):
+    collector = webscape.Collector(str(tmp_path), max_workers=2, host_interval=0.0, images_per_keyword=3)
+    collector.collect(["dolo", "aspirin", "metformin"], templates(site)[:1])
+
+    (host, requests), = site.requests.items()
+    assert len(requests) > collector.max_workers
+    assert len(site.connections[host]) <= collector.max_workers
+
+
+def test_rerun_resumes_from_the_manifest(site, tmp_path):
+    first = webscape.Collector(str(tmp_path), max_workers=2, host_interval=0.0, images_per_keyword=2)
+    stats = first.collect(["dolo"], templates(site)[:1])
+    assert stats["saved"] == 2
+    served = sum(len(r) for r in site.requests.values())
+
+    second = webscape.Collector(str(tmp_path), max_workers=2, host_interval=0.0, images_per_keyword=2)
+    assert second.collect(["dolo"], templates(site)[:1])["saved"] == 0
+    assert sum(len(r) for r in site.requests.values()) == served
+
+    # Raising the limit only fetches the images not saved yet
+    third = webscape.Collector(str(tmp_path), max_workers=2, host_interval=0.0, images_per_keyword=3)
+    stats = third.collect(["dolo"], templates(site)[:1])
+    assert stats["saved"] == 1 and stats["skipped"] == 2
+
+
+def test_failed_save_is_not_recorded(site, tmp_path, monkeypatch):
+    def broken_save(content, path):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(webscape, "save_image", broken_save)
+    collector = webscape.Collector(str(tmp_path), max_workers=1, host_interval=0.0, images_per_keyword=1)
+    stats = collector.collect(["dolo"], templates(site)[:1])
+    assert stats["saved"] == 0 and stats["failed"] == IMAGES_PER_PAGE
+    assert collector.manifest.hashes == set()
+
+    monkeypatch.undo()
+    retry = webscape.Collector(str(tmp_path), max_workers=1, host_interval=0.0, images_per_keyword=1)
+    assert retry.collect(["dolo"], templates(site)[:1])["saved"] == 1
@@ -1,21 +1,35 @@
+"""
+Collects real medicine images from pharmacy search pages and derives fake
+ones from them.
+
+Search pages are fetched concurrently (bounded by --workers) with one pooled
+session and a minimum request interval per host, instead of global sleeps.
+Images are stored under a name derived from their content hash and recorded
+in a JSON-lines manifest next to them, so re-running resumes where the last
+run stopped and never saves the same image twice:
+
+    python webscape.py --workers 8 --host-interval 1.0
+    python webscape.py --source "http://127.0.0.1:8080/search?q={}" --keywords dolo
+"""
+import argparse
+import hashlib
+import json
 import requests
 from bs4 import BeautifulSoup
 import os
+import sys
 from PIL import Image
 from io import BytesIO
+import threading
 import time
 import random
 import logging
-import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlsplit
+from requests.adapters import HTTPAdapter
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Create directories if they don't exist
-os.makedirs("real_medicines", exist_ok=True)
-os.makedirs("fake_medicines", exist_ok=True)
-
 # Medicine keywords for real medicines
 real_medicine_keywords = [
     "paracetamol", "dolo", "azithromycin", "amoxicillin", "cetirizine",
@@ -33,113 +47,286 @@ headers = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
 }
 
-def download_image(url, save_path):
-    """Download and save an image with error handling"""
-    try:
-        response = requests.get(url, headers=headers, timeout=10)
+# Different selectors for different websites
+img_selectors = [
+    "img.product-image-photo",  # Netmeds
+    "img[src*='medicine']",     # 1mg
+    "img[src*='product']",      # Pharmeasy
+    "img[alt*='medicine']",
+    "img[alt*='tablet']",
+    "img[alt*='capsule']"
+]
+
+MANIFEST_NAME = "manifest.jsonl"
+
+
+class HostPool:
+    """One pooled session per host, with a minimum interval between requests to the same host"""
+    
+    def __init__(self, interval=1.0, jitter=0.5, pool_size=4, timeout=10):
+        self.interval = interval
+        self.jitter = jitter
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._sessions = {}
+        self._next_slot = {}
+        self._lock = threading.Lock()
+    
+    def _session(self, host):
+        session = self._sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            session.headers.update(headers)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self._sessions[host] = session
+        return session
+    
+    def get(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            session = self._session(host)
+            # Reserve the next free slot for this host, then wait for it outside the lock
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.interval + random.uniform(0, self.jitter)
+        if slot > now:
+            time.sleep(slot - now)
+        response = session.get(url, timeout=self.timeout)
         response.raise_for_status()
+        return response
+    
+    def close(self):
+        for session in self._sessions.values():
+            session.close()
+
+
+class Manifest:
+    """
+    Append-only JSON-lines record of fetched image URLs and content hashes.
+    
+    A saved image is only recorded once its file is on disk, so an interrupted
+    or failed save is retried on the next run instead of counting as a duplicate.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self.entries = []
+        self.urls = set()
+        self.hashes = set()
+        self._pending = set()
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A run killed mid-write leaves at most one partial line
+                        continue
+                    if entry["status"] == "saved" and not os.path.exists(entry["path"]):
+                        # File deleted since; fetch it again
+                        continue
+                    self._index(entry)
+    
+    def _index(self, entry):
+        self.entries.append(entry)
+        self.urls.add(entry["url"])
+        self.hashes.add(entry["sha256"])
+    
+    def saved_count(self, keyword, source):
+        with self._lock:
+            return sum(1 for e in self.entries
+                       if e["keyword"] == keyword and e["source"] == source and e["status"] == "saved")
+    
+    def _append(self, url, digest, keyword, source, status, path):
+        entry = {"url": url, "sha256": digest, "keyword": keyword, "source": source,
+                 "status": status, "path": path, "fetched_at": time.time()}
+        self._index(entry)
+        with open(self.path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+    
+    def claim(self, url, content, keyword, source, folder):
+        """
+        Decide whether an image is new, reserving its hash until record() or release().
         
-        img = Image.open(BytesIO(response.content))
-        img = img.convert("RGB")
-        
-        # Resize if too large
-        if max(img.size) > 1000:
-            ratio = 1000 / max(img.size)
-            new_size = tuple(int(dim * ratio) for dim in img.size)
-            img = img.resize(new_size, Image.Resampling.LANCZOS)
+        Returns:
+            tuple: (sha256, path to save it to), with path None when the content was
+            already fetched or is being saved by another worker
+        """
+        digest = hashlib.sha256(content).hexdigest()
+        with self._lock:
+            if digest in self.hashes or digest in self._pending:
+                self._append(url, digest, keyword, source, "duplicate", None)
+                return digest, None
+            self._pending.add(digest)
+        return digest, os.path.join(folder, f"{keyword}_{digest[:16]}.jpg")
+    
+    def record(self, url, digest, keyword, source, path):
+        """Record a claimed image once its file has been saved"""
+        with self._lock:
+            self._pending.discard(digest)
+            self._append(url, digest, keyword, source, "saved", path)
+    
+    def release(self, digest):
+        """Give up a claimed image whose save failed"""
+        with self._lock:
+            self._pending.discard(digest)
+
+
+def save_image(content, save_path):
+    """Decode downloaded bytes and save them as an RGB JPEG of at most 1000 px"""
+    img = Image.open(BytesIO(content))
+    img = img.convert("RGB")
+    
+    # Resize if too large
+    if max(img.size) > 1000:
+        ratio = 1000 / max(img.size)
+        new_size = tuple(int(dim * ratio) for dim in img.size)
+        img = img.resize(new_size, Image.Resampling.LANCZOS)
+    
+    # Write to a temporary name first so an interrupted run never leaves a truncated image
+    tmp_path = save_path + ".part"
+    img.save(tmp_path, "JPEG", quality=95)
+    os.replace(tmp_path, save_path)
+
+
+def extract_image_urls(html, page_url):
+    """Absolute image URLs on a search page matched by img_selectors, in page order without repeats"""
+    soup = BeautifulSoup(html, "html.parser")
+    urls = []
+    for selector in img_selectors:
+        for img in soup.select(selector):
+            src = img.get("src") or img.get("data-src")
+            if src:
+                url = urljoin(page_url, src)
+                if url.startswith(("http://", "https://")) and url not in urls:
+                    urls.append(url)
+    return urls
+
+
+class Collector:
+    """Fetches up to images_per_keyword images per (keyword, source) with bounded concurrency"""
+    
+    def __init__(self, folder="real_medicines", manifest_path=None, max_workers=8, host_interval=1.0,
+                 images_per_keyword=5, timeout=10):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+        self.manifest = Manifest(manifest_path or os.path.join(folder, MANIFEST_NAME))
+        self.max_workers = max_workers
+        self.images_per_keyword = images_per_keyword
+        self.hosts = HostPool(interval=host_interval, jitter=host_interval / 2, pool_size=max_workers,
+                              timeout=timeout)
+        self.stats = {"saved": 0, "duplicate": 0, "skipped": 0, "failed": 0}
+        self._stats_lock = threading.Lock()
+    
+    def _count(self, key):
+        with self._stats_lock:
+            self.stats[key] += 1
+    
+    def fetch_images_from_url(self, url_template, keyword):
+        """Fetch images for one keyword from one search page until the per-keyword limit is reached"""
+        count = self.manifest.saved_count(keyword, url_template)
+        if count >= self.images_per_keyword:
+            return count
         
-        img.save(save_path, "JPEG", quality=95)
-        return True
-    except Exception as e:
-        logger.error(f"Error downloading image from {url}: {str(e)}")
-        return False
-
-def fetch_images_from_url(url_template, keyword, folder):
-    """Fetch images from a specific URL template"""
-    try:
         url = url_template.format(keyword)
-        logger.info(f"Fetching from: {url}")
-        
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
-        
-        soup = BeautifulSoup(response.text, "html.parser")
-        
-        # Different selectors for different websites
-        img_selectors = [
-            "img.product-image-photo",  # Netmeds
-            "img[src*='medicine']",     # 1mg
-            "img[src*='product']",      # Pharmeasy
-            "img[alt*='medicine']",
-            "img[alt*='tablet']",
-            "img[alt*='capsule']"
-        ]
-        
-        img_tags = []
-        for selector in img_selectors:
-            img_tags.extend(soup.select(selector))
-        
-        count = 0
-        for img in img_tags:
-            src = img.get("src") or img.get("data-src")
-            if src and "http" in src:
-                filename = f"{folder}/{keyword}_{count}.jpg"
-                if download_image(src, filename):
-                    logger.info(f"Saved: {filename}")
-                    count += 1
-                    time.sleep(random.uniform(1, 2))  # Random delay
-                
-                if count >= 5:  # Limit images per keyword
-                    break
-                    
-    except Exception as e:
-        logger.error(f"Error fetching from {url_template}: {str(e)}")
-
-def generate_fake_medicine_images():
-    """Generate fake medicine images by modifying real ones"""
-    real_images = [f for f in os.listdir("real_medicines") if f.endswith(('.jpg', '.jpeg', '.png'))]
-    
-    for i, real_img in enumerate(real_images[:10]):  # Generate 10 fake images
         try:
-            # Load real image
-            img_path = os.path.join("real_medicines", real_img)
-            img = Image.open(img_path)
-            
-            # Apply random modifications
-            if random.random() < 0.5:
-                # Add noise
-                img_array = np.array(img)
-                noise = np.random.normal(0, 25, img_array.shape).astype(np.uint8)
-                img_array = np.clip(img_array + noise, 0, 255).astype(np.uint8)
-                img = Image.fromarray(img_array)
-            else:
-                # Change colors
-                img = img.convert('HSV')
-                img_array = np.array(img)
-                img_array[:,:,0] = (img_array[:,:,0] + random.randint(-30, 30)) % 180
-                img = Image.fromarray(img_array).convert('RGB')
-            
-            # Save fake image
-            fake_path = os.path.join("fake_medicines", f"fake_{i}.jpg")
-            img.save(fake_path, "JPEG", quality=95)
-            logger.info(f"Generated fake image: {fake_path}")
-            
+            logger.info(f"Fetching from: {url}")
+            image_urls = extract_image_urls(self.hosts.get(url).text, url)
         except Exception as e:
-            logger.error(f"Error generating fake image: {str(e)}")
+            logger.error(f"Error fetching from {url}: {str(e)}")
+            self._count("failed")
+            return count
+        
+        for image_url in image_urls:
+            if count >= self.images_per_keyword:
+                break
+            if image_url in self.manifest.urls:
+                self._count("skipped")
+                continue
+            try:
+                content = self.hosts.get(image_url).content
+                # Reject anything that is not a decodable image before it reaches the manifest
+                Image.open(BytesIO(content)).verify()
+            except Exception as e:
+                logger.error(f"Error downloading image from {image_url}: {str(e)}")
+                self._count("failed")
+                continue
+            
+            digest, path = self.manifest.claim(image_url, content, keyword, url_template, self.folder)
+            if path is None:
+                self._count("duplicate")
+                continue
+            try:
+                save_image(content, path)
+            except Exception as e:
+                self.manifest.release(digest)
+                logger.error(f"Error saving image from {image_url}: {str(e)}")
+                self._count("failed")
+                continue
+            self.manifest.record(image_url, digest, keyword, url_template, path)
+            logger.info(f"Saved: {path}")
+            self._count("saved")
+            count += 1
+        return count
+    
+    def collect(self, keywords, url_templates):
+        jobs = [(template, keyword) for keyword in keywords for template in url_templates]
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                list(pool.map(lambda job: self.fetch_images_from_url(*job), jobs))
+        finally:
+            self.hosts.close()
+        return self.stats
+
+def generate_fake_medicine_images(count=10, folder="fake_medicines", workers=None):
+    """Derive `count` fake images from the collected real ones with the batch engine in MODELS/augment.py"""
+    models_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "MODELS")
+    if models_dir not in sys.path:
+        sys.path.insert(0, models_dir)
+    from augment import save_counterfeits
+    
+    written = save_counterfeits("real_medicines", folder, count, workers=workers)
+    logger.info(f"Generated {written} fake images in {folder}")
+    return written
 
 def main():
+    parser = argparse.ArgumentParser(description="Collect real medicine images and generate fake ones")
+    parser.add_argument("--keywords", nargs="+", default=real_medicine_keywords)
+    parser.add_argument("--source", nargs="+", default=medicine_urls, dest="sources",
+                        help="Search URL templates, with {} where the keyword goes")
+    parser.add_argument("--workers", type=int, default=8, help="Search pages fetched concurrently")
+    parser.add_argument("--host-interval", type=float, default=1.0,
+                        help="Minimum seconds between requests to the same host")
+    parser.add_argument("--per-keyword", type=int, default=5, help="Images per keyword and source")
+    parser.add_argument("--manifest", default=None, help=f"Defaults to real_medicines/{MANIFEST_NAME}")
+    parser.add_argument("--fakes", type=int, default=10, help="Fake images to derive from the real ones")
+    parser.add_argument("--skip-fakes", action="store_true", help="Do not generate fake images")
+    args = parser.parse_args()
+    
+    # Set up logging
+    logging.basicConfig(level=logging.INFO)
+    
+    # Create directories if they don't exist
+    os.makedirs("real_medicines", exist_ok=True)
+    os.makedirs("fake_medicines", exist_ok=True)
+    
     logger.info("Starting image collection...")
     
     # Collect real medicine images
-    for keyword in real_medicine_keywords:
-        logger.info(f"\nSearching for: {keyword}")
-        for url_template in medicine_urls:
-            fetch_images_from_url(url_template, keyword, "real_medicines")
-            time.sleep(random.uniform(2, 3))  # Random delay between URLs
+    collector = Collector("real_medicines", args.manifest, args.workers, args.host_interval, args.per_keyword)
+    stats = collector.collect(args.keywords, args.sources)
+    logger.info(f"Downloads: {stats}")
     
     # Generate fake medicine images
-    logger.info("\nGenerating fake medicine images...")
-    generate_fake_medicine_images()
+    if not args.skip_fakes:
+        logger.info("\nGenerating fake medicine images...")
+        try:
+            generate_fake_medicine_images(args.fakes)
+        except ValueError as e:
+            logger.error(f"Error generating fake images: {str(e)}")
     
     # Print summary
     real_count = len([f for f in os.listdir("real_medicines") if f.endswith(('.jpg', '.jpeg', '.png'))])